@@ -10,6 +10,7 @@ from BroControl import config
 from BroControl import cmdresult
 from BroControl import execute
 from BroControl import control
+from BroControl import cron
 from BroControl import version
 from BroControl import pluginreg
 from BroControl import node as node_mod
@@ -29,7 +30,7 @@ def expose(func):
 
 def lock_required(func):
     def wrapper(self, *args, **kwargs):
-        self.lock()
+        self.lock(command=func.__name__)
         try:
             return func(self, *args, **kwargs)
         finally:
@@ -39,7 +40,43 @@ def lock_required(func):
 
 def lock_required_silent(func):
     def wrapper(self, *args, **kwargs):
-        self.lock(showwait=False)
+        self.lock(showwait=False, command=func.__name__)
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            self.unlock()
+    wrapper.lock_required = True
+    return wrapper
+
+# Like lock_required, but only takes a shared lock (so that several such
+# commands can run at the same time).  This must be used only for commands
+# that don't change any files, Bro processes, or node state.
+def lock_required_shared(func):
+    def wrapper(self, *args, **kwargs):
+        self.lock(command=func.__name__, shared=True)
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            self.unlock()
+    wrapper.lock_required = True
+    return wrapper
+
+# Like lock_required, but for commands operating on the nodes given by the
+# "node_list" argument: only these nodes are locked exclusively (along with
+# a shared lock), so that such commands can run concurrently as long as
+# their nodes are disjoint.
+def lock_required_nodes(func):
+    argnames = func.__code__.co_varnames[1:func.__code__.co_argcount]
+    def wrapper(self, *args, **kwargs):
+        if "node_list" in kwargs:
+            node_list = kwargs["node_list"]
+        elif len(args) > argnames.index("node_list"):
+            node_list = args[argnames.index("node_list")]
+        else:
+            node_list = None
+
+        nodes = [n.name for n in self.node_args(node_list)]
+        self.lock(command=func.__name__, nodes=nodes)
         try:
             return func(self, *args, **kwargs)
         finally:
@@ -95,6 +132,8 @@ class BroCtl(object):
         if self.config.get_state("cronenabled") is None:
             self.config.set_state("cronenabled", True)
 
+        self.config.save_snapshot()
+
     def reload_cfg(self):
         self.config.reload_cfg()
 
@@ -112,6 +151,8 @@ class BroCtl(object):
     def finish(self):
         self.executor.finish()
         self.plugins.finishPlugins()
+        self.config.save_snapshot()
+        self.config.close_state()
 
     def warn_broctl_install(self):
         self.config.warn_broctl_install()
@@ -163,15 +204,22 @@ class BroCtl(object):
 
         return nodes
 
-    def lock(self, showwait=True):
-        lockstatus = lock.lock(self.ui, showwait)
+    def lock(self, showwait=True, command=None, shared=False, nodes=None):
+        lockstatus = lock.lock(self.ui, showwait, shared, nodes)
         if not lockstatus:
             raise LockError("Unable to get lock")
 
         self.config.read_state()
 
+        # All changes of state variables made by a command are written at
+        # once when the lock is released.
+        self.config.begin_state_batch(command)
+
     def unlock(self):
-        lock.unlock(self.ui)
+        try:
+            self.config.end_state_batch()
+        finally:
+            lock.unlock(self.ui)
 
     def node_names(self):
         return [ n.name for n in self.config.nodes() ]
@@ -207,6 +255,12 @@ class BroCtl(object):
         self.plugins.cmdPost("config")
         return results
 
+    @expose
+    @lock_required
+    def clear_config_cache(self):
+        self.config.clear_snapshot()
+        return True
+
     @expose
     @check_config
     @lock_required
@@ -221,7 +275,7 @@ class BroCtl(object):
 
     @expose
     @check_config
-    @lock_required
+    @lock_required_nodes
     def start(self, node_list=None):
         nodes = self.node_args(node_list)
 
@@ -233,7 +287,7 @@ class BroCtl(object):
 
     @expose
     @check_config
-    @lock_required
+    @lock_required_nodes
     def stop(self, node_list=None):
         nodes = self.node_args(node_list)
 
@@ -245,8 +299,20 @@ class BroCtl(object):
 
     @expose
     @check_config
-    @lock_required
     def restart(self, clean=False, node_list=None):
+        # Cleaning up includes installing the config for the whole cluster,
+        # so then the whole cluster is locked.
+        if clean:
+            self.lock(command="restart")
+        else:
+            self.lock(command="restart", nodes=[n.name for n in self.node_args(node_list)])
+
+        try:
+            return self._restart(clean, node_list)
+        finally:
+            self.unlock()
+
+    def _restart(self, clean, node_list):
         nodes = self.node_args(node_list)
 
         nodes = self.plugins.cmdPreWithNodes("restart", nodes, clean)
@@ -317,7 +383,7 @@ class BroCtl(object):
 
     @expose
     @check_config
-    @lock_required
+    @lock_required_shared
     def status(self, node_list=None):
         nodes = self.node_args(node_list)
 
@@ -327,7 +393,7 @@ class BroCtl(object):
         return results
 
     @expose
-    @lock_required
+    @lock_required_shared
     def top(self, node_list=None):
         nodes = self.node_args(node_list)
 
@@ -339,7 +405,7 @@ class BroCtl(object):
 
     @expose
     @check_config
-    @lock_required
+    @lock_required_shared
     def diag(self, node_list=None):
         nodes = self.node_args(node_list)
 
@@ -351,16 +417,20 @@ class BroCtl(object):
 
     @expose
     @lock_required_silent
-    def cron(self, watch=True):
+    def cron(self, watch=True, force=()):
+        for task in force:
+            if task not in cron.TASKS:
+                raise CommandSyntaxError("unknown cron task: %s" % task)
+
         if self.plugins.cmdPre("cron", "", watch):
-            self.controller.cron(watch)
+            self.controller.cron(watch, force)
         self.plugins.cmdPost("cron", "", watch)
 
         return True
 
     @expose
     @check_config
-    @lock_required
+    @lock_required_shared
     def cronenabled(self):
         results = False
         if self.plugins.cmdPre("cron", "?", False):
@@ -411,11 +481,11 @@ class BroCtl(object):
 
     @expose
     @check_config
-    @lock_required
-    def capstats(self, interval=10, node_list=None):
+    @lock_required_shared
+    def capstats(self, interval=10, node_list=None, source=None):
         nodes = self.node_args(node_list)
         nodes = self.plugins.cmdPreWithNodes("capstats", nodes, interval)
-        results = self.controller.capstats(nodes, interval)
+        results = self.controller.capstats(nodes, interval, source)
         self.plugins.cmdPostWithNodes("capstats", nodes, interval)
 
         return results
@@ -433,7 +503,7 @@ class BroCtl(object):
 
     @expose
     @check_config
-    @lock_required
+    @lock_required_shared
     def df(self, node_list=None):
         nodes = self.node_args(node_list, get_hosts=True)
         nodes = self.plugins.cmdPreWithNodes("df", nodes)
@@ -444,7 +514,7 @@ class BroCtl(object):
 
     @expose
     @check_config
-    @lock_required
+    @lock_required_shared
     def print_id(self, id, node_list=None):
         nodes = self.node_args(node_list)
         nodes = self.plugins.cmdPreWithNodes("print", nodes, id)
@@ -455,7 +525,7 @@ class BroCtl(object):
 
     @expose
     @check_config
-    @lock_required
+    @lock_required_shared
     def peerstatus(self, node_list=None):
         nodes = self.node_args(node_list)
         nodes = self.plugins.cmdPreWithNodes("peerstatus", nodes)
@@ -466,7 +536,7 @@ class BroCtl(object):
 
     @expose
     @check_config
-    @lock_required
+    @lock_required_shared
     def netstats(self, node_list=None):
         if not node_list:
             node_list = None
@@ -58,6 +58,7 @@ class BroCtrldWorker(Thread, Common):
     def run(self):
         #FIXME: deepcopy breaks here if i set ui=self
         self.broctl = BroCtl(ui=TermUI())
+        self.broctl.config.watch_cfg_files()
         self.broctl.ui = self
         self.broctl.controller.ui = self
         self.broctl.executor.ui = self
@@ -5,12 +5,17 @@ import os
 import socket
 import subprocess
 import re
+import threading
+import time
 
+from BroControl import filewatch
+from BroControl import ifaddrs
 from BroControl import py3bro
 from BroControl import node as node_mod
 from BroControl import options
+from BroControl import snapshot
 from BroControl.exceptions import ConfigurationError, RuntimeEnvironmentError
-from .state import SqliteState
+from .state import SqliteState, NODE_STATE_COLUMNS
 from .version import VERSION
 
 
@@ -21,13 +26,32 @@ from .version import VERSION
 # - the global broctl configuration from broctl.cfg
 # - the node configuration from node.cfg
 # - dynamic state variables which are kept across restarts in spool/state.db
+#
+# Values that are expensive to determine (e.g. the node addresses, which
+# require DNS lookups) are cached in a snapshot file (spool/config-snapshot.json)
+# and are determined again only if something they depend on has changed.
 
 Config = None # Globally accessible instance of Configuration.
 
+# Name of the snapshot file (in the spool directory).
+SNAPSHOT_FILE = "config-snapshot.json"
+
+# Maximum number of host name lookups that are done in parallel.
+MAX_LOOKUP_THREADS = 16
+
 class NodeStore:
     def __init__(self):
         self.nodestore = {}
-        self.nodenameslower = []
+        self.nodenameslower = {}
+
+        # Indexes of the nodes (each list is sorted by node type and count).
+        # They are built when first needed after a node was added, so that
+        # adding many nodes doesn't sort the nodes each time.
+        self._sorted = None
+        self._bytype = None
+        self._byhost = None
+        self._byaddr = None
+        self._hostnodes = None
 
     def add_node(self, node):
         # Add a node to the nodestore, but first check for duplicate node
@@ -40,15 +64,83 @@ class NodeStore:
         # one (e.g. "worker-1" with lb_procs=2 and "worker-1-2").
         namelower = node.name.lower()
         if namelower in self.nodenameslower:
-            matchname = ""
-            for nn in self.nodestore:
-                if nn.lower() == namelower:
-                    matchname = nn
-                    break
+            matchname = self.nodenameslower[namelower]
             raise ConfigurationError('node name "%s" is a duplicate of "%s"' % (node.name, matchname))
 
         self.nodestore[node.name] = node
-        self.nodenameslower.append(namelower)
+        self.nodenameslower[namelower] = node.name
+        self._sorted = None
+
+    # The nodestore can be read like a dict that maps node names to nodes
+    # (which Configuration.nodestore was in older versions of BroControl).
+    def __len__(self):
+        return len(self.nodestore)
+
+    def __getitem__(self, name):
+        return self.nodestore[name]
+
+    def __contains__(self, name):
+        return name in self.nodestore
+
+    def __iter__(self):
+        return iter(self.nodestore)
+
+    def keys(self):
+        return list(self.nodestore.keys())
+
+    def values(self):
+        return list(self.nodestore.values())
+
+    def items(self):
+        return list(self.nodestore.items())
+
+    # Returns the node with the given name, or the default value if there
+    # is no such node.
+    def get(self, name, default=None):
+        return self.nodestore.get(name, default)
+
+    # Returns a list of all nodes, sorted by node type and count.
+    def sorted_nodes(self):
+        self._build_indexes()
+        return list(self._sorted)
+
+    # Returns a sorted list of all nodes of the given type.
+    def by_type(self, nodetype):
+        self._build_indexes()
+        return list(self._bytype.get(nodetype, ()))
+
+    # Returns a sorted list of all nodes on the given host.
+    def by_host(self, host):
+        self._build_indexes()
+        return list(self._byhost.get(host, ()))
+
+    # Returns a sorted list of all nodes with the given IP address.
+    def by_addr(self, addr):
+        self._build_indexes()
+        return list(self._byaddr.get(addr, ()))
+
+    # Returns a sorted list containing the first node on each host.
+    def host_nodes(self):
+        self._build_indexes()
+        return list(self._hostnodes)
+
+    def _build_indexes(self):
+        if self._sorted is not None:
+            return
+
+        self._sorted = sorted(self.nodestore.values(), key=node_mod.sortnode)
+        self._bytype = {}
+        self._byhost = {}
+        self._byaddr = {}
+        self._hostnodes = []
+
+        for node in self._sorted:
+            self._bytype.setdefault(node.type, []).append(node)
+            self._byaddr.setdefault(node.addr, []).append(node)
+            if node.host not in self._byhost:
+                self._byhost[node.host] = []
+                self._hostnodes.append(node)
+            self._byhost[node.host].append(node)
 
 
 class Configuration:
@@ -61,10 +153,11 @@ class Configuration:
         Config = self
 
         self.config = {}
-        self.state = {}
-        self.nodestore = {}
-
-        self.localaddrs = self._get_local_addrs()
+        self.nodestore = NodeStore()
+        self.snapshot = snapshot.ConfigSnapshot(None)
+        self.filehashes = {}
+        self.cfgwatcher = None
+        self.cfgchanged = None
 
         # Read broctl.cfg.
         self.config = self._read_config(cfgfile)
@@ -72,11 +165,10 @@ class Configuration:
         self._initialize_options()
         self._check_options()
 
-        if state:
-            self.state_store = state
-        else:
-            self.state_store = SqliteState(self.statefile)
+        if not state:
+            state = SqliteState(self.statefile, self.statedbtimeout, not self.havenfs)
 
+        self._init_state(state)
         self.read_state()
         self._update_cfg_state()
 
@@ -87,8 +179,6 @@ class Configuration:
         self._update_cfg_state()
 
     def _initialize_options(self):
-        from BroControl import execute
-
         # Set defaults for options we get passed in.
         self.init_option("brobase", self.basedir)
         self.init_option("broscriptdir", self.broscriptdir)
@@ -104,11 +194,25 @@ class Configuration:
         self.init_option("mailfrom", "Big Brother <bro@%s>" % socket.gethostname())
         self.init_option("mailalarmsto", self.config["mailto"])
 
-        # Determine operating system.
-        success, output = execute.run_localcmd("uname")
-        if not success or not output:
-            raise RuntimeEnvironmentError("failed to run uname: %s" % output)
-        self.init_option("os", output.strip())
+        snapshotfile = os.path.join(self.config["spooldir"], SNAPSHOT_FILE)
+        if self.snapshot.path != snapshotfile:
+            self.snapshot = snapshot.ConfigSnapshot(snapshotfile)
+
+        # Information about the local system is cached until the next reboot
+        # (or until the PATH changes, because we need to find commands).
+        bootkey = [socket.gethostname(), snapshot.boot_id()]
+        syskey = bootkey + [os.getenv("PATH")]
+        sysinfo = self.snapshot.get("sysinfo", syskey)
+        if sysinfo is None:
+            sysinfo = self._get_sysinfo()
+            self.snapshot.set("sysinfo", syskey, sysinfo)
+
+        self.localaddrs = self.snapshot.get("localaddrs", bootkey)
+        if self.localaddrs is None:
+            self.localaddrs = self._get_local_addrs()
+            self.snapshot.set("localaddrs", bootkey, self.localaddrs)
+
+        self.init_option("os", sysinfo["os"])
 
         # Determine the CPU pinning command.
         pin_cmd = ""
@@ -119,6 +223,26 @@ class Configuration:
 
         self.init_option("pin_command", pin_cmd)
 
+        self.init_option("time", sysinfo["time"])
+
+        # Calculate the log expire interval (in minutes).
+        minutes = self._get_interval_minutes("logexpireinterval")
+        self.init_option("logexpireminutes", minutes)
+
+        # Determine the intervals (in minutes) of the cron tasks.
+        self.cronintervals = self._get_cron_intervals()
+
+    # Returns a dictionary with information about the local system that we
+    # get by running external commands.
+    def _get_sysinfo(self):
+        from BroControl import execute
+
+        # Determine operating system.
+        success, output = execute.run_localcmd("uname")
+        if not success or not output:
+            raise RuntimeEnvironmentError("failed to run uname: %s" % output)
+        os_name = output.strip()
+
         # Find the time command (should be a GNU time for best results).
         time_cmd = ""
         success, output = execute.run_localcmd("which time")
@@ -127,11 +251,7 @@ class Configuration:
             # line when alias is defined.
             time_cmd = output.splitlines()[-1].strip()
 
-        self.init_option("time", time_cmd)
-
-        # Calculate the log expire interval (in minutes).
-        minutes = self._get_interval_minutes("logexpireinterval")
-        self.init_option("logexpireminutes", minutes)
+        return {"os": os_name, "time": time_cmd}
 
     # Do a basic sanity check on broctl options.
     def _check_options(self):
@@ -168,6 +288,9 @@ class Configuration:
             if not os.path.isfile(v):
                 raise ConfigurationError('broctl option "%s" file not found: %s' % (f, v))
 
+        if self.config["capstatssource"] not in ("capstats", "counters"):
+            raise ConfigurationError('value of broctl option "capstatssource" is invalid (must be "capstats" or "counters"): %s' % self.config["capstatssource"])
+
         # Verify that logs don't expire more quickly than the rotation interval
         logexpireseconds = 60 * self.config["logexpireminutes"]
         if 0 < logexpireseconds < self.config["logrotationinterval"]:
@@ -176,11 +299,12 @@ class Configuration:
 
     # Convert a time interval string (from the value of the given option name)
     # to an integer number of minutes.
-    def _get_interval_minutes(self, optname):
+    def _get_interval_minutes(self, optname, ss=None):
         # Conversion table for time units to minutes.
         units = {"day": 24*60, "hr": 60, "min": 1}
 
-        ss = self.config[optname]
+        if ss is None:
+            ss = self.config[optname]
         try:
             # If no time unit, assume it's days (for backward compatibility).
             v = int(ss) * units["day"]
@@ -199,9 +323,27 @@ class Configuration:
 
         return v
 
+    # Parse the "crontaskintervals" option, and return a dictionary that maps
+    # the names of cron tasks to their interval in minutes.
+    def _get_cron_intervals(self):
+        from BroControl import cron
+
+        intervals = {}
+        for entry in self.config["crontaskintervals"].split():
+            task, sep, interval = entry.partition("=")
+            if not sep or not interval:
+                raise ConfigurationError('value of broctl option "crontaskintervals" is invalid (entries must be of the form <task>=<interval>): %s' % entry)
+
+            if task not in cron.TASKS:
+                raise ConfigurationError('unknown cron task "%s" in broctl option "crontaskintervals" (must be one of: %s)' % (task, ", ".join(cron.TASKS)))
+
+            intervals[task] = self._get_interval_minutes("crontaskintervals", interval)
+
+        return intervals
+
     def initPostPlugins(self):
         # Read node.cfg
-        self.nodestore = self._read_nodes()
+        self.nodestore = self._load_nodes()
 
         # If "env_vars" was specified in broctl.cfg, then apply to all nodes.
         varlist = self.config.get("env_vars")
@@ -254,15 +396,16 @@ class Configuration:
     # - If tag is the name of a node, then that node is returned.
     def nodes(self, tag=None):
         nodetype = node_mod.group_type(tag)
-        if nodetype == "_ALL_":
-            tag = None
+        if tag is None or nodetype == "_ALL_":
+            return self.nodestore.sorted_nodes()
 
-        nodes = []
-        for n in self.nodestore.values():
-            if nodetype == n.type or tag == n.name or tag is None:
-                nodes += [n]
+        nodes = self.nodestore.by_type(nodetype) if nodetype else []
 
-        nodes.sort(key=node_mod.sortnode)
+        # A node name might also be a group name (e.g. "manager").
+        node = self.nodestore.get(tag)
+        if node and node.type != nodetype:
+            nodes.append(node)
+            nodes.sort(key=node_mod.sortnode)
 
         return nodes
 
@@ -270,9 +413,9 @@ class Configuration:
     # config).  Returns None if neither are available.
     def manager(self):
         if self.config["standalone"]:
-            n = self.nodes()
+            n = self.nodestore.sorted_nodes()
         else:
-            n = self.nodes(node_mod.manager_group())
+            n = self.nodestore.by_type("manager")
 
         if not n:
             return None
@@ -293,17 +436,18 @@ class Configuration:
     # If "exclude_local" is True, then the returned list will not include
     # nodes that are on the local host.
     def hosts(self, tag=None, exclude_local=False):
-        hosts = {}
-        nodelist = []
-        for node in self.nodes(tag):
-            if node.host in hosts:
-                continue
-
-            if exclude_local and node.addr in self.localaddrs:
-                continue
+        if tag is None or node_mod.group_type(tag) == "_ALL_":
+            nodelist = self.nodestore.host_nodes()
+        else:
+            hosts = set()
+            nodelist = []
+            for node in self.nodes(tag):
+                if node.host not in hosts:
+                    hosts.add(node.host)
+                    nodelist.append(node)
 
-            hosts[node.host] = 1
-            nodelist.append(node)
+        if exclude_local:
+            nodelist = [n for n in nodelist if n.addr not in self.localaddrs]
 
         return nodelist
 
@@ -366,6 +510,49 @@ class Configuration:
 
         return env_vars
 
+    # Returns the nodes from node.cfg, either from the snapshot (if node.cfg,
+    # the set of valid node keys, and the local addresses are unchanged, and
+    # the node addresses have not expired), or by parsing node.cfg.
+    def _load_nodes(self):
+        fid = snapshot.file_id(self.nodecfg)
+        key = [self.nodecfg, fid, sorted(node_mod.Node._keys), self.localaddrs] if fid else None
+        cached = self.snapshot.get("nodes", key)
+
+        # The node addresses in the snapshot expire just like those in the
+        # state database.
+        if cached is not None and time.time() - cached["time"] >= self.config["hostlookupttl"]:
+            cached = None
+
+        if cached is None:
+            nodestore = self._read_nodes()
+            nodes = [self._node_attrs(n) for n in nodestore.sorted_nodes()]
+            self.snapshot.set("nodes", key, {"nodes": nodes, "warnings": self._nodewarnings, "time": self._hostlookuptime})
+            return nodestore
+
+        # Repeat any warnings that were output when node.cfg was parsed.
+        for msg in cached["warnings"]:
+            self.ui.warn(msg)
+
+        nodestore = NodeStore()
+        for attrs in cached["nodes"]:
+            node = node_mod.Node(self, attrs.pop("name"), attrs)
+            nodestore.add_node(node)
+
+        return nodestore
+
+    # Returns a dictionary of all node.cfg attributes of a node.
+    def _node_attrs(self, node):
+        return dict((k, v) for (k, v) in node.attrs().items() if not k.startswith("_"))
+
+    # Discard all cached values, so that everything is determined again the
+    # next time broctl starts.
+    def clear_snapshot(self):
+        self.snapshot.clear()
+
+    # Write the snapshot file (if anything has changed).
+    def save_snapshot(self):
+        self.snapshot.save()
+
     # Parse node.cfg.
     def _read_nodes(self):
         config = py3bro.configparser.SafeConfigParser()
@@ -377,10 +564,13 @@ class Configuration:
             raise ConfigurationError(err)
 
         nodestore = NodeStore()
+        self._nodewarnings = []
 
-        counts = {}
+        nodes = []
         for sec in config.sections():
-            node = node_mod.Node(self, sec)
+            # The values from node.cfg are shared by all nodes created from
+            # this section (i.e., with lb_procs).
+            values = {}
 
             # Note that the keys are converted to lowercase by configparser.
             for (key, val) in config.items(sec):
@@ -388,21 +578,107 @@ class Configuration:
                 key = key.replace(".", "_")
 
                 if key not in node_mod.Node._keys:
-                    self.ui.warn("ignoring unrecognized node config option '%s' given for node '%s'" % (key, sec))
+                    msg = "ignoring unrecognized node config option '%s' given for node '%s'" % (key, sec)
+                    self._nodewarnings.append(msg)
+                    self.ui.warn(msg)
                     continue
 
-                node.__dict__[key] = val
+                values[key] = val
+
+            nodes.append(node_mod.Node(self, sec, values))
 
+        # Look up each host name only once (usually, there are many nodes on
+        # the same host).
+        hostaddrs = self._resolve_hosts(set(n.host for n in nodes if n.host))
+
+        counts = {}
+        for node in nodes:
             # Perform a sanity check on the node, and update nodestore.
-            self._check_node(node, nodestore, counts)
+            self._check_node(node, nodestore, counts, hostaddrs)
 
         # Perform a sanity check on the nodestore (make sure we have a valid
         # cluster config, etc.).
-        self._check_nodestore(nodestore.nodestore)
+        self._check_nodestore(nodestore)
+
+        return nodestore
+
+    # Returns a dictionary that maps each of the given host names to either
+    # a list of its addresses, or a ConfigurationError if the lookup failed
+    # (or took longer than HostLookupTimeout seconds).  Addresses are cached
+    # in the state database for HostLookupTTL seconds.  Expired cached
+    # addresses are still used right away, and are looked up again in the
+    # background (see _store_host_lookups()).
+    def _resolve_hosts(self, hosts):
+        ttl = self.config["hostlookupttl"]
+        now = time.time()
+
+        hostaddrs = {}
+        expired = []
+        lookups = []
+        self._hostlookuptime = now
+
+        for host in sorted(hosts):
+            cached = self.state_store.get_host_addrs(host) if ttl > 0 else None
+            if cached:
+                addrs, updated = cached
+                hostaddrs[host] = addrs
+                self._hostlookuptime = min(self._hostlookuptime, updated)
+
+                if now - updated >= ttl:
+                    expired.append(host)
+
+                continue
+
+            lookups.append(host)
+
+        if expired:
+            self.hostlookups.append((_start_lookups(expired), now))
 
-        return nodestore.nodestore
+        results = _lookup_hosts(lookups, self.config["hostlookuptimeout"])
 
-    def _check_node(self, node, nodestore, counts):
+        newentries = []
+        for host in lookups:
+            result = results.get(host)
+
+            if isinstance(result, list):
+                hostaddrs[host] = result
+                newentries.append((host, result, now))
+                continue
+
+            if result is None:
+                msg = "timed out"
+            elif isinstance(result, socket.gaierror):
+                msg = result.args[1]
+            else:
+                msg = str(result) or result.__class__.__name__
+
+            hostaddrs[host] = ConfigurationError("hostname lookup failed for '%s' in node config [%s]" % (host, msg))
+
+        if ttl > 0 and newentries:
+            self.state_store.set_host_addrs(newentries)
+
+        return hostaddrs
+
+    # Store the addresses of the host names which were looked up again in
+    # the background (see _resolve_hosts()) and have been found by now.
+    # Lookups which failed or are still running are ignored, so the expired
+    # addresses remain in use (and are looked up again the next time).
+    def _store_host_lookups(self):
+        entries = []
+        for (done, started) in self.hostlookups:
+            while True:
+                try:
+                    host, result = done.get_nowait()
+                except py3bro.Empty:
+                    break
+
+                if isinstance(result, list):
+                    entries.append((host, result, started))
+
+        if entries:
+            self.state_store.set_host_addrs(entries)
+
+    def _check_node(self, node, nodestore, counts, hostaddrs):
         if not node.type:
             raise ConfigurationError("no type given for node %s" % node.name)
 
@@ -412,12 +688,9 @@ class Configuration:
         if not node.host:
             raise ConfigurationError("no host given for node '%s'" % node.name)
 
-        try:
-            addrinfo = socket.getaddrinfo(node.host, None, 0, 0, socket.SOL_TCP)
-        except socket.gaierror as e:
-            raise ConfigurationError("hostname lookup failed for '%s' in node config [%s]" % (node.host, e.args[1]))
-
-        addrs = [addr[4][0] for addr in addrinfo]
+        addrs = hostaddrs[node.host]
+        if isinstance(addrs, ConfigurationError):
+            raise addrs
 
         # By default, just use the first IP addr in the list.
         addr_str = addrs[0]
@@ -550,9 +823,8 @@ class Configuration:
 
         # If manager is on localhost, then all other nodes must be on localhost
         if manageronlocalhost:
-            for n in nodestore.values():
-                if not node_mod.is_manager(n) and n.addr not in localhostaddrs:
-                    raise ConfigurationError("all nodes must use localhost/127.0.0.1/::1 when manager uses it")
+            if sum(len(nodestore.by_addr(a)) for a in localhostaddrs) != len(nodestore):
+                raise ConfigurationError("all nodes must use localhost/127.0.0.1/::1 when manager uses it")
 
 
     def _to_bool(self, val):
@@ -634,16 +906,154 @@ class Configuration:
             return
 
         self.state[key] = val
-        self.state_store.set(key, val)
+        if self.statebatch:
+            self.statechanges[key] = val
+        else:
+            self.state_store.set(key, val)
 
     # Returns value of state variable, or the specified default value if the
     # state variable is not defined.
     def get_state(self, key, default=None):
         return self.state.get(key.lower(), default)
 
-    # Read dynamic state variables.
+    # Returns the value of a column of the runtime state of a node (see
+    # state.NODE_STATE_COLUMNS), or None if it is not set.
+    def get_node_state(self, name, col):
+        row = self.nodestate.get(name.lower())
+        if not row:
+            return None
+
+        return row[col]
+
+    # Set columns of the runtime state of a node (given as keyword
+    # arguments).  The values are always written (even if they seem to be
+    # unchanged, because another process might have changed them since the
+    # node state was read), but only the given columns are written.
+    def set_node_state(self, name, **values):
+        name = name.lower()
+        row = dict(self.nodestate.get(name) or dict.fromkeys(NODE_STATE_COLUMNS))
+        row.update(values)
+        self.nodestate[name] = row
+
+        if self.statebatch:
+            self.nodestatechanges.setdefault(name, {}).update(values)
+        else:
+            self.state_store.set_node_states([(name, values)])
+
+    # Returns a list of (name, pid, host) tuples of all nodes (including
+    # nodes no longer in the node configuration) that have a PID.
+    def nodes_with_pid(self):
+        self.flush_state()
+        return self.state_store.nodes_with_pid()
+
+    # Returns a set of the (lowercase) names of all nodes that are expected
+    # to be running.
+    def nodes_expected_running(self):
+        self.flush_state()
+        return set(self.state_store.nodes_expected_running())
+
+    # Append an entry for a node to the node journal (see
+    # state.JOURNAL_COLUMNS for the optional column values).  The entry is
+    # written along with the other state changes of the current command.
+    def add_journal_entry(self, node, event, **values):
+        entry = {"time": time.time(), "cmdid": self.cmdid, "command": self.command,
+                 "node": node.name, "type": node.type, "event": event}
+        entry.update(values)
+
+        if self.statebatch:
+            self.journalentries.append(entry)
+        else:
+            self.state_store.add_journal([entry])
+
+    def _init_state(self, state_store):
+        self.state_store = state_store
+        self.state = {}
+        self.stateversion = None
+        self.nodestate = {}
+        self.nodestateversion = None
+        self.statebatch = 0
+        self.statechanges = {}
+        self.nodestatechanges = {}
+        self.journalentries = []
+        self.cmdid = None
+        self.command = None
+
+        # The host name lookups running in the background, as (queue of the
+        # results, start time) tuples (see _resolve_hosts()).
+        self.hostlookups = []
+
+    # Read dynamic state variables and the node state.  Only the values
+    # that were changed since they were last read are read again, and
+    # nothing at all is read if nothing has changed.
     def read_state(self):
-        self.state = dict(self.state_store.items())
+        items, self.stateversion = self.state_store.changes(self.stateversion)
+        self.state.update(items)
+
+        rows, self.nodestateversion = self.state_store.node_changes(self.nodestateversion)
+        self.nodestate.update(rows)
+
+        # Changes not yet written to the state database are still valid.
+        self.state.update(self.statechanges)
+        for (name, values) in self.nodestatechanges.items():
+            row = dict(self.nodestate.get(name) or dict.fromkeys(NODE_STATE_COLUMNS))
+            row.update(values)
+            self.nodestate[name] = row
+
+    # Write the buffered changes to the state database (they are committed
+    # only at the end of the current batch).
+    def _write_state_changes(self):
+        changes = self.statechanges
+        nodechanges = self.nodestatechanges
+        entries = self.journalentries
+        self.statechanges = {}
+        self.nodestatechanges = {}
+        self.journalentries = []
+
+        self.state_store.set_many(sorted(changes.items()))
+        self.state_store.set_node_states(sorted(nodechanges.items()))
+        self.state_store.add_journal(entries)
+        self._store_host_lookups()
+
+    # Write the buffered changes and commit them right away, even in the
+    # middle of a batch, so that they are not lost if broctl is terminated
+    # and the state database is not locked until the end of the batch.
+    def flush_state(self):
+        self._write_state_changes()
+        self.state_store.flush()
+
+    # Close the state database.  This must be called only after all state
+    # variables are written.
+    def close_state(self):
+        self._store_host_lookups()
+        self.state_store.close()
+
+    # Start buffering changes of state variables, so that they are written
+    # to the state database in one transaction when end_state_batch() is
+    # called (usually once per broctl command).  Batches can be nested.
+    # The outermost batch gets a new command ID (recorded in the node
+    # journal along with the name of the command).
+    def begin_state_batch(self, command=None):
+        if not self.statebatch:
+            self.state_store.begin()
+            self.cmdid = "%.6f-%d" % (time.time(), os.getpid())
+            self.command = command
+
+        self.statebatch += 1
+
+    def end_state_batch(self):
+        if not self.statebatch:
+            return
+
+        self.statebatch -= 1
+        if self.statebatch:
+            return
+
+        try:
+            self._write_state_changes()
+        finally:
+            self.state_store.commit()
+            self.cmdid = None
+            self.command = None
 
     # Use the ifconfig command to find local IP addrs.
     def _get_local_addrs_ifconfig(self):
@@ -744,6 +1154,11 @@ class Configuration:
     # Return a list of the IP addresses associated with local interfaces.
     # For IPv6 addresses, zone_id and prefix length are removed if present.
     def _get_local_addrs(self):
+        # Try to get the addresses without running external commands first.
+        localaddrs = ifaddrs.get_local_addrs()
+        if localaddrs:
+            return localaddrs
+
         # ifconfig is more portable so try it first
         localaddrs = self._get_local_addrs_ifconfig()
 
@@ -778,6 +1193,22 @@ class Configuration:
 
     # Returns True if the broctl config files have changed since last reload.
     def is_cfg_changed(self):
+        statekey = (self.state.get("configchksum"), self.state.get("confignodechksum"))
+
+        # If the config files are watched, then the previous result is still
+        # valid as long as neither the files nor the state have changed.
+        if self.cfgwatcher:
+            if self.cfgwatcher.paths != [self.cfgfile, self.nodecfg]:
+                self.watch_cfg_files()
+
+            if not self.cfgwatcher.changed() and self.cfgchanged and self.cfgchanged[0] == statekey:
+                return self.cfgchanged[1]
+
+        changed = self._is_cfg_changed()
+        self.cfgchanged = (statekey, changed)
+        return changed
+
+    def _is_cfg_changed(self):
         try:
             if "configchksum" in self.state:
                 if self.state["configchksum"] != self._get_broctlcfg_hash(filehash=True):
@@ -792,6 +1223,15 @@ class Configuration:
 
         return False
 
+    # Use inotify (if available) to find out when the config files change,
+    # so that is_cfg_changed() doesn't need to look at the files each time.
+    # This is useful only for long-running processes.
+    def watch_cfg_files(self):
+        if self.cfgwatcher:
+            self.cfgwatcher.close()
+
+        self.cfgwatcher = filewatch.watch([self.cfgfile, self.nodecfg])
+
     # Check if the user has already run the "install" or "deploy" commands.
     def is_broctl_installed(self):
         return os.path.isfile(os.path.join(self.config["policydirsiteinstallauto"], "broctl-config.bro"))
@@ -858,20 +1298,8 @@ class Configuration:
             # node names from the state db (which is lowercase).
             nodes[n.name.lower()] = n.host
 
-        for key in self.state.keys():
-            # Look for a PID associated with a Bro node
-            if not key.endswith("-pid"):
-                continue
-
-            pid = self.get_state(key)
-            if not pid:
-                continue
-
-            # Get node name and host name for this node
-            nname = key[:-4]
-            hostkey = key.replace("-pid", "-host")
-            hname = self.get_state(hostkey)
-            if not hname:
+        for (nname, pid, hname) in self.nodes_with_pid():
+            if not pid or not hname:
                 continue
 
             # If node is not a known node or if host has changed, then
@@ -879,44 +1307,52 @@ class Configuration:
             if nname not in nodes or hname != nodes[nname]:
                 self.ui.warn('Bro node "%s" possibly still running on host "%s" (PID %s)' % (nname, hname, pid))
                 # Set the "expected running" flag to False so cron doesn't try
-                # to start this node.
-                expectkey = key.replace("-pid", "-expect-running")
-                self.set_state(expectkey, False)
-                # Clear the PID so we don't keep getting warnings.
-                self.set_state(key, None)
+                # to start this node, and clear the PID so we don't keep
+                # getting warnings.
+                self.set_node_state(nname, expect_running=False, pid=None)
+
+    # Return a hash value (as a string) of the contents of a file.  The hash
+    # is cached (in memory and in the snapshot), and computed again only if
+    # the (dev, inode, size, mtime) of the file changed.
+    def _get_file_hash(self, fname):
+        fid = snapshot.file_id(fname)
+
+        if fid:
+            cached = self.filehashes.get(fname)
+            if cached and cached[0] == fid:
+                return cached[1]
+
+        key = [fname, fid] if fid else None
+        name = "filehash-%s" % fname
+
+        hexdigest = self.snapshot.get(name, key)
+        if hexdigest is None:
+            with open(fname, "r") as ff:
+                hexdigest = _get_hash(ff.read())
+            self.snapshot.set(name, key, hexdigest)
+
+        if fid:
+            self.filehashes[fname] = (fid, hexdigest)
+
+        return hexdigest
 
     # Return a hash value (as a string) of the current broctl configuration.
     def _get_broctlcfg_hash(self, filehash=False):
         if filehash:
-            with open(self.cfgfile, "r") as ff:
-                data = ff.read()
-        else:
-            data = str(sorted(self.config.items()))
-
-        if py3bro.using_py3:
-            data = data.encode()
+            return self._get_file_hash(self.cfgfile)
 
-        hh = hashlib.sha1()
-        hh.update(data)
-        return hh.hexdigest()
+        return _get_hash(str(sorted(self.config.items())))
 
     # Return a hash value (as a string) of the current broctl node config.
     def _get_nodecfg_hash(self, filehash=False):
         if filehash:
-            with open(self.nodecfg, "r") as ff:
-                data = ff.read()
-        else:
-            nn = []
-            for n in self.nodes():
-                nn.append(tuple([(key, val) for key, val in n.items() if not key.startswith("_")]))
-            data = str(nn)
+            return self._get_file_hash(self.nodecfg)
 
-        if py3bro.using_py3:
-            data = data.encode()
+        nn = []
+        for n in self.nodes():
+            nn.append(tuple([(key, val) for key, val in n.items() if not key.startswith("_")]))
 
-        hh = hashlib.sha1()
-        hh.update(data)
-        return hh.hexdigest()
+        return _get_hash(str(nn))
 
     # Update the stored hash value of the current broctl config.
     def update_cfg_hash(self):
@@ -926,14 +1362,29 @@ class Configuration:
         self.set_state("hash-broctlcfg", cfghash)
         self.set_state("hash-nodecfg", nodehash)
 
-    # Runs Bro to get its version number.
+    # Returns the version number of Bro.  The version is cached in the
+    # snapshot, and Bro is run again only if the Bro binary or the Bro
+    # plugins (which Bro loads when it starts) have changed.
     def _get_bro_version(self):
-        from BroControl import execute
-
         bro = self.config["bro"]
         if not os.path.lexists(bro):
             raise ConfigurationError("cannot find Bro binary: %s" % bro)
 
+        fid = snapshot.file_id(bro)
+        pluginpath = os.getenv("BRO_PLUGIN_PATH")
+        plugindirs = [self.config["pluginbrodir"]] + (pluginpath.split(":") if pluginpath else [])
+        key = [bro, fid, [snapshot.dir_id(d) for d in plugindirs]] if fid else None
+        version = self.snapshot.get("broversion", key)
+        if version is None:
+            version = self._run_bro_version(bro)
+            self.snapshot.set("broversion", key, version)
+
+        return version
+
+    # Runs Bro to get its version number.
+    def _run_bro_version(self, bro):
+        from BroControl import execute
+
         version = ""
         success, output = execute.run_localcmd("%s -v" % bro)
         if success and output:
@@ -957,6 +1408,83 @@ class Configuration:
         return version
 
 
+# Start looking up the addresses of the given host names in parallel.
+# Returns a queue that receives a (host, result) tuple for each host name
+# once its lookup is done, where "result" is either a list of addresses or
+# the exception of a failed lookup (usually socket.gaierror).
+def _start_lookups(hosts):
+    todo = py3bro.Queue()
+    done = py3bro.Queue()
+
+    for host in hosts:
+        todo.put(host)
+
+    # The threads might still be running when the interpreter shuts down
+    # (and module globals are gone), so they must not use any globals.
+    empty = py3bro.Empty
+    getaddrinfo = socket.getaddrinfo
+    sol_tcp = socket.SOL_TCP
+
+    def lookup():
+        while True:
+            try:
+                host = todo.get_nowait()
+            except empty:
+                return
+
+            try:
+                addrinfo = getaddrinfo(host, None, 0, 0, sol_tcp)
+                done.put((host, [ai[4][0] for ai in addrinfo]))
+            except Exception as err:
+                # Any exception must be reported, otherwise we would wait
+                # for this host until the timeout.
+                done.put((host, err))
+
+    for i in range(min(len(hosts), MAX_LOOKUP_THREADS)):
+        # Daemon threads, so that a hanging lookup doesn't keep us running.
+        thread = threading.Thread(target=lookup)
+        thread.daemon = True
+        thread.start()
+
+    return done
+
+
+# Look up the addresses of the given host names in parallel.  Returns a
+# dictionary that maps each host name to the result of its lookup (see
+# _start_lookups()).  If the lookups take longer than "timeout" seconds,
+# then we stop waiting for them and the remaining host names are missing
+# from the result.
+def _lookup_hosts(hosts, timeout):
+    done = _start_lookups(hosts)
+
+    results = {}
+    deadline = time.time() + timeout
+
+    while len(results) < len(hosts):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+
+        try:
+            host, result = done.get(True, remaining)
+        except py3bro.Empty:
+            break
+
+        results[host] = result
+
+    return results
+
+
+# Return the SHA1 hash value (as a string) of a string.
+def _get_hash(data):
+    if py3bro.using_py3:
+        data = data.encode()
+
+    hh = hashlib.sha1()
+    hh.update(data)
+    return hh.hexdigest()
+
+
 # Check if a string is a valid representation of an IP address or not.
 def _is_valid_addr(ipstr):
     try:
@@ -16,6 +16,9 @@ from BroControl import cron
 from BroControl import node as node_mod
 from BroControl import cmdresult
 
+# The time (in seconds) over which the CPU usage of the Bro processes is
+# measured on Linux (see get_top_output()).
+TOP_INTERVAL = 1
 
 # Waits for the nodes' Bro processes to reach the given status.
 # Build the Bro parameters for the given node. Include
@@ -105,6 +108,82 @@ def fmttime(t):
     return time.strftime(config.Config.timefmt, time.localtime(float(t)))
 
 
+# Parse a line of capstats output (e.g., "1186620936.890567 pkts=12747
+# kpps=1.3 kbytes=10807 mbps=8.8 ...") into a dictionary mapping the tags to
+# their values.  Raises ValueError if the line cannot be parsed.
+def _capstats_values(line):
+    fields = line.split()[1:]
+    if not fields:
+        raise ValueError("no fields")
+
+    vals = {}
+    for field in fields:
+        key, val = field.split("=")
+        vals[key] = float(val)
+
+    return vals
+
+
+# Compute the same tags as capstats reports (apart from the per-protocol
+# packet counts) from the two samples of the packet counters of an
+# interface output by the "ifstats" helper.  Raises ValueError if the output
+# cannot be parsed, or if the counters were reset in between.
+def _counter_stats(output):
+    lines = output.splitlines()
+    if len(lines) != 2:
+        raise ValueError("expected two samples")
+
+    (t1, pkts1, bytes1, dropped1, missed1, lost1) = [float(v) for v in lines[0].split()]
+    (t2, pkts2, bytes2, dropped2, missed2, lost2) = [float(v) for v in lines[1].split()]
+
+    secs = t2 - t1
+    pkts = pkts2 - pkts1
+    nbytes = bytes2 - bytes1
+    drops = (dropped2 + missed2 + lost2) - (dropped1 + missed1 + lost1)
+
+    if secs <= 0 or pkts < 0 or nbytes < 0 or drops < 0:
+        raise ValueError("counters were reset")
+
+    return {"pkts": pkts,
+            "kpps": round(pkts / secs / 1000.0, 1),
+            "kbytes": float(int(nbytes / 1024)),
+            "mbps": round(nbytes * 8 / secs / 1e6, 1),
+            "nic_pkts": pkts,
+            "nic_drops": drops}
+
+
+# Parse the output of the "proc-stats" helper into a dictionary that maps
+# PIDs to dicts with the tags described at get_top_output() (and "ppid").
+# Raises KeyError, IndexError, or ValueError if the output cannot be parsed.
+def _parse_proc_stats(output):
+    procs = {}
+
+    for line in output.splitlines():
+        fields = line.split()
+
+        if fields[0] == "proc":
+            pid = int(fields[1])
+            d = {"pid": pid, "ppid": int(fields[2]),
+                 "vsize": int(fields[3]), "rss": int(fields[4]),
+                 "cpu": str(int(round(float(fields[5])))),
+                 "cswch": float(fields[6]), "nvcswch": float(fields[7]),
+                 "cmd": " ".join(fields[10:]), "threads": []}
+
+            if fields[8] != "-" and fields[9] != "-":
+                d["rdbytes"] = float(fields[8])
+                d["wrbytes"] = float(fields[9])
+
+            procs[pid] = d
+
+        elif fields[0] == "thread":
+            procs[int(fields[1])]["threads"].append({"tid": int(fields[2]), "cpu": float(fields[3]), "name": " ".join(fields[4:])})
+
+        else:
+            raise ValueError("unexpected line: %s" % line)
+
+    return procs
+
+
 class Controller:
     def __init__(self, config, ui, executor, pluginregistry):
         self.config = config
@@ -173,7 +252,9 @@ class Controller:
             self.ui.info("creating crash report for previously crashed nodes: %s" % ", ".join([n.name for n in crashed]))
             self._make_crash_reports(crashed)
 
-        # Make working directories.
+        # Make working directories.  The commands for all nodes run in
+        # parallel, so the durations of the phases are those of all nodes.
+        starttime = time.time()
         dirs = [(node, node.cwd()) for node in nodes]
         nodes = []
         for (node, success, output) in self.executor.mkdirs(dirs):
@@ -182,6 +263,10 @@ class Controller:
             else:
                 self.ui.error("cannot create working directory for %s" % node.name)
                 results.set_node_fail(node)
+                self.config.add_journal_entry(node, "start-failed")
+
+        mkdirtime = time.time()
+        phases = {"mkdir": mkdirtime - starttime}
 
         # Start Bro process.
         cmds = []
@@ -197,13 +282,14 @@ class Controller:
             cmds += [(node, "start", envs + [node.cwd(), str(pin_cpu)] + _make_bro_params(node, True))]
 
         nodes = []
+        failed = []
         # Note: the shell is used to interpret the command because broargs
         # might contain quoted arguments.
         for (node, success, output) in self.executor.run_helper(cmds, shell=True):
             if success:
                 if not output:
                     self.ui.error("failed to get PID of %s" % node.name)
-                    results.set_node_fail(node)
+                    failed += [node]
                     continue
 
                 pidstr = output.splitlines()[0]
@@ -211,22 +297,35 @@ class Controller:
                     pid = int(pidstr)
                 except ValueError:
                     self.ui.error("invalid PID for %s: %s" % (node.name, pidstr))
-                    results.set_node_fail(node)
+                    failed += [node]
                     continue
 
                 nodes += [node]
                 node.setPID(pid)
             else:
                 self.ui.error('cannot start %s; check output of "diag"' % node.name)
-                results.set_node_fail(node)
+                failed += [node]
                 if output:
                     self.ui.error(output)
 
+        # Don't lose the PIDs if broctl is terminated before the end of the
+        # command (all of them are written in one transaction).
+        if nodes:
+            self.config.flush_state()
+
+        spawntime = time.time()
+        phases["spawn"] = spawntime - mkdirtime
+
+        for node in failed:
+            results.set_node_fail(node)
+            self.config.add_journal_entry(node, "start-failed", **phases)
+
         # Check whether processes did indeed start up.
         hanging = []
         running = []
+        reached = {}
 
-        for (node, success) in self._waitforbros(nodes, "RUNNING", 3, True):
+        for (node, success) in self._waitforbros(nodes, "RUNNING", 3, True, reached):
             if success:
                 running += [node]
             else:
@@ -242,6 +341,7 @@ class Controller:
                 self.ui.info('%s terminated immediately after starting; check output with "diag"' % node.name)
                 node.clearPID()
                 results.set_node_fail(node)
+                self.config.add_journal_entry(node, "start-failed", **phases)
             else:
                 self.ui.info("(%s still initializing)" % node.name)
                 running += [node]
@@ -250,8 +350,21 @@ class Controller:
             self._log_action(node, "started")
             results.set_node_success(node)
 
+            # The time needed to reach the RUNNING state is unknown for nodes
+            # still initializing.
+            if node.name in reached:
+                runningtime = reached[node.name] - spawntime
+            else:
+                runningtime = None
+
+            self.config.add_journal_entry(node, "started", running=runningtime, **phases)
+
         return results
 
+    # Returns a list of (node, isrunning) tuples.  If "setcrashed" is True,
+    # then nodes whose Bro process has terminated are marked as crashed,
+    # which changes the node state (so this must not be done by commands
+    # that hold only a shared lock).
     def _isrunning(self, nodes, setcrashed=True):
 
         results = []
@@ -281,10 +394,14 @@ class Controller:
                     # Grmpf. It crashed.
                     node.clearPID()
                     node.setCrashed()
+                    self.config.add_journal_entry(node, "crashed")
 
         return results
 
-    def _waitforbros(self, nodes, status, timeout, ensurerunning):
+    # Wait until the given nodes reach the given status.  If "reached" is a
+    # dictionary, then the time at which each node reached the status is
+    # stored in it (indexed by node name).
+    def _waitforbros(self, nodes, status, timeout, ensurerunning, reached=None):
         # If ensurerunning is true, process must still be running.
         if ensurerunning:
             running = self._isrunning(nodes)
@@ -323,6 +440,8 @@ class Controller:
                         # Status reached. Cool.
                         del todo[node.name]
                         results += [(node, True)]
+                        if reached is not None:
+                            reached[node.name] = time.time()
                 else:
                     # Something's wrong. We give up on that node.
                     del todo[node.name]
@@ -471,6 +590,7 @@ class Controller:
             return self.executor.run_helper(cmds)
 
         # Stop nodes.
+        termtime = time.time()
         for (node, success, output) in stop(running, 15):
             if not success:
                 # Give up on this node.  Most likely either we cannot connect
@@ -478,6 +598,7 @@ class Controller:
                 self.ui.error("unable to stop %s: %s" % (node.name, output))
                 results.set_node_fail(node)
                 running.remove(node)
+                self.config.add_journal_entry(node, "stop-failed")
 
         if running:
             time.sleep(1)
@@ -485,7 +606,8 @@ class Controller:
         # Check whether they terminated.
         terminated = []
         kill = []
-        for (node, success) in self._waitforbros(running, "TERMINATED", self.config.stoptimeout, False):
+        reached = {}
+        for (node, success) in self._waitforbros(running, "TERMINATED", self.config.stoptimeout, False, reached):
             if not success:
                 # Check whether it crashed during shutdown ...
                 result = self._isrunning([node])
@@ -522,6 +644,7 @@ class Controller:
                     del todo[node.name]
                     terminated += [node]
                     results.set_node_success(node)
+                    reached.setdefault(node.name, time.time())
 
             if not todo:
                 # All done.
@@ -537,6 +660,7 @@ class Controller:
 
         for node in todo.values():
             results.set_node_fail(node)
+            self.config.add_journal_entry(node, "stop-failed", killed=node in kill)
 
         # Do post-terminate cleanup for those which terminated gracefully.
         cleanup = [node for node in terminated if not node.hasCrashed()]
@@ -548,13 +672,21 @@ class Controller:
 
             cmds += [(node, postterminate, [node.type, node.cwd(), crashflag])]
 
-        for (node, success, output) in self.executor.run_cmds(cmds):
+        posttime = time.time()
+        postresults = self.executor.run_cmds(cmds)
+        postduration = time.time() - posttime
+
+        for (node, success, output) in postresults:
             if success:
                 self._log_action(node, "stopped")
+                event = "stopped"
             else:
                 self.ui.error("error running post-terminate for %s:\n%s" % (node.name, output))
                 self._log_action(node, "stopped (failed)")
+                event = "stop-failed"
 
+            self.config.add_journal_entry(node, event, terminate=reached[node.name] - termtime,
+                                          postterminate=postduration, killed=node in kill)
             node.clearPID()
             node.clearCrashed()
 
@@ -570,7 +702,9 @@ class Controller:
         if showall:
             self.ui.info("Getting process status ...")
 
-        nodestatus = self._isrunning(nodes)
+        # The status command holds only a shared lock, so it must not change
+        # the node state (a crashed node is only reported as such).
+        nodestatus = self._isrunning(nodes, setcrashed=False)
         running = []
 
         cmds = []
@@ -626,7 +760,10 @@ class Controller:
 
             if isrunning:
                 node_info["status"] = statuses[node.name]
-            elif node.hasCrashed():
+            elif node.hasCrashed() or node.getPID():
+                # A node that still has a PID but isn't running has crashed
+                # (it is marked as crashed by the next command that takes
+                # an exclusive lock of the node).
                 node_info["status"] = "crashed"
 
             if isrunning:
@@ -678,6 +815,11 @@ class Controller:
 
             nodes += [(node, cwd)]
 
+        # The auto-generated scripts are the same for all nodes, so we
+        # generate them only once and then link them into the other
+        # nodes' directories.
+        gendir = None
+
         cmds = []
         for (node, cwd) in nodes:
 
@@ -686,16 +828,23 @@ class Controller:
             installed_policies = "1" if installed else "0"
             print_scripts = "1" if list_scripts else "0"
 
-            if not install.make_layout(cwd, self.ui, True):
-                results.ok = False
-                return results
-            if not install.make_local_networks(cwd, self.ui):
-                results.ok = False
-                return results
+            if gendir:
+                if not self._link_generated(gendir, cwd):
+                    results.ok = False
+                    return results
+            else:
+                if not install.make_layout(cwd, self.ui, True):
+                    results.ok = False
+                    return results
+                if not install.make_local_networks(cwd, self.ui, True):
+                    results.ok = False
+                    return results
 
-            if not install.make_broctl_config_policy(cwd, self.ui, self.pluginregistry):
-                results.ok = False
-                return results
+                if not install.make_broctl_config_policy(cwd, self.ui, self.pluginregistry):
+                    results.ok = False
+                    return results
+
+                gendir = cwd
 
             cmd = os.path.join(self.config.scriptsdir, "check-config") + " %s %s %s %s" % (installed_policies, print_scripts, cwd, " ".join(_make_bro_params(node, False)))
             cmd += " broctl/check"
@@ -712,8 +861,25 @@ class Controller:
 
         return results
 
+    # Hard link (or copy, if linking fails) the files from "srcdir" to
+    # "dstdir".  Returns True on success.
+    def _link_generated(self, srcdir, dstdir):
+        for name in os.listdir(srcdir):
+            src = os.path.join(srcdir, name)
+            dst = os.path.join(dstdir, name)
+            try:
+                try:
+                    os.link(src, dst)
+                except OSError:
+                    shutil.copy2(src, dst)
+            except (IOError, OSError) as err:
+                self.ui.error("failed to copy file: %s" % err)
+                return False
+
+        return True
+
     def _query_peerstatus(self, nodes):
-        running = self._isrunning(nodes)
+        running = self._isrunning(nodes, setcrashed=False)
 
         eventlist = []
         for (node, isrunning) in running:
@@ -796,11 +962,12 @@ class Controller:
 
         return results
 
-    def capstats(self, nodes, interval):
+    def capstats(self, nodes, interval, source=None):
         results = cmdresult.CmdResult()
 
-        if self.config.capstatspath:
-            for (node, netif, success, vals) in self.get_capstats_output(nodes, interval):
+        source = source or self.config.capstatssource
+        if source == "counters" or self.config.capstatspath:
+            for (node, netif, success, vals) in self.get_capstats_output(nodes, interval, source=source):
                 if not success:
                     vals = {"output": vals}
                 results.set_node_data(node, success, vals)
@@ -820,7 +987,13 @@ class Controller:
     # If there is more than one node, then the results will also contain
     # one "pseudo-node" of the name "$total" with the sum of all individual
     # values.
-    def get_capstats_output(self, nodes, interval):
+    #
+    # The traffic is measured for "interval" seconds, with capstats, or from
+    # the packet counters of the interfaces if "source" (by default, the
+    # CapstatsSource option) is "counters".  The commands are run with the
+    # given executor, if any (e.g., so that cron can run other commands on
+    # the hosts in the meantime).
+    def get_capstats_output(self, nodes, interval, executor=None, source=None):
         results = []
 
         # Construct a list of (node, interface) tuples, one tuple for each
@@ -838,10 +1011,18 @@ class Controller:
             if hosts.setdefault((node.addr, netif), node) == node:
                 nodenetifs.append((node, netif))
 
-        capstats = self.config.capstatspath
-        cmds = [(node, capstats, ["-I", str(interval), "-n", "1", "-i", interface]) for (node, interface) in nodenetifs]
+        executor = executor or self.executor
+        counters = (source or self.config.capstatssource) == "counters"
 
-        outputs = self.executor.run_cmds(cmds)
+        if counters:
+            cmds = [(node, "ifstats", [str(interval), interface]) for (node, interface) in nodenetifs]
+            outputs = executor.run_helper(cmds)
+            tool = "ifstats"
+        else:
+            capstats = self.config.capstatspath
+            cmds = [(node, capstats, ["-I", str(interval), "-n", "1", "-i", interface]) for (node, interface) in nodenetifs]
+            outputs = executor.run_cmds(cmds)
+            tool = "capstats"
 
         totals = {}
 
@@ -855,38 +1036,27 @@ class Controller:
 
             if not success:
                 if output:
-                    results += [(node, netif, False, "%s: capstats failed (%s)" % (node.name, outputline))]
+                    results += [(node, netif, False, "%s: %s failed (%s)" % (node.name, tool, outputline))]
                 else:
-                    results += [(node, netif, False, "%s: cannot execute capstats" % node.name)]
+                    results += [(node, netif, False, "%s: cannot execute %s" % (node.name, tool))]
                 continue
 
             if not output:
-                results += [(node, netif, False, "%s: no capstats output" % node.name)]
+                results += [(node, netif, False, "%s: no %s output" % (node.name, tool))]
                 continue
 
-            fields = outputline.split()[1:]
-
-            if not fields:
-                results += [(node, netif, False, "%s: unexpected capstats output: %s" % (node.name, outputline))]
-                continue
-
-            vals = {}
-
             try:
-                for field in fields:
-                    key, val = field.split("=")
-                    val = float(val)
-                    vals[key] = val
-
-                    if key in totals:
-                        totals[key] += val
-                    else:
-                        totals[key] = val
-
+                if counters:
+                    vals = _counter_stats(output)
+                else:
+                    vals = _capstats_values(outputline)
             except ValueError:
-                results += [(node, netif, False, "%s: unexpected capstats output: %s" % (node.name, outputline))]
+                results += [(node, netif, False, "%s: unexpected %s output: %s" % (node.name, tool, outputline))]
                 continue
 
+            for (key, val) in vals.items():
+                totals[key] = totals.get(key, 0.0) + val
+
             results += [(node, netif, True, vals)]
 
         # Add pseudo-node for totals
@@ -956,6 +1126,9 @@ class Controller:
     # where diskinfo is a list of the form DiskInfo named tuple objects (fs,
     # total, used, avail, percent) or ["FAIL", <error message>] if an error
     # is encountered.
+    #
+    # The df helper is run only once per host, for the paths of all nodes on
+    # that host, and each file system is reported only once per node.
     def df(self, nodes):
         results = cmdresult.CmdResult()
 
@@ -964,30 +1137,63 @@ class Controller:
                 "policydir", "libdir", "tmpdir", "staticdir", "scriptsdir")
 
         df = {}
+        nodepaths = {}
+        hostpaths = {}
+        cmds = []
+
         for node in nodes:
             df[node.name] = {}
+            nodepaths[node.name] = []
 
-        cmds = []
-        for node in nodes:
             for key in dirs:
                 if key == "logdir" and not (node_mod.is_logger(node) or node_mod.is_manager(node) or node_mod.is_standalone(node)):
                     # Don't need to check this on nodes that don't write logs.
                     continue
 
-                path = self.config.config[key]
+                nodepaths[node.name].append(self.config.config[key])
+
+            if node.host not in hostpaths:
+                hostpaths[node.host] = []
+                cmds += [(node, "df", hostpaths[node.host])]
 
-                cmds += [(node, "df", [path])]
+            for path in nodepaths[node.name]:
+                if path not in hostpaths[node.host]:
+                    hostpaths[node.host].append(path)
+
+        # Maps each host to a dict which maps the paths to their DiskInfo
+        # (or None for NFS mounted volumes, or an error message if the path
+        # cannot be checked), or to an error message.
+        usage = {}
 
         for (node, success, output) in self.executor.run_helper(cmds):
-            if success:
-                fields = output.split()
-                if len(fields) != 4:
-                    df[node.name]["FAIL"] = "wrong number of fields from df helper"
+            paths = hostpaths[node.host]
+
+            if not success:
+                usage[node.host] = output if output else "no output"
+                continue
+
+            lines = output.splitlines()
+            if len(lines) != len(paths):
+                usage[node.host] = "wrong number of lines from df helper"
+                continue
+
+            usage[node.host] = {}
+
+            for (path, line) in zip(paths, lines):
+                # An error affects only this path.
+                if line.startswith("error: "):
+                    usage[node.host][path] = line[len("error: "):]
                     continue
 
+                fields = line.split()
+                if len(fields) != 4:
+                    usage[node.host] = "wrong number of fields from df helper"
+                    break
+
                 fs = fields[0]
                 # Ignore NFS mounted volumes.
                 if not fs.startswith("/") and ":" in fs:
+                    usage[node.host][path] = None
                     continue
 
                 try:
@@ -995,15 +1201,25 @@ class Controller:
                     used = float(fields[2])
                     avail = float(fields[3])
                 except ValueError as err:
-                    df[node.name]["FAIL"] = "bad output from df helper: %s" % err
-                    continue
+                    usage[node.host] = "bad output from df helper: %s" % err
+                    break
 
                 perc = used * 100.0 / (used + avail)
-                df[node.name][fs] = DiskInfo(fs, total, used, avail, perc)
-            else:
-                df[node.name]["FAIL"] = output if output else "no output"
+                usage[node.host][path] = DiskInfo(fs, total, used, avail, perc)
 
         for node in nodes:
+            hostusage = usage.get(node.host, "no output")
+
+            if isinstance(hostusage, dict):
+                for path in nodepaths[node.name]:
+                    diskinfo = hostusage[path]
+                    if isinstance(diskinfo, DiskInfo):
+                        df[node.name][diskinfo.fs] = diskinfo
+                    elif diskinfo is not None:
+                        df[node.name]["FAIL"] = diskinfo
+            else:
+                df[node.name]["FAIL"] = hostusage
+
             success = "FAIL" not in df[node.name]
             results.set_node_data(node, success, df[node.name])
 
@@ -1013,12 +1229,99 @@ class Controller:
     # an error message string, or None if there was no error.  'vals' is a list
     # of dicts which map tags to their values.  Tags are "pid", "proc", "vsize",
     # "rss", "cpu", and "cmd".
-    def get_top_output(self, nodes):
+    #
+    # On Linux, the processes are sampled from /proc, and the CPU usage is
+    # measured over TOP_INTERVAL seconds.  The additional tags are "cswch"
+    # and "nvcswch" (voluntary and involuntary context switches per second),
+    # "rdbytes" and "wrbytes" (bytes read and written per second, if
+    # known), and "threads" (a list of dicts with the tags "tid", "name", and
+    # "cpu" for each thread of the process).
+    #
+    # If "notify" is True, then the plugins are passed the results of each
+    # node (see Plugin.broProcessStats).
+    def get_top_output(self, nodes, notify=True):
+        if self.config.os == "Linux":
+            results = self._get_proc_stats_output(nodes)
+        else:
+            results = self._get_top_helper_output(nodes)
 
+        if notify:
+            for (node, error, vals) in results:
+                if not error:
+                    self.pluginregistry.broProcessStats(node, vals)
+
+        return results
+
+    def _get_proc_stats_output(self, nodes):
         results = []
         cmds = []
+        parents = {}
+        hostpids = {}
 
-        running = self._isrunning(nodes)
+        # Sample the processes of all nodes of a host with one command.
+        for (node, isrunning) in self._isrunning(nodes, setcrashed=False):
+            if not isrunning:
+                results += [(node, "not running", [{}])]
+                continue
+
+            pid = node.getPID()
+            parents[node.name] = pid
+
+            if node.host not in hostpids:
+                hostpids[node.host] = [str(TOP_INTERVAL)]
+                cmds += [(node, "proc-stats", hostpids[node.host])]
+
+            hostpids[node.host].append(str(pid))
+
+        if not cmds:
+            return results
+
+        res = {}
+        for (node, success, output) in self.executor.run_helper(cmds):
+            res[node.host] = success, output
+
+        for node in nodes:
+            if node.name not in parents:
+                continue
+
+            success, output = res[node.host]
+
+            if not success:
+                # The error msg gets written to stats.log, so we only want
+                # the first line.
+                errmsg = output.splitlines()[0] if output else ""
+                results += [(node, "proc-stats failed: %s" % errmsg, [{}])]
+                continue
+
+            try:
+                procs = _parse_proc_stats(output)
+            except (KeyError, IndexError, ValueError) as err:
+                results += [(node, "bad output from proc-stats: %s" % err, [{}])]
+                continue
+
+            parent = parents[node.name]
+            if parent not in procs:
+                # It's possible that the process is no longer there.
+                results += [(node, "not running", [{}])]
+                continue
+
+            vals = []
+            for (pid, d) in sorted(procs.items()):
+                if pid == parent or d["ppid"] == parent:
+                    d = d.copy()
+                    del d["ppid"]
+                    d["proc"] = "parent" if pid == parent else "child"
+                    vals += [d]
+
+            results += [(node, None, vals)]
+
+        return results
+
+    def _get_top_helper_output(self, nodes):
+        results = []
+        cmds = []
+
+        running = self._isrunning(nodes, setcrashed=False)
 
         # Get all the PIDs first.
 
@@ -1151,7 +1454,7 @@ class Controller:
         return results
 
     def print_id(self, nodes, id):
-        running = self._isrunning(nodes)
+        running = self._isrunning(nodes, setcrashed=False)
 
         eventlist = []
         for (node, isrunning) in running:
@@ -1170,7 +1473,7 @@ class Controller:
 
 
     def _query_netstats(self, nodes):
-        running = self._isrunning(nodes)
+        running = self._isrunning(nodes, setcrashed=False)
 
         eventlist = []
         for (node, isrunning) in running:
@@ -1391,8 +1694,9 @@ class Controller:
         return results
 
 
-    # Triggers all activity which is to be done regularly via cron.
-    def cron(self, watch):
+    # Triggers all activity which is to be done regularly via cron.  The
+    # tasks in "force" are run even if they are not due.
+    def cron(self, watch, force=()):
         if not self.config.cronenabled:
             logging.debug("cron is disabled")
             return
@@ -1413,8 +1717,9 @@ class Controller:
             # necessary.
             startlist = []
             stoplist = []
+            expected = self.config.nodes_expected_running()
             for (node, isrunning) in self._isrunning(self.config.nodes()):
-                expectrunning = node.getExpectRunning()
+                expectrunning = node.name.lower() in expected
 
                 if not isrunning and expectrunning:
                     startlist.append(node)
@@ -1426,23 +1731,50 @@ class Controller:
             if stoplist:
                 results = self.stop(stoplist)
 
-        # Check for dead hosts.
-        tasks.check_hosts()
+        # Only the tasks which are due according to their schedule are run
+        # (by default, all of them).
+        due = tasks.due_tasks(force)
 
-        # Generate statistics.
-        tasks.log_stats(5)
+        # The stats store must be set up before the tasks use it.
+        tasks.import_stats()
 
-        # Check available disk space.
-        tasks.check_disk_space()
+        # The remaining tasks are independent of each other (apart from the
+        # statistics), so they run concurrently.  In particular, the other
+        # tasks run while capstats is measuring the traffic.
+        crontasks = [task for task in [
+                # Check for dead hosts.
+                ("check-hosts", tasks.check_hosts, []),
 
-        # Expire old log files.
-        tasks.expire_logs()
+                # Generate statistics.
+                ("stats:top", tasks.sample_top, []),
+                ("stats:capstats", lambda: tasks.sample_capstats(5), []),
+                ("stats", tasks.write_stats, ["stats:top", "stats:capstats"]),
 
-        # Expire old crash directories.
-        tasks.expire_crash()
+                # Check available disk space.
+                ("disk-space", tasks.check_disk_space, []),
 
-        # Update the HTTP stats directory.
-        tasks.update_http_stats()
+                # Expire old log files and statistics.
+                ("expire-logs", tasks.expire_logs, []),
+                ("expire-stats", tasks.expire_stats, ["stats"]),
+
+                # Expire old crash directories.
+                ("expire-crash", tasks.expire_crash, []),
+
+                # Update the HTTP stats directory (with the stats just
+                # written, once the old ones are expired).
+                ("http-stats", tasks.update_http_stats, ["stats", "expire-stats"]),
+                ] if cron.task_schedule(task[0]) in due]
+
+        finished = set()
+        try:
+            cron.run_tasks(cronui, crontasks, finished=finished)
+        finally:
+            # A task which didn't succeed is due again on the next run.
+            tasks.record_runs([task[0] for task in crontasks], finished)
+
+            # The tasks run in threads of their own, but the plugins are
+            # called only from this thread (see CronTasks.call_plugins).
+            tasks.call_plugins()
 
         # Run external command if we have one.
         tasks.run_cron_cmd()
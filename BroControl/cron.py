@@ -1,11 +1,141 @@
 # Tasks which are to be done on a regular basis from cron.
 from __future__ import print_function
+import errno
 import os
 import time
 import shutil
+import logging
+import threading
 
 from BroControl import execute
 from BroControl import py3bro
+from BroControl import statslog
+from BroControl import statsstore
+
+# The time (in seconds) after which we stop waiting for a cron task, and
+# for all of them.
+TASK_TIMEOUT = 120
+CRON_BUDGET = 240
+
+# The number of cron tasks which are run concurrently.
+CRON_WORKERS = 4
+
+# The names of the tasks which can be scheduled with the CronTaskIntervals
+# option (or forced with "broctl cron --force").
+TASKS = ("check-hosts", "stats", "disk-space", "expire-logs", "expire-stats",
+         "expire-crash", "http-stats")
+
+# The CSV files of each node in the www directory (as written by
+# stats-to-csv): the name of the file, whether it's written for workers only,
+# and its columns as (name, metrics) tuples, where the value of a column is
+# the sum of its metrics.
+WWW_CSVS = (
+    ("cpu", False, [("CPU", ["parent-cpu", "child-cpu"])]),
+    ("mem", False, [("Memory", ["parent-vsize", "child-vsize"])]),
+    ("mbps", True, [("MBits/sec", ["interface-mbps"])]),
+    ("pkts", True, [("TCP", ["interface-t"]), ("UDP", ["interface-u"]),
+                    ("ICMP", ["interface-i"]), ("Other", ["interface-o"])]),
+)
+
+# The maximum number of lines of a CSV file in the www directory.  Longer
+# time spans are written at the resolution of a rollup (see statsstore.py).
+WWW_MAXPOINTS = 1000
+
+# A task is due this many seconds before its interval has passed, because
+# cron doesn't start us at exactly the same second each time.
+SCHEDULE_SLACK = 60
+
+
+# Returns the name of the schedule (see TASKS) that a task passed to
+# run_tasks() belongs to.  Such tasks are named "<schedule>", or
+# "<schedule>:<step>" if a schedule consists of several tasks.
+def task_schedule(name):
+    return name.split(":")[0]
+
+
+# Run tasks concurrently, given as a list of (name, func, deps) tuples,
+# where "deps" is a list of the names of the tasks which must have finished
+# before the task can start.  We stop waiting for a task which doesn't
+# finish within "timeout" seconds, or that is still running when all the
+# tasks together have taken "budget" seconds (it continues in the
+# background), and the tasks depending on it are skipped, as are the tasks
+# depending on a task which failed.  Dependencies on tasks which are not
+# in the list (e.g., because they are not due) are ignored.  If a task
+# raised an exception, the first such exception is raised again once all
+# tasks are done.  If "finished" is given, the names of the tasks which
+# finished successfully are added to it (even if an exception is raised).
+def run_tasks(ui, tasks, workers=CRON_WORKERS, timeout=TASK_TIMEOUT, budget=CRON_BUDGET, finished=None):
+    cond = threading.Condition()
+    names = set(task[0] for task in tasks)
+    pending = [(name, func, [dep for dep in deps if dep in names]) for (name, func, deps) in tasks]
+    running = {}
+    done = {}
+    failed = set()
+    errors = []
+
+    def run(name, func):
+        start = time.time()
+        try:
+            func()
+        except Exception as err:
+            logging.exception("cron task %s failed", name)
+            with cond:
+                errors.append(err)
+                failed.add(name)
+
+        with cond:
+            if running.pop(name, None) is not None and name not in failed:
+                done[name] = time.time() - start
+            cond.notify()
+
+    start = time.time()
+    deadline = start + budget
+
+    with cond:
+        while pending or running:
+            now = time.time()
+
+            for (name, started) in list(running.items()):
+                if now - started > timeout or now > deadline:
+                    ui.error("cron task %s did not finish within %d seconds" % (name, now - started))
+                    del running[name]
+                    failed.add(name)
+
+            for task in list(pending):
+                (name, func, deps) = task
+                if any(dep in failed for dep in deps) or now > deadline:
+                    logging.debug("cron task %s skipped", name)
+                    pending.remove(task)
+                    failed.add(name)
+                elif len(running) < workers and all(dep in done for dep in deps):
+                    pending.remove(task)
+                    running[name] = now
+                    thread = threading.Thread(target=run, args=(name, func))
+                    thread.daemon = True
+                    thread.start()
+
+            if not running:
+                if pending:
+                    # The remaining tasks depend on each other.
+                    for (name, func, deps) in pending:
+                        logging.debug("cron task %s skipped", name)
+                    break
+
+                continue
+
+            # Wait until a task finishes, or the next one times out.
+            wakeup = min([started + timeout for started in running.values()] + [deadline])
+            cond.wait(max(wakeup - now, 0) + 0.01)
+
+    logging.debug("cron tasks finished after %.3f s: %s", time.time() - start,
+                  ", ".join("%s %.3f s" % (name, secs) for (name, secs) in sorted(done.items(), key=lambda item: -item[1])))
+
+    if finished is not None:
+        finished.update(done)
+
+    if errors:
+        raise errors[0]
+
 
 class CronUI:
     def __init__(self):
@@ -37,21 +167,106 @@ class CronTasks:
         self.executor = executor
         self.pluginregistry = pluginregistry
 
+        # The output of "top" and capstats (see sample_top() and
+        # sample_capstats()).
+        self.top = []
+        self.capstats = []
+
+        # The calls of plugin methods made by the tasks, as (func, args)
+        # tuples.  The tasks run in threads of their own, so the calls are
+        # done afterwards by call_plugins() (which the plugins expect to be
+        # done from the main thread).
+        self.plugincalls = []
+
+        # The time when due_tasks() was called (see record_runs()).
+        self.duetime = None
+
+    # Call the plugin methods that the tasks have queued.
+    def call_plugins(self):
+        calls = self.plugincalls
+        self.plugincalls = []
+
+        for (func, args) in calls:
+            func(*args)
+
+    # Returns the set of the names of the tasks (see TASKS) which are due
+    # according to the CronTaskIntervals option.  The tasks in "force" are
+    # due regardless of when they ran last.  Their last run is recorded
+    # only once they succeeded (see record_runs).
+    def due_tasks(self, force=()):
+        now = time.time()
+        due = set()
+        self.duetime = now
+
+        for name in TASKS:
+            key = "cron-lastrun-%s" % name
+            minutes = self.config.cronintervals.get(name, 0)
+            lastrun = self.config.get_state(key)
+
+            if name in force or not minutes or lastrun is None or now - lastrun >= minutes * 60 - SCHEDULE_SLACK:
+                due.add(name)
+            else:
+                logging.debug("cron task %s not due until %s", name, time.ctime(lastrun + minutes * 60))
+
+        return due
+
+    # Records the time when due_tasks() was called as the last run of the
+    # schedules (see TASKS) of the tasks given by name in "ran", if all the
+    # tasks of a schedule are in "finished".  A schedule with a task which
+    # failed, timed out, or was skipped remains due on the next run.
+    def record_runs(self, ran, finished):
+        schedules = set(task_schedule(name) for name in ran)
+        schedules -= set(task_schedule(name) for name in ran if name not in finished)
+
+        for name in schedules:
+            self.config.set_state("cron-lastrun-%s" % name, self.duetime)
+
     def log_stats(self, interval):
+        self.sample_top()
+        self.sample_capstats(interval)
+        self.write_stats()
+        self.call_plugins()
+
+    def sample_top(self):
         if not self.config.statslogenable:
             return
 
-        nodes = self.config.nodes()
-        top = self.controller.get_top_output(nodes)
+        self.top = self.controller.get_top_output(self.config.nodes(), notify=False)
 
-        have_capstats = self.config.capstatspath
-        capstats = []
+        for (node, error, vals) in self.top:
+            if not error:
+                self.plugincalls.append((self.pluginregistry.broProcessStats, (node, vals)))
 
-        if have_capstats:
-            capstats = self.controller.get_capstats_output(nodes, interval)
+    # Run capstats (or sample the interface counters, see the CapstatsSource
+    # option) for "interval" seconds.  This uses an executor of its own, so
+    # that other tasks can run commands on the hosts in the meantime.
+    def sample_capstats(self, interval):
+        if not self.config.statslogenable:
+            return
+
+        if self.config.capstatssource == "capstats" and not self.config.capstatspath:
+            return
+
+        executor = execute.Executor(self.config)
+        try:
+            self.capstats = self.controller.get_capstats_output(self.config.nodes(), interval, executor)
+        finally:
+            executor.finish()
+
+    # Write the stats sampled by sample_top() and sample_capstats() to
+    # stats.log and the stats store.
+    def write_stats(self):
+        if not self.config.statslogenable:
+            return
+
+        top = self.top
+        capstats = self.capstats
 
         t = time.time()
 
+        # The numeric values of each node for the stats store.
+        records = {}
+
         try:
             with open(self.config.statslog, "a") as out:
                 for (node, error, vals) in top:
@@ -59,8 +274,13 @@ class CronTasks:
                         for proc in vals:
                             parentchild = proc["proc"]
                             for (val, key) in sorted(proc.items()):
-                                if val != "proc":
+                                # The per-thread stats are not logged.
+                                if val not in ("proc", "threads"):
                                     out.write("%s %s %s %s %s\n" % (t, node, parentchild, val, key))
+                                    try:
+                                        records.setdefault(node.name, {})["%s-%s" % (parentchild, val)] = float(key)
+                                    except ValueError:
+                                        pass
                     else:
                         out.write("%s %s error error %s\n" % (t, node, error))
 
@@ -71,6 +291,7 @@ class CronTasks:
 
                     for (key, val) in sorted(vals.items()):
                         out.write("%s %s interface %s %s\n" % (t, node, key, val))
+                        records.setdefault(node.name, {})["interface-%s" % key] = val
 
                         if key == "pkts" and str(node) != "$total":
                             # Report if we don't see packets on an interface.
@@ -91,6 +312,59 @@ class CronTasks:
             self.ui.error("failed to append to file: %s" % err)
             return
 
+        store = self._stats_store()
+        if store is None:
+            return
+
+        try:
+            store.append([(t, name, vals) for (name, vals) in sorted(records.items())])
+            store.update_rollups(sorted(records))
+        except (IOError, OSError) as err:
+            self.ui.error("failed to update stats store: %s" % err)
+
+    # Import the data of the existing stats.log files into the store of the
+    # stats (see statsstore.py) when it is used for the first time.  This is
+    # not a cron task, because it may take much longer than a task is given
+    # (see TASK_TIMEOUT).  It is repeated on the next run if it fails,
+    # because importing the same data again doesn't change anything.
+    def import_stats(self):
+        if not self.config.statslogenable:
+            return
+
+        path = os.path.join(self.config.statsdir, "store")
+        imported = os.path.join(path, ".imported")
+        if os.path.exists(imported):
+            return
+
+        try:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+            store = statsstore.StatsStore(path)
+            for logfile in statslog.segments(self._archived_statslog()) + [self.config.statslog]:
+                if os.path.exists(logfile):
+                    statsstore.import_statslog(store, logfile)
+
+            open(imported, "w").close()
+        except (IOError, OSError) as err:
+            self.ui.error("failed to import stats.log into stats store: %s" % err)
+
+    # Returns the store of the stats (see statsstore.py), or None if the
+    # existing stats.log files have not been imported into it yet (see
+    # import_stats()).  Nothing may be added to the store before, because
+    # data older than what it already has would not be imported.
+    def _stats_store(self):
+        path = os.path.join(self.config.statsdir, "store")
+        if not os.path.exists(os.path.join(path, ".imported")):
+            return None
+
+        return statsstore.StatsStore(path)
+
+    # Returns the path of the stats.log archive in the stats directory (see
+    # statslog.py).
+    def _archived_statslog(self):
+        return os.path.join(self.config.statsdir, os.path.basename(self.config.statslog))
+
     def check_disk_space(self):
         minspace = self.config.mindiskspace
         if minspace == 0:
@@ -121,7 +395,7 @@ class CronTasks:
                 self.config.set_state(key, perc)
 
     def expire_logs(self):
-        if self.config.logexpireminutes == 0 and self.config.statslogexpireinterval == 0:
+        if self.config.logexpireminutes == 0:
             return
 
         success, output = execute.run_localcmd(os.path.join(self.config.scriptsdir, "expire-logs"))
@@ -129,6 +403,32 @@ class CronTasks:
         if not success:
             self.ui.error("expire-logs failed\n%s" % output)
 
+    # Remove the archived stats of all days that are older than
+    # StatsLogExpireInterval, and the rollups older than
+    # StatsRollupExpireInterval.  Whole days (or months and years for the
+    # rollups) are removed, so stats are kept a bit longer.
+    def expire_stats(self):
+        if self.config.statslogexpireinterval == 0 and self.config.statsrollupexpireinterval == 0:
+            return
+
+        if not os.path.isdir(self.config.statsdir):
+            return
+
+        now = time.time()
+        store = self._stats_store()
+
+        try:
+            if self.config.statslogexpireinterval != 0:
+                before = now - 86400 * self.config.statslogexpireinterval
+                statslog.expire(self._archived_statslog(), before)
+                if store is not None:
+                    store.expire(before)
+
+            if self.config.statsrollupexpireinterval != 0 and store is not None:
+                store.expire_rollups(now - 86400 * self.config.statsrollupexpireinterval)
+        except (IOError, OSError) as err:
+            self.ui.error("failed to expire stats: %s" % err)
+
     def expire_crash(self):
         if self.config.crashexpireinterval == 0:
             return
@@ -150,7 +450,7 @@ class CronTasks:
             previous = self.config.get_state(tag)
             if previous is not None:
                 if alive != previous:
-                    self.pluginregistry.hostStatusChanged(host, alive)
+                    self.plugincalls.append((self.pluginregistry.hostStatusChanged, (host, alive)))
                     if self.config.mailhostupdown:
                         up_or_down = "up" if alive else "down"
                         self.ui.info("host %s %s" % (host, up_or_down))
@@ -173,27 +473,7 @@ class CronTasks:
 
         metadat = os.path.join(self.config.statsdir, "meta.dat")
         try:
-            with open(metadat, "w") as meta:
-                for node in self.config.hosts():
-                    meta.write("node %s %s %s\n" % (node, node.type, node.host))
-
-                meta.write("time %s\n" % time.asctime())
-                meta.write("version %s\n" % self.config.version)
-
-                success, output = execute.run_localcmd("uname -a")
-                if success and output:
-                    # Note: "output" already has a '\n'
-                    meta.write("os %s" % output)
-                else:
-                    meta.write("os <error>\n")
-
-                success, output = execute.run_localcmd("hostname")
-                if success and output:
-                    # Note: "output" already has a '\n'
-                    meta.write("host %s" % output)
-                else:
-                    meta.write("host <error>\n")
-
+            metachanged = self._write_meta(metadat)
         except IOError as err:
             self.ui.error("failure creating file: %s" % err)
             return
@@ -206,27 +486,129 @@ class CronTasks:
                 self.ui.error("failed to create directory: %s" % err)
                 return
 
-        # Update the WWW data
-        statstocsv = os.path.join(self.config.scriptsdir, "stats-to-csv")
+        # Take over the current stats.log in spool by renaming it, so that
+        # stats written in the meantime go to a new file.  A file left over
+        # by an interrupted cron run is processed first (stats-to-csv skips
+        # the lines it has already seen).
+        handoff = "%s.cron" % self.config.statslog
+        if os.path.exists(handoff):
+            if not self._archive_stats(handoff, metadat, wwwdir, metachanged):
+                return
 
-        success, output = execute.run_localcmd("%s %s %s %s" % (statstocsv, self.config.statslog, metadat, wwwdir))
-        if success:
-            shutil.copy(metadat, wwwdir)
+        if not os.path.exists(self.config.statslog):
+            return
+
+        try:
+            os.rename(self.config.statslog, handoff)
+        except OSError as err:
+            # The file might have been removed in the meantime.
+            if err.errno != errno.ENOENT:
+                self.ui.error("failed to rename file: %s" % err)
+            return
+
+        self._archive_stats(handoff, metadat, wwwdir, metachanged)
+
+    # Write the meta.dat file, unless only its timestamp would change.
+    # Returns True if the file was written.
+    def _write_meta(self, metadat):
+        lines = ["node %s %s %s\n" % (node, node.type, node.host) for node in self.config.hosts()]
+        info = ["version %s\n" % self.config.version] + self._host_info()
+
+        try:
+            with open(metadat, "r") as meta:
+                if [line for line in meta if not line.startswith("time ")] == lines + info:
+                    return False
+        except IOError:
+            pass
+
+        with open(metadat, "w") as meta:
+            meta.writelines(lines)
+            meta.write("time %s\n" % time.asctime())
+            meta.writelines(info)
+
+        return True
+
+    # Returns the "os" and "host" lines of meta.dat.  The output of the
+    # commands is kept in the state database until the uname() of this host
+    # changes (e.g., after a kernel update or a change of the hostname).
+    def _host_info(self):
+        key = " ".join(os.uname())
+        cached = self.config.get_state("stats-hostinfo")
+        if cached and cached[0] == key:
+            return cached[1:]
+
+        lines = []
+        for (tag, cmd) in (("os", "uname -a"), ("host", "hostname")):
+            success, output = execute.run_localcmd(cmd)
+            if success and output:
+                # Note: "output" already has a '\n'
+                lines.append("%s %s" % (tag, output))
+            else:
+                lines.append("%s <error>\n" % tag)
+
+        self.config.set_state("stats-hostinfo", [key] + lines)
+        return lines
+
+    # Update the WWW data from a stats.log file taken over from spool, and
+    # append it to the one in ${statsdir}.  Returns True if the file was
+    # archived (and removed).
+    def _archive_stats(self, path, metadat, wwwdir, metachanged):
+        store = self._stats_store()
+        if store is not None:
+            success = self._write_www_stats(store, wwwdir)
         else:
-            self.ui.error("error reported by stats-to-csv\n%s" % output)
+            # The stats store is not set up yet (see import_stats()), so
+            # stats-to-csv appends the new stats to the CSV files.
+            statstocsv = os.path.join(self.config.scriptsdir, "stats-to-csv")
+
+            success, output = execute.run_localcmd("%s %s %s %s" % (statstocsv, path, metadat, wwwdir))
+            if not success:
+                self.ui.error("error reported by stats-to-csv\n%s" % output)
+
+        if success:
+            if metachanged or not os.path.exists(os.path.join(wwwdir, "meta.dat")):
+                shutil.copy(metadat, wwwdir)
 
-        # Append the current stats.log in spool to the one in ${statsdir}
-        dst = os.path.join(self.config.statsdir, os.path.basename(self.config.statslog))
         try:
-            with open(self.config.statslog, "r") as fsrc:
-                with open(dst, "a") as fdst:
-                    shutil.copyfileobj(fsrc, fdst)
-        except IOError as err:
+            with open(path, "r") as fsrc:
+                statslog.append(self._archived_statslog(), fsrc)
+        except (IOError, OSError) as err:
             self.ui.error("failed to append file: %s" % err)
-            return
+            return False
 
-        os.unlink(self.config.statslog)
+        os.unlink(path)
+        return True
+
+    # Write the CSV files in the www directory (see WWW_CSVS) of the nodes
+    # in meta.dat from the stats store.  Each file covers all the stats of
+    # its node, at a resolution that keeps it within WWW_MAXPOINTS lines.
+    # Returns True if all files were written.
+    def _write_www_stats(self, store, wwwdir):
+        try:
+            for node in self.config.hosts():
+                if node.type not in ("manager", "proxy", "worker"):
+                    continue
+
+                timerange = store.time_range(node.name)
+                if timerange is None:
+                    continue
+
+                for (tag, workeronly, columns) in WWW_CSVS:
+                    if workeronly and node.type != "worker":
+                        continue
 
+                    # Write a new file and rename it, so that the web
+                    # server never sees a partially written file.
+                    path = os.path.join(wwwdir, "%s.%s.csv" % (node.name, tag))
+                    tmpfile = "%s.tmp" % path
+                    with open(tmpfile, "w") as f:
+                        statsstore.export_csv(store, f, node.name, columns, timerange[0], timerange[1] + 1, WWW_MAXPOINTS)
+                    os.rename(tmpfile, path)
+        except (IOError, OSError) as err:
+            self.ui.error("failed to write stats CSV file: %s" % err)
+            return False
+
+        return True
 
     def run_cron_cmd(self):
         # Run external command if we have one.
@@ -0,0 +1,138 @@
+# Watching files for changes with inotify (available on Linux only), so that
+# a long-running process (such as broctld) doesn't need to check files for
+# changes as long as nothing happens.
+
+import errno
+import os
+import struct
+import threading
+
+try:
+    import ctypes
+except ImportError:
+    ctypes = None
+
+# inotify constants (from <sys/inotify.h>).
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+
+# The directories containing the files are watched (not the files
+# themselves), because many editors replace a file instead of modifying it.
+_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+               IN_MOVED_TO | IN_CREATE | IN_DELETE)
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _to_bytes(s):
+    return s if isinstance(s, bytes) else s.encode("utf-8")
+
+
+# Returns a FileWatcher for the given list of file names, or None if inotify
+# is not available.
+def watch(paths):
+    if not ctypes:
+        return None
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        inotify_init1 = libc.inotify_init1
+        inotify_add_watch = libc.inotify_add_watch
+        inotify_rm_watch = libc.inotify_rm_watch
+    except (OSError, AttributeError):
+        return None
+
+    fd = inotify_init1(IN_CLOEXEC)
+    if fd < 0:
+        return None
+
+    # Map each watch descriptor to the names of the watched files in that
+    # directory.
+    watches = {}
+    for path in paths:
+        dirname, name = os.path.split(os.path.abspath(path))
+        wd = inotify_add_watch(fd, _to_bytes(dirname), _WATCH_MASK)
+        if wd < 0:
+            os.close(fd)
+            return None
+
+        watches.setdefault(wd, set()).add(_to_bytes(name))
+
+    return FileWatcher(paths, fd, watches, inotify_rm_watch)
+
+
+class FileWatcher:
+    def __init__(self, paths, fd, watches, rm_watch):
+        self.paths = list(paths)
+        self._fd = fd
+        self._watches = watches
+        self._rm_watch = rm_watch
+        self._closed = False
+
+        # Initially, we don't know anything about the files.
+        self._dirty = True
+
+        # Set if the events can no longer be read, in which case the files
+        # are always reported as possibly changed.
+        self._dead = False
+
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    # Returns True if any of the files might have changed since the previous
+    # call (or if this is the first call, or if the watcher no longer works).
+    # This does not make any system calls.
+    def changed(self):
+        if self._dead:
+            return True
+
+        if not self._dirty:
+            return False
+
+        # Clear the flag before the caller looks at the files, so that no
+        # change that happens while doing so gets lost.
+        self._dirty = False
+        return True
+
+    # Stop watching the files.
+    def close(self):
+        self._closed = True
+
+        # Removing the watches generates events, which wake up the thread
+        # reading the events (which then closes the inotify file descriptor).
+        for wd in self._watches:
+            self._rm_watch(self._fd, wd)
+
+    # Read inotify events (in a separate thread).
+    def _run(self):
+        while True:
+            try:
+                data = os.read(self._fd, 4096)
+            except OSError as err:
+                if err.errno == errno.EINTR and not self._closed:
+                    continue
+
+                self._dead = True
+                return
+
+            if self._closed:
+                os.close(self._fd)
+                return
+
+            pos = 0
+            while pos + _EVENT_HEADER.size <= len(data):
+                wd, mask, cookie, namelen = _EVENT_HEADER.unpack_from(data, pos)
+                pos += _EVENT_HEADER.size
+                name = data[pos:pos + namelen].rstrip(b"\0")
+                pos += namelen
+
+                if mask & IN_Q_OVERFLOW or name in self._watches.get(wd, ()):
+                    self._dirty = True
@@ -0,0 +1,173 @@
+# Functions to find the IP addresses of the local network interfaces without
+# running any external commands.
+
+import array
+import binascii
+import socket
+import struct
+import sys
+
+try:
+    import ctypes
+except ImportError:
+    ctypes = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Return a list of the IP addresses of all local interfaces (without zone_id
+# or prefix length), or None if they cannot be determined in-process on this
+# platform.
+def get_local_addrs():
+    addrs = _getifaddrs()
+
+    if addrs is None and sys.platform.startswith("linux"):
+        addrs = _linux_ipv4_addrs()
+        if addrs is not None:
+            addrs += _linux_ipv6_addrs() or []
+
+    return addrs
+
+
+if ctypes:
+    class _sockaddr(ctypes.Structure):
+        # On BSD and OS X, there is an additional "sa_len" field before
+        # the address family.
+        if sys.platform.startswith("linux"):
+            _fields_ = [("sa_family", ctypes.c_ushort)]
+        else:
+            _fields_ = [("sa_len", ctypes.c_ubyte), ("sa_family", ctypes.c_ubyte)]
+
+    class _ifaddrs(ctypes.Structure):
+        pass
+
+    _ifaddrs._fields_ = [
+        ("ifa_next", ctypes.POINTER(_ifaddrs)),
+        ("ifa_name", ctypes.c_char_p),
+        ("ifa_flags", ctypes.c_uint),
+        ("ifa_addr", ctypes.POINTER(_sockaddr)),
+        ("ifa_netmask", ctypes.POINTER(_sockaddr)),
+        ("ifa_ifu", ctypes.POINTER(_sockaddr)),
+        ("ifa_data", ctypes.c_void_p)]
+
+
+# Offset and length of the address in a sockaddr_in and sockaddr_in6.
+_ADDR_LAYOUT = {socket.AF_INET: (4, 4), socket.AF_INET6: (8, 16)}
+
+
+# Use the getifaddrs() function of the C library (via ctypes).  Returns
+# None if getifaddrs() is not available or fails.
+def _getifaddrs():
+    if not ctypes:
+        return None
+
+    try:
+        # The C library is already loaded into the Python process, so we
+        # don't need to search for it (which is slow).
+        libc = ctypes.CDLL(None)
+        getifaddrs = libc.getifaddrs
+        freeifaddrs = libc.freeifaddrs
+    except (OSError, AttributeError):
+        return None
+
+    ifap = ctypes.POINTER(_ifaddrs)()
+    if getifaddrs(ctypes.byref(ifap)) != 0:
+        return None
+
+    addrs = []
+    try:
+        ifa = ifap
+        while ifa:
+            sa = ifa.contents.ifa_addr
+            if sa and sa.contents.sa_family in _ADDR_LAYOUT:
+                family = sa.contents.sa_family
+                offset, length = _ADDR_LAYOUT[family]
+                packed = ctypes.string_at(ctypes.addressof(sa.contents) + offset, length)
+                addrs.append(_format_addr(family, packed))
+
+            ifa = ifa.contents.ifa_next
+    finally:
+        freeifaddrs(ifap)
+
+    return addrs
+
+
+# Return the string representation of a packed address.
+def _format_addr(family, packed):
+    if family == socket.AF_INET6 and not sys.platform.startswith("linux"):
+        # The BSD kernels embed the zone_id of link-local addresses in the
+        # second 16-bit word of the address.
+        if packed[:2] == b"\xfe\x80":
+            packed = packed[:2] + b"\x00\x00" + packed[4:]
+
+    return socket.inet_ntop(family, packed)
+
+
+# Use the SIOCGIFCONF ioctl to find the IPv4 addresses on Linux.  Returns
+# None if this fails.
+def _linux_ipv4_addrs():
+    if not fcntl:
+        return None
+
+    SIOCGIFCONF = 0x8912
+
+    # The size of "struct ifreq" depends on the size of a pointer.
+    ifreqsize = 40 if struct.calcsize("P") == 8 else 32
+    maxifs = 128
+
+    while True:
+        buf = array.array("B", b"\0" * (ifreqsize * maxifs))
+        bufaddr, buflen = buf.buffer_info()
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                ifconf = struct.pack("iP", buflen, bufaddr)
+                result = fcntl.ioctl(sock.fileno(), SIOCGIFCONF, ifconf)
+            finally:
+                sock.close()
+        except (IOError, OSError):
+            return None
+
+        size = struct.unpack("iP", result)[0]
+
+        # If the buffer is full, there might be more interfaces.
+        if size < buflen:
+            break
+        maxifs *= 2
+
+    buf = buf.tobytes() if hasattr(buf, "tobytes") else buf.tostring()
+
+    addrs = []
+    for offset in range(0, size, ifreqsize):
+        # The sockaddr_in follows the 16-byte interface name.
+        addrs.append(socket.inet_ntoa(buf[offset + 20:offset + 24]))
+
+    return addrs
+
+
+# Read the IPv6 addresses on Linux from /proc/net/if_inet6.  Returns None
+# if this file is not available (e.g. if IPv6 is disabled).
+def _linux_ipv6_addrs():
+    try:
+        with open("/proc/net/if_inet6", "r") as f:
+            lines = f.readlines()
+    except IOError:
+        return None
+
+    addrs = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 6 or len(fields[0]) != 32:
+            continue
+
+        try:
+            packed = binascii.unhexlify(fields[0])
+        except (TypeError, ValueError):
+            continue
+
+        addrs.append(socket.inet_ntop(socket.AF_INET6, packed))
+
+    return addrs
@@ -2,9 +2,12 @@
 
 import os
 import binascii
+import socket
+import struct
 
 from BroControl import util
 from BroControl import config
+from BroControl import node as node_mod
 from BroControl import py3bro
 
 # In all paths given in this file, ${<option>} will replaced with the value of
@@ -122,25 +125,87 @@ class Logger:
         return self.logger
 
 
-# Create Bro-side broctl configuration file.
-def make_layout(path, cmdout, silent=False):
-    class Port:
-        def __init__(self, startport):
-            # This is the first port number to use.
-            self.p = startport
+# Record the port number that each node will use (starting at "startport"),
+# and return the port numbers.
+class Port:
+    def __init__(self, startport):
+        # This is the first port number to use.
+        self.p = startport
+
+    # Record the port number that the specified node will use (if node is
+    # None, then don't record it) and return that port number.
+    def use_port(self, node):
+        port = self.p
+        # Increment the port number, since we're using the current one.
+        self.p += 1
+
+        if node is not None:
+            node.setPort(port)
+
+        return port
+
+
+# Generate the lines of standalone-layout.bro.
+def _standalone_layout(manager, broport):
+    yield "# Automatically generated. Do not edit.\n"
+    # This is the port that standalone nodes listen on for remote
+    # control by default.
+    yield "redef Communication::listen_port = %s/tcp;\n" % broport.use_port(manager)
+    yield "redef Communication::nodes += {\n"
+    yield '\t["control"] = [$host=%s, $zone_id="%s", $class="control", $events=Control::controller_events],\n' % (util.format_bro_addr(manager.addr), manager.zone_id)
+    yield "};\n"
+
+
+# Generate the lines of cluster-layout.bro.  The node lists are computed
+# once up front, so that the cost of generating the file is linear in the
+# number of nodes.
+def _cluster_layout(manager, broport):
+    loggers, _, proxies, workers = node_mod.separate_types(config.Config.nodes())
+
+    mylogger = Logger(loggers)
+
+    # If no loggers are defined, then manager does the logging.
+    manager_is_logger = "F" if loggers else "T"
+
+    # Every proxy and the manager use the same set of worker names.
+    workerset = ", ".join(['"%s"' % w.name for w in workers])
+    managername = manager.name
+    proxynames = [p.name for p in proxies]
+    numproxies = len(proxynames)
+
+    yield "# Automatically generated. Do not edit.\n"
+    yield "redef Cluster::manager_is_logger = %s;\n" % manager_is_logger
+    yield "redef Cluster::nodes = {\n"
+
+    # Control definition.  For now just reuse the manager information.
+    yield '\t["control"] = [$node_type=Cluster::CONTROL, $ip=%s, $zone_id="%s", $p=%s/tcp],\n' % (util.format_bro_addr(manager.addr), config.Config.zoneid, broport.use_port(None))
+
+    # Loggers definition
+    for lognode in loggers:
+        yield '\t["%s"] = [$node_type=Cluster::LOGGER, $ip=%s, $zone_id="%s", $p=%s/tcp],\n' % (lognode.name, util.format_bro_addr(lognode.addr), lognode.zone_id, broport.use_port(lognode))
 
-        # Record the port number that the specified node will use (if node is
-        # None, then don't record it) and return that port number.
-        def use_port(self, node):
-            port = self.p
-            # Increment the port number, since we're using the current one.
-            self.p += 1
+    # Manager definition
+    yield '\t["%s"] = [$node_type=Cluster::MANAGER, $ip=%s, $zone_id="%s", $p=%s/tcp, %s$workers=set(%s)],\n' % (managername, util.format_bro_addr(manager.addr), manager.zone_id, broport.use_port(manager), mylogger.next_logger(), workerset)
 
-            if node is not None:
-                node.setPort(port)
+    # Proxies definition (all proxies use same logger as the manager)
+    for p in proxies:
+        yield '\t["%s"] = [$node_type=Cluster::PROXY, $ip=%s, $zone_id="%s", $p=%s/tcp, %s$manager="%s", $workers=set(%s)],\n' % (p.name, util.format_bro_addr(p.addr), p.zone_id, broport.use_port(p), mylogger.logger, managername, workerset)
 
-            return port
+    # Workers definition
+    for w in workers:
+        proxyname = proxynames[w.count % numproxies]
+        yield '\t["%s"] = [$node_type=Cluster::WORKER, $ip=%s, $zone_id="%s", $p=%s/tcp, $interface="%s", %s$manager="%s", $proxy="%s"],\n' % (w.name, util.format_bro_addr(w.addr), w.zone_id, broport.use_port(w), w.interface, mylogger.next_logger(), managername, proxyname)
 
+    # Activate time-machine support if configured.
+    if config.Config.timemachinehost:
+        yield '\t["time-machine"] = [$node_type=Cluster::TIME_MACHINE, $ip=%s, $p=%s],\n' % (config.Config.timemachinehost, config.Config.timemachineport)
+
+    yield "};\n"
+
+
+# Create Bro-side broctl configuration file.  The file is written out while
+# it is being generated rather than built up in memory first.
+def make_layout(path, cmdout, silent=False):
     manager = config.Config.manager()
     broport = Port(config.Config.broport)
 
@@ -149,120 +214,186 @@ def make_layout(path, cmdout, silent=False):
             cmdout.info("generating standalone-layout.bro ...")
 
         filename = os.path.join(path, "standalone-layout.bro")
-
-        ostr = "# Automatically generated. Do not edit.\n"
-        # This is the port that standalone nodes listen on for remote
-        # control by default.
-        ostr += "redef Communication::listen_port = %s/tcp;\n" % broport.use_port(manager)
-        ostr += "redef Communication::nodes += {\n"
-        ostr += '\t["control"] = [$host=%s, $zone_id="%s", $class="control", $events=Control::controller_events],\n' % (util.format_bro_addr(manager.addr), manager.zone_id)
-        ostr += "};\n"
+        lines = _standalone_layout(manager, broport)
 
     else:
         if not silent:
             cmdout.info("generating cluster-layout.bro ...")
 
         filename = os.path.join(path, "cluster-layout.bro")
-        workers = config.Config.workers()
-        proxies = config.Config.proxies()
-        loggers = config.Config.loggers()
+        lines = _cluster_layout(manager, broport)
 
-        mylogger = Logger(loggers)
+    try:
+        with open(filename, "w") as out:
+            out.writelines(lines)
+    except IOError as e:
+        cmdout.error("failed to write file: %s" % e)
+        return False
 
-        # If no loggers are defined, then manager does the logging.
-        manager_is_logger = "F" if loggers else "T"
+    return True
 
-        ostr = "# Automatically generated. Do not edit.\n"
-        ostr += "redef Cluster::manager_is_logger = %s;\n" % manager_is_logger
-        ostr += "redef Cluster::nodes = {\n"
 
-        # Control definition.  For now just reuse the manager information.
-        ostr += '\t["control"] = [$node_type=Cluster::CONTROL, $ip=%s, $zone_id="%s", $p=%s/tcp],\n' % (util.format_bro_addr(manager.addr), config.Config.zoneid, broport.use_port(None))
+# Yields a (line number, prefix, tag) tuple for each network in a file.
+def _read_network_lines(fname):
+    with open(fname, "r") as f:
+        for (lineno, line) in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            fields = line.split(None, 1)
+            tag = fields[1] if len(fields) == 2 else ""
+
+            yield (lineno, fields[0], tag)
+
 
-        # Loggers definition
-        for lognode in loggers:
-            ostr += '\t["%s"] = [$node_type=Cluster::LOGGER, $ip=%s, $zone_id="%s", $p=%s/tcp],\n' % (lognode.name, util.format_bro_addr(lognode.addr), lognode.zone_id, broport.use_port(lognode))
+# Maximum number of tags of merged networks to show in a comment.
+_MAX_TAGS = 3
 
-        # Manager definition
-        ostr += '\t["%s"] = [$node_type=Cluster::MANAGER, $ip=%s, $zone_id="%s", $p=%s/tcp, %s$workers=set(' % (manager.name, util.format_bro_addr(manager.addr), manager.zone_id, broport.use_port(manager), mylogger.next_logger())
-        ostr += ", ".join('"%s"' % s.name for s in workers)
-        ostr += ")],\n"
+# Returns a comment string for a list of tags (duplicates are removed).
+def _merge_tags(tags):
+    unique = []
+    seen = set()
+    for tag in tags:
+        if tag not in seen:
+            seen.add(tag)
+            unique.append(tag)
 
-        # Proxies definition (all proxies use same logger as the manager)
-        for p in proxies:
-            ostr += '\t["%s"] = [$node_type=Cluster::PROXY, $ip=%s, $zone_id="%s", $p=%s/tcp, %s$manager="%s", $workers=set(' % (p.name, util.format_bro_addr(p.addr), p.zone_id, broport.use_port(p), mylogger.logger, manager.name)
-            ostr += ", ".join('"%s"' % s.name for s in workers)
-            ostr += ")],\n"
+    comment = "; ".join(unique[:_MAX_TAGS])
+    if len(unique) > _MAX_TAGS:
+        comment += " (and %d more)" % (len(unique) - _MAX_TAGS)
 
-        # Workers definition
-        for w in workers:
-            p = w.count % len(proxies)
-            ostr += '\t["%s"] = [$node_type=Cluster::WORKER, $ip=%s, $zone_id="%s", $p=%s/tcp, $interface="%s", %s$manager="%s", $proxy="%s"],\n' % (w.name, util.format_bro_addr(w.addr), w.zone_id, broport.use_port(w), w.interface, mylogger.next_logger(), manager.name, proxies[p].name)
+    return comment
 
-        # Activate time-machine support if configured.
-        if config.Config.timemachinehost:
-            ostr += '\t["time-machine"] = [$node_type=Cluster::TIME_MACHINE, $ip=%s, $p=%s],\n' % (config.Config.timemachinehost, config.Config.timemachineport)
 
-        ostr += "};\n"
+# Convert a network prefix string (e.g. "10.0.0.0/8") to a tuple
+# (version, first address, last address), where the addresses are integers.
+# Raises ValueError if the prefix is not valid.
+def _parse_prefix(prefix):
+    addr, _, plen = prefix.partition("/")
+
+    if ":" in addr:
+        version, family, bits = 6, socket.AF_INET6, 128
+    else:
+        version, family, bits = 4, socket.AF_INET, 32
 
     try:
-        with open(filename, "w") as out:
-            out.write(ostr)
-    except IOError as e:
-        cmdout.error("failed to write file: %s" % e)
-        return False
+        # inet_pton does not accept abbreviated IPv4 addresses (e.g. "10/8").
+        packed = socket.inet_pton(family, addr)
+        plen = int(plen) if plen else bits
+    except (socket.error, ValueError):
+        raise ValueError
 
-    return True
+    if not 0 <= plen <= bits:
+        raise ValueError
 
+    hostbits = bits - plen
+    first = int(binascii.hexlify(packed), 16) >> hostbits << hostbits
 
-# Reads in a list of networks from file.
-def read_networks(fname):
+    return version, first, first | ((1 << hostbits) - 1)
 
-    nets = []
 
-    with open(fname, "r") as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith("#"):
-                continue
+# Return the prefix string for a network given as an integer address and a
+# prefix length.
+def _format_prefix(version, addr, plen):
+    if version == 4:
+        addrstr = socket.inet_ntoa(struct.pack("!I", addr))
+    else:
+        addrstr = socket.inet_ntop(socket.AF_INET6, binascii.unhexlify("%032x" % addr))
 
-            fields = line.split(None, 1)
+    return util.format_bro_prefix("%s/%d" % (addrstr, plen))
 
-            cidr = util.format_bro_prefix(fields[0])
-            tag = fields[1] if len(fields) == 2 else ""
 
-            nets += [(cidr, tag)]
+# Yields (address, prefix length) tuples for the smallest list of networks
+# that exactly covers the address range from "first" to "last".
+def _summarize_range(first, last, bits):
+    while first <= last:
+        # The largest block which is aligned at "first" and fits in the range.
+        size = first & -first if first else 1 << bits
+        while size > last - first + 1:
+            size >>= 1
+
+        yield first, bits + 1 - size.bit_length()
+        first += size
+
 
-    return nets
+# Reads in a list of networks from file, validates them, and merges all
+# overlapping and adjacent networks into a minimal list of networks.  The tags
+# of all networks that were merged are kept.  Returns a tuple (nets, count)
+# where "nets" is a list of (cidr, tag) tuples (IPv4 networks first, and
+# sorted by address), and "count" is the number of networks read from the
+# file.  Raises ValueError if a network is not valid.
+def aggregate_networks(fname):
+    nets = {4: [], 6: []}
+    count = 0
+
+    for (lineno, prefix, tag) in _read_network_lines(fname):
+        try:
+            version, first, last = _parse_prefix(prefix)
+        except ValueError:
+            raise ValueError("invalid CIDR notation on line %d: %s" % (lineno, prefix))
+
+        nets[version].append((first, last, tag))
+        count += 1
+
+    result = []
+    for (version, bits) in ((4, 32), (6, 128)):
+        # Merge into address ranges, each with a list of (first, tag) tuples.
+        ranges = []
+        for (first, last, tag) in sorted(nets[version]):
+            if ranges and first <= ranges[-1][1] + 1:
+                ranges[-1][1] = max(ranges[-1][1], last)
+            else:
+                ranges.append([first, last, []])
+            if tag:
+                ranges[-1][2].append((first, tag))
+
+        for (first, last, tags) in ranges:
+            # Each of the original networks is completely contained in one of
+            # the networks that cover the range, and both are sorted.
+            i = 0
+            for (addr, plen) in _summarize_range(first, last, bits):
+                end = addr + (1 << (bits - plen)) - 1
+                nettags = []
+                while i < len(tags) and tags[i][0] <= end:
+                    nettags.append(tags[i][1])
+                    i += 1
+
+                result.append((_format_prefix(version, addr, plen), _merge_tags(nettags)))
+
+    return result, count
 
 
 # Create Bro script which contains a list of local networks.
-def make_local_networks(path, cmdout):
+def make_local_networks(path, cmdout, silent=False):
 
     netcfg = config.Config.localnetscfg
 
     try:
-        nets = read_networks(netcfg)
-    except IndexError:
-        cmdout.error("invalid CIDR notation in file: %s" % netcfg)
+        nets, count = aggregate_networks(netcfg)
+    except ValueError as e:
+        cmdout.error("%s in file: %s" % (e, netcfg))
         return False
     except IOError as e:
         cmdout.error("failed to read file: %s" % e)
         return False
 
-    ostr = "# Automatically generated. Do not edit.\n\n"
+    if count != len(nets) and not silent:
+        cmdout.info("merged %d networks from %s into %d networks" % (count, netcfg, len(nets)))
 
-    ostr += "redef Site::local_nets = {\n"
-    for (cidr, tag) in nets:
-        ostr += "\t%s," % cidr
-        if tag:
-            ostr += "\t# %s" % tag
-        ostr += "\n"
-    ostr += "};\n\n"
+    def lines():
+        yield "# Automatically generated. Do not edit.\n\n"
+        yield "redef Site::local_nets = {\n"
+        for (cidr, tag) in nets:
+            if tag:
+                yield "\t%s,\t# %s\n" % (cidr, tag)
+            else:
+                yield "\t%s,\n" % cidr
+        yield "};\n\n"
 
     try:
         with open(os.path.join(path, "local-networks.bro"), "w") as out:
-            out.write(ostr)
+            out.writelines(lines())
     except IOError as e:
         cmdout.error("failed to write file: %s" % e)
         return False
@@ -1,10 +1,45 @@
+# The broctl lock.  Usually, the lock file is locked with flock(), which
+# supports shared (read-only) and exclusive locks, and lets waiting
+# processes continue as soon as the lock is released.  If HaveNFS is set
+# (or flock is not available), then an exclusive lock is taken by creating
+# a hard link to the lock file, which also works on NFS.
+#
+# Commands operating on individual nodes take a shared lock and then an
+# exclusive lock of each of the nodes (using a lock file per node), so that
+# such commands can run concurrently as long as their nodes are disjoint.
+# Cluster-wide commands take an exclusive lock, which excludes all others.
+# A command may change the runtime state of a node only if it holds the
+# exclusive lock or the lock of that node (commands holding only the
+# shared lock must not change any node state).
+
+import errno
+import logging
 import os
+import threading
 import time
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 from BroControl import config
 
 lockCount = 0
 
+# True if the lock currently held is a shared lock.
+lockShared = False
+
+# File descriptor of the lock file if the lock is held with flock().
+lockFd = None
+
+# File descriptors of the lock files of the locked nodes (indexed by node
+# name).
+nodeLockFds = {}
+
+# Number of seconds to wait for the lock before giving up.
+_LOCK_TIMEOUT = 30
+
 # Return: 0 if no lock, >0 for PID of lock, or -1 on error
 def _break_lock(cmdout):
     from BroControl import execute
@@ -90,14 +125,200 @@ def _release_lock(cmdout):
     except OSError as e:
         cmdout.error("cannot remove lock file: %s" % e)
 
-def lock(cmdout, showwait=True):
-    global lockCount
+# Returns the PID (as a string) written into the lock file by the current
+# holder of an exclusive lock, or an empty string if not known.
+def _lock_owner(fd):
+    try:
+        os.lseek(fd, 0, os.SEEK_SET)
+        return os.read(fd, 32).decode("ascii", "replace").strip()
+    except OSError:
+        return ""
+
+# Wait up to "timeout" seconds for a flock() lock on the file descriptor.
+# The blocking flock() call is done in a separate thread, so that we get the
+# lock as soon as it's released, but can still give up after the timeout.
+# If we give up, then the thread closes the file descriptor when it gets
+# the lock eventually (which releases the lock again).
+def _wait_flock(fd, mode, timeout):
+    done = threading.Event()
+    mutex = threading.Lock()
+    status = {"abandoned": False, "error": None}
+
+    def wait():
+        try:
+            fcntl.flock(fd, mode)
+        except (IOError, OSError) as err:
+            status["error"] = err
+
+        with mutex:
+            if status["abandoned"]:
+                os.close(fd)
+            done.set()
+
+    thread = threading.Thread(target=wait)
+    thread.daemon = True
+    thread.start()
+
+    done.wait(timeout)
+    with mutex:
+        if not done.is_set():
+            status["abandoned"] = True
+            return False
+
+    if status["error"]:
+        raise status["error"]
+
+    return True
+
+# Lock a file with flock(), waiting until the given deadline (a Unix
+# timestamp) at most.  "what" describes the lock in messages.  Returns the
+# file descriptor of the locked file, or None if the lock was not acquired.
+def _flock(cmdout, path, shared, showwait, deadline, what):
+    mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    except OSError as err:
+        cmdout.error("cannot acquire %s: %s" % (what, err))
+        return None
+
+    try:
+        try:
+            fcntl.flock(fd, mode | fcntl.LOCK_NB)
+        except (IOError, OSError) as err:
+            if err.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+
+            if showwait:
+                owner = _lock_owner(fd)
+                if owner:
+                    cmdout.info("waiting for %s (owned by PID %s) ..." % (what, owner))
+                else:
+                    cmdout.info("waiting for %s ..." % what)
+
+            start = time.time()
+            if not _wait_flock(fd, mode, max(deadline - start, 0)):
+                # The file descriptor now belongs to the waiting thread.
+                logging.debug("gave up waiting for %s after %.3f s", what, time.time() - start)
+                return None
+
+            logging.debug("waited %.3f s for %s", time.time() - start, what)
+
+        if not shared:
+            # Tell processes waiting for the lock who has it.
+            os.ftruncate(fd, 0)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, ("%d\n" % os.getpid()).encode("ascii"))
+
+    except (IOError, OSError) as err:
+        cmdout.error("cannot acquire %s: %s" % (what, err))
+        os.close(fd)
+        return None
+
+    return fd
+
+# Release a lock taken by _flock().
+def _funlock(cmdout, fd, shared):
+    try:
+        if not shared:
+            os.ftruncate(fd, 0)
+    except OSError as err:
+        cmdout.error("cannot truncate lock file: %s" % err)
+
+    # Closing the file releases the lock.
+    os.close(fd)
+
+# Returns the directory containing the lock files of the nodes.
+def _node_lock_dir():
+    return config.Config.lockfile + ".nodes"
+
+# Lock the lock file with flock(), and then each of the given nodes (if
+# any).  Returns True if all locks were acquired.
+def _flock_all(cmdout, showwait, shared, nodes):
+    global lockFd
+
+    lockdir = os.path.dirname(config.Config.lockfile)
+    if not os.path.exists(lockdir):
+        cmdout.info("creating directory for lock file: %s" % lockdir)
+        os.makedirs(lockdir)
+
+    deadline = time.time() + _LOCK_TIMEOUT
+
+    lockFd = _flock(cmdout, config.Config.lockfile, shared, showwait, deadline, "lock")
+    if lockFd is None:
+        return False
+
+    if not nodes:
+        return True
+
+    nodedir = _node_lock_dir()
+    try:
+        os.mkdir(nodedir)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            cmdout.error("cannot create directory for node locks: %s" % err)
+            _release_all(cmdout, shared)
+            return False
+
+    # Always lock the nodes in the same order, so that processes locking
+    # overlapping sets of nodes cannot deadlock.
+    for name in sorted(set(nodes)):
+        fd = _flock(cmdout, os.path.join(nodedir, name), False, showwait, deadline, "lock of node %s" % name)
+        if fd is None:
+            _release_all(cmdout, shared)
+            return False
+
+        nodeLockFds[name] = fd
+
+    return True
+
+# Release all locks taken by _flock_all().
+def _release_all(cmdout, shared):
+    global lockFd
+
+    for name in sorted(nodeLockFds, reverse=True):
+        _funlock(cmdout, nodeLockFds.pop(name), False)
+
+    _funlock(cmdout, lockFd, shared)
+    lockFd = None
+
+# Acquire the lock.  A shared lock can be held by several processes at the
+# same time (but not while another process holds an exclusive lock).  If a
+# list of node names is given, then a shared lock is taken along with an
+# exclusive lock of each of the nodes.  With HaveNFS, all locks are
+# exclusive.  Returns True if the lock was acquired.
+def lock(cmdout, showwait=True, shared=False, nodes=None):
+    global lockCount, lockShared
+
+    if nodes:
+        nodes = [name.lower() for name in nodes]
+        shared = True
 
     if lockCount > 0:
-        # Already locked.
+        # Already locked.  A shared lock cannot be turned into an exclusive
+        # one (and no more nodes can be locked), because another process
+        # might be waiting to do the same.
+        if lockShared and not shared:
+            cmdout.error("cannot acquire exclusive lock while holding a shared lock")
+            return False
+
+        if lockShared and nodes:
+            missing = sorted(set(nodes) - set(nodeLockFds))
+            if missing:
+                cmdout.error("cannot acquire lock of nodes not locked before: %s" % ", ".join(missing))
+                return False
+
         lockCount += 1
         return True
 
+    if fcntl and not config.Config.havenfs:
+        if not _flock_all(cmdout, showwait, shared, nodes):
+            return False
+
+        lockCount = 1
+        lockShared = shared
+        return True
+
     lockpid = _acquire_lock(cmdout)
     if lockpid < 0:
         return False
@@ -111,14 +332,15 @@ def lock(cmdout, showwait=True):
             time.sleep(1)
 
             count += 1
-            if count > 30:
+            if count > _LOCK_TIMEOUT:
                 return False
 
     lockCount = 1
+    lockShared = False
     return True
 
 def unlock(cmdout):
-    global lockCount
+    global lockCount, lockShared
 
     if lockCount == 0:
         cmdout.error("mismatched lock/unlock")
@@ -129,6 +351,10 @@ def unlock(cmdout):
         lockCount -= 1
         return
 
-    _release_lock(cmdout)
+    if lockFd is not None:
+        _release_all(cmdout, lockShared)
+    else:
+        _release_lock(cmdout)
 
     lockCount = 0
+    lockShared = False
@@ -7,7 +7,7 @@ import copy
 
 from BroControl import doc
 
-class Node:
+class Node(object):
     """Class representing one node of the BroControl maintained setup. In
     standalone mode, there's always exactly one node of type ``standalone``. In
     a cluster setup, there is zero or one of type ``logger``, exactly one of
@@ -107,31 +107,104 @@ class Node:
              "lb_procs": 1, "lb_method": 1, "lb_interfaces": 1,
              "pin_cpus": 1, "env_vars": 1, "count": 1}
 
+    # Incremented whenever a key is added, so that cached descriptions of
+    # nodes are rebuilt.
+    _keygen = 0
 
-    def __init__(self, config, name):
+    # The attribute values of a node are stored in two dictionaries:
+    # "_defaults" holds the values from the node's section in node.cfg (it
+    # is shared with all nodes copied from this one, and is never modified),
+    # and "_values" holds the values that were set for this node only.
+    # "_cache" holds the node's items and description once they are needed.
+    # It is discarded whenever an attribute is set, or a mutable value
+    # (e.g. env_vars) was modified in place (see _get_cache()).
+    __slots__ = ("name", "_config", "_defaults", "_values", "_cache")
+
+    def __init__(self, config, name, defaults=None):
         """Instantiates a new node of the given name."""
-        self.name = name
-        self._config = config
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "_config", config)
+        object.__setattr__(self, "_defaults", defaults if defaults is not None else {})
+        object.__setattr__(self, "_values", {})
+        object.__setattr__(self, "_cache", None)
+
+    def __getattr__(self, key):
+        if key in Node.__slots__:
+            raise AttributeError(key)
+
+        try:
+            val = self._values[key]
+        except KeyError:
+            try:
+                val = self._defaults[key]
+            except KeyError:
+                if key in Node._keys:
+                    return ""
+                raise AttributeError("'Node' object has no attribute '%s'" % key)
+
+            if isinstance(val, (dict, list)):
+                # The caller might modify the value, which must not affect
+                # any other node sharing it.
+                val = copy.copy(val)
+                self._values[key] = val
+
+        return val
 
-        for key in Node._keys:
-            self.__dict__[key] = ""
+    def __setattr__(self, key, val):
+        if key in Node.__slots__:
+            object.__setattr__(self, key, val)
+        else:
+            self._values[key] = val
+
+        object.__setattr__(self, "_cache", None)
 
     def __str__(self):
         return self.name
 
     def copy(self):
-        n = Node(self._config, self.name)
-
-        for key in self.__dict__:
-            if key.startswith("_"):
-                # This is to avoid copying _config, which causes problems.
-                setattr(n, key, getattr(self, key))
-            else:
-                # Must make a copy of some config items (e.g. env_vars) so that
-                # changes to the value only affect one node.
-                setattr(n, key, copy.copy(getattr(self, key)))
+        # The new node shares all values with this one.  Values that were
+        # set for this node are moved into a new shared dictionary first
+        # (so that any node copied from this one earlier is not affected).
+        if self._values:
+            defaults = dict(self._defaults)
+            defaults.update(self._values)
+            object.__setattr__(self, "_defaults", defaults)
+            object.__setattr__(self, "_values", {})
+
+        return Node(self._config, self.name, self._defaults)
+
+    # Returns a dictionary of all attributes (with their original values)
+    # of the node.
+    def attrs(self):
+        d = dict.fromkeys(Node._keys, "")
+        d.update(self._defaults)
+        d.update(self._values)
+        d["name"] = self.name
+        return d
 
-        return n
+    # Returns a list of the (key, value) tuples of the mutable values (dicts
+    # and lists) of the node.  Only the values in "_values" can be modified
+    # in place, because the shared ones are copied before they are returned
+    # (see __getattr__).
+    def _mutable_values(self):
+        return [(k, v) for (k, v) in self._values.items() if isinstance(v, (dict, list))]
+
+    # Returns a sorted list of (key, value) tuples of all attributes
+    # (including "_config"), which is computed only once (until the node
+    # changes).  The list is stored in "_cache", along with the node's items
+    # and description once they are needed, and a copy of the mutable values
+    # so that we notice when one of them was modified in place.
+    def _get_cache(self):
+        cache = self._cache
+        if cache is None or cache[0] != Node._keygen or cache[4] != self._mutable_values():
+            d = self.attrs()
+            d["_config"] = self._config
+            attrs = [(k, d[k]) for k in sorted(d)]
+            mutables = [(k, copy.copy(v)) for (k, v) in self._mutable_values()]
+            cache = [Node._keygen, attrs, None, None, mutables]
+            object.__setattr__(self, "_cache", cache)
+
+        return cache
 
     def items(self):
         """Returns a list of (key, value) tuples, sorted by key, of a node."""
@@ -142,7 +215,11 @@ class Node:
             else:
                 return str(v)
 
-        return [(k, tostr(self.__dict__[k])) for k in sorted(self.__dict__.keys())]
+        cache = self._get_cache()
+        if cache[2] is None:
+            cache[2] = [(k, tostr(v)) for (k, v) in cache[1]]
+
+        return list(cache[2])
 
     @doc.api
     def describe(self):
@@ -159,7 +236,11 @@ class Node:
 
         # Do not output attributes starting with underscore, because they are
         # for internal use and don't provide useful information to the user.
-        return ("%15s - " % self.name) + " ".join(["%s=%s" % (k, fmt(self.__dict__[k])) for k in sorted(self.__dict__.keys()) if not k.startswith("_")])
+        cache = self._get_cache()
+        if cache[3] is None:
+            cache[3] = ("%15s - " % self.name) + " ".join(["%s=%s" % (k, fmt(v)) for (k, v) in cache[1] if not k.startswith("_")])
+
+        return cache[3]
 
     def to_dict(self):
         d = dict(self.items())
@@ -174,60 +255,49 @@ class Node:
 
     def setPID(self, pid):
         """Stores the process ID of the node's Bro process."""
-        key = "%s-pid" % self.name
-        self._config.set_state(key, pid)
-        key = "%s-host" % self.name
-        self._config.set_state(key, self.host)
+        self._config.set_node_state(self.name, pid=pid, host=self.host)
 
     @doc.api
     def getPID(self):
         """Returns the process ID of the node's Bro process if running, and
         None otherwise."""
-        key = "%s-pid" % self.name
-        return self._config.get_state(key)
+        return self._config.get_node_state(self.name, "pid")
 
     def clearPID(self):
         """Clears the stored process ID for the node's Bro process, indicating
         that it is no longer running."""
-        key = "%s-pid" % self.name
-        self._config.set_state(key, None)
+        self._config.set_node_state(self.name, pid=None)
 
     def setCrashed(self):
         """Marks node's Bro process as having terminated unexpectedly."""
-        key = "%s-crashed" % self.name
-        self._config.set_state(key, True)
+        self._config.set_node_state(self.name, crashed=True)
 
     def clearCrashed(self):
         """Clears the mark for the node's Bro process having terminated
         unexpectedly."""
-        key = "%s-crashed" % self.name
-        self._config.set_state(key, False)
+        self._config.set_node_state(self.name, crashed=False)
 
     @doc.api
     def hasCrashed(self):
         """Returns True if the node's Bro process has exited abnormally."""
-        key = "%s-crashed" % self.name
-        val = self._config.get_state(key)
+        val = self._config.get_node_state(self.name, "crashed")
         if val is None:
             val = False
         return val
 
     def getExpectRunning(self):
         """Returns True if we expect the node's Bro process to be running."""
-        key = "%s-expect-running" % self.name
-        val = self._config.get_state(key)
+        val = self._config.get_node_state(self.name, "expect_running")
         if val is None:
             val = False
         return val
 
     def setExpectRunning(self, val):
-        key = "%s-expect-running" % self.name
-        self._config.set_state(key, val)
+        self._config.set_node_state(self.name, expect_running=val)
 
     def setPort(self, port):
         """Set the Bro port this node is using."""
-        key = "%s-port" % self.name
-        self._config.set_state(key, port)
+        self._config.set_node_state(self.name, port=port)
 
     @doc.api
     def getPort(self):
@@ -235,8 +305,7 @@ class Node:
         communication system is listening on for incoming connections, or -1 if
         no such port has been set yet.
         """
-        key = "%s-port" % self.name
-        return self._config.get_state(key) or -1
+        return self._config.get_node_state(self.name, "port") or -1
 
     @staticmethod
     def addKey(kw):
@@ -246,6 +315,7 @@ class Node:
         # We need to convert to lowercase here because Python's configparser
         # automatically converts keys to lowercase when reading node.cfg.
         Node._keys[kw.lower()] = 1
+        Node._keygen += 1
 
 
 # The sorting order for node types used by the sorting functions below
@@ -39,6 +39,12 @@ options = [
            "The number of seconds to wait before assuming Broccoli communication events have timed out."),
     Option("CommandTimeout", 60, "int", Option.USER, False,
            "The number of seconds to wait for a command to return results."),
+    Option("HostLookupTTL", 3600, "int", Option.USER, False,
+           "The number of seconds that the IP addresses of the host names in the node configuration are cached in the state database (zero to disable caching).  After this time, the cached addresses are still used while they are looked up again in the background (and if that lookup fails)."),
+    Option("HostLookupTimeout", 5, "int", Option.USER, False,
+           "The number of seconds to wait for a host name lookup when no addresses for that host name are cached."),
+    Option("StateDBTimeout", 30, "int", Option.USER, False,
+           "The number of seconds to wait for access to the state database when another broctl process is using it."),
     Option("BroPort", 47760, "int", Option.USER, False,
            "The TCP port number that Bro will listen on. For a cluster configuration, each node in the cluster will automatically be assigned a subsequent port to listen on."),
     Option("LogRotationInterval", 3600, "int", Option.USER, False,
@@ -84,12 +90,18 @@ options = [
            "Minimum percentage of disk space available before broctl cron mails a warning.  If this value is 0, then no warning will be sent."),
     Option("StatsLogEnable", 1, "bool", Option.USER, False,
            "True to enable BroControl to write statistics to the stats.log file."),
+    Option("CapstatsSource", "capstats", "string", Option.USER, False,
+           "Source of the network interface statistics reported by the capstats command and written to the stats.log file: 'capstats' measures the traffic with the capstats tool, and 'counters' computes it from the packet counters of the interfaces (including the packets lost by PF_RING, if used) without capturing any packets (Linux only)."),
     Option("StatsLogExpireInterval", 0, "int", Option.USER, False,
-           "Number of days entries in the stats.log file are kept (zero means never expire)."),
+           "Number of days entries in the stats.log file are kept (zero means never expire).  The archived stats are stored in one file per day, which is removed once all its entries are older than this."),
+    Option("StatsRollupExpireInterval", 0, "int", Option.USER, False,
+           "Number of days the hourly and daily rollups of the statistics (minimum, average, and maximum of each value) are kept (zero means never expire).  This is typically much longer than StatsLogExpireInterval."),
     Option("CrashExpireInterval", 0, "int", Option.USER, False,
            "Number of days that crash directories are kept (zero means never expire)."),
     Option("LogExpireInterval", "0", "string", Option.USER, False,
            "Time interval that archived log files are kept (a value of 0 means log files never expire).  The time interval is expressed as an integer followed by one of the following time units: day, hr, min."),
+    Option("CronTaskIntervals", "", "string", Option.USER, False,
+           "A space-separated list of <task>=<interval> entries that specify how often the cron command performs the given tasks (empty string means all tasks are performed each time).  The tasks are check-hosts, stats, disk-space, expire-logs, expire-stats, expire-crash, and http-stats, and the time interval is expressed as an integer followed by one of the following time units: day, hr, min.  For example, 'expire-logs=1hr expire-crash=1day' expires log files once per hour and crash directories once per day."),
     Option("KeepLogs", "", "string", Option.USER, False,
            "A space-separated list of filename shell patterns of expired log files to keep (empty string means don't keep any expired log files). The filename shell patterns are not regular expressions and do not include any directories. For example, specifying 'conn.* dns*' will prevent any expired log files with filenames starting with 'conn.' or 'dns' from being removed. Finally, note that this option is ignored if log files never expire."),
     Option("BroArgs", "", "string", Option.USER, False,
@@ -206,7 +218,7 @@ options = [
     Option("StateFile", "${SpoolDir}/state.db", "string", Option.AUTOMATIC, False,
            "File storing the current broctl state."),
     Option("LockFile", "${SpoolDir}/lock", "string", Option.AUTOMATIC, False,
-           "Lock file preventing concurrent shell operations."),
+           "Lock file preventing concurrent shell operations.  Unless HaveNFS is set, commands that only report the status of the nodes (such as status and df) can run concurrently, and so can the start, stop, and restart commands for disjoint sets of nodes (using lock files in the directory <LockFile>.nodes)."),
 
     Option("DebugLog", "${SpoolDir}/debug.log", "string", Option.AUTOMATIC, False,
            "Log file for debugging information."),
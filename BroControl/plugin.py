@@ -399,6 +399,24 @@ class Plugin(object):
         """
         return
 
+    @doc.api("override")
+    def broProcessStats(self, node, procs):
+        """Called when BroControl has sampled the resource usage of the Bro
+        processes of Node_ *node* (for the ``top`` command, and when ``cron``
+        writes the stats.log file). *procs* is a list of dicts, one for
+        each process, which map the tags "pid", "proc" ("parent" or
+        "child"), "vsize", "rss", "cpu", and "cmd" to their values. On
+        Linux, the dicts also contain the tags "cswch" and "nvcswch"
+        (voluntary and involuntary context switches per second), "rdbytes"
+        and "wrbytes" (bytes read and written per second, if known), and
+        "threads" (a list of dicts with the tags "tid", "name", and "cpu"
+        for each thread).
+
+        This method can be overridden by derived classes. The default
+        implementation does nothing.
+        """
+        return
+
     # Per-command help currently not supported by broctl. May add this later.
     #
     #@doc.api(override):
@@ -80,6 +80,12 @@ class PluginRegistry:
         for p in self._activeplugins():
             p.broProcessDied(node)
 
+    def broProcessStats(self, node, procs):
+        """Calls all plugins Plugin.broProcessStats_ methods; see there for
+        parameter semantics."""
+        for p in self._activeplugins():
+            p.broProcessStats(node, procs)
+
     def cmdPreWithNodes(self, cmd, nodes, *args):
         """Executes the ``cmd_<XXX>_pre`` function for a command taking a list
         of nodes as its first argument. All other arguments are passed on.
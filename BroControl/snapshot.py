@@ -0,0 +1,165 @@
+# A cache of the parts of the broctl configuration that are expensive to
+# determine (e.g. because external commands or DNS lookups are needed), so
+# that they don't need to be determined again each time broctl starts.
+#
+# Each cached value is stored along with a key describing everything the
+# value depends on (e.g. the identity of a config file), and a cached value
+# is used only if its key still matches.
+
+import copy
+import json
+import os
+import time
+
+from BroControl import py3bro
+from BroControl.version import VERSION
+
+
+# Files modified less than this many seconds ago are never cached, because
+# (depending on the timestamp resolution of the filesystem) another change
+# in the same second might not change the modification time.
+_MIN_FILE_AGE = 2
+
+
+# Return a list identifying the current version of a file (without reading
+# the file), or None if the file does not exist or was modified too recently
+# to be cached.
+def file_id(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    if st.st_mtime > time.time() - _MIN_FILE_AGE:
+        return None
+
+    return [st.st_dev, st.st_ino, st.st_size, st.st_mtime]
+
+
+# Return a list identifying the current contents of a directory, i.e. the
+# modification times of the directory and each entry in it (without looking
+# any further into subdirectories), or None if the directory does not exist.
+def dir_id(path):
+    try:
+        entries = [["", os.stat(path).st_mtime]]
+        for name in sorted(os.listdir(path)):
+            entries.append([name, os.stat(os.path.join(path, name)).st_mtime])
+    except OSError:
+        return None
+
+    return entries
+
+
+# Return a string that is different after each reboot of this machine (or
+# an empty string if not available).
+def boot_id():
+    try:
+        with open("/proc/sys/kernel/random/boot_id", "r") as f:
+            return f.read().strip()
+    except IOError:
+        return ""
+
+
+# Convert all unicode strings (as returned by the json module on Python 2)
+# to str.
+def _to_str(obj):
+    if isinstance(obj, dict):
+        return dict((_to_str(k), _to_str(v)) for (k, v) in obj.items())
+    if isinstance(obj, list):
+        return [_to_str(v) for v in obj]
+    if isinstance(obj, unicode):
+        return obj.encode("utf-8")
+    return obj
+
+
+# Return a copy of "obj" which is exactly what we would get back after
+# saving it to the snapshot file and loading it again.
+def _normalize(obj):
+    obj = json.loads(json.dumps(obj))
+    if not py3bro.using_py3:
+        obj = _to_str(obj)
+    return obj
+
+
+class ConfigSnapshot:
+    # If "path" is None, then nothing is loaded or saved.
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.changed = False
+
+        if path:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = _normalize(json.load(f))
+        except (IOError, OSError, ValueError):
+            # Missing or corrupt snapshot files are simply ignored.
+            return
+
+        # Don't use a snapshot written by a different version of broctl.
+        if isinstance(data, dict) and data.get("version") == VERSION:
+            self.entries = data.get("entries", {})
+
+    # Returns a copy of the value stored for "name", or None if there is no
+    # such value or if it was stored with a different key.  A key of None
+    # means that the value cannot be cached.
+    def get(self, name, key):
+        if key is None:
+            return None
+
+        entry = self.entries.get(name)
+        if entry is None or entry[0] != _normalize(key):
+            return None
+
+        return copy.deepcopy(entry[1])
+
+    # Store a value (which must be serializable as JSON) for "name".  A copy
+    # of the value is stored, so later changes to the value don't affect the
+    # snapshot.
+    def set(self, name, key, value):
+        if key is None:
+            return
+
+        entry = _normalize([key, value])
+        if self.entries.get(name) != entry:
+            self.entries[name] = entry
+            self.changed = True
+
+    # Write the snapshot file if anything has changed.  Failures are ignored,
+    # because the snapshot is just a cache.
+    def save(self):
+        if not self.path or not self.changed:
+            return
+
+        tmpfile = "%s.%d.tmp" % (self.path, os.getpid())
+        try:
+            with open(tmpfile, "w") as f:
+                json.dump({"version": VERSION, "entries": self.entries}, f)
+
+            # Replace the file atomically, so that concurrent broctl
+            # processes never see a partially-written snapshot.
+            os.rename(tmpfile, self.path)
+        except (IOError, OSError):
+            try:
+                os.unlink(tmpfile)
+            except OSError:
+                pass
+            return
+
+        self.changed = False
+
+    # Discard all cached values and remove the snapshot file.  Since save()
+    # replaces the file atomically, a concurrent broctl process always sees
+    # either a complete snapshot or none (a missing file is not an error).
+    def clear(self):
+        self.entries = {}
+        self.changed = False
+
+        if self.path:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
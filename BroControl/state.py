@@ -1,14 +1,62 @@
 import json
+import re
 import sqlite3
 
 from BroControl.exceptions import RuntimeEnvironmentError
 
+# Stores a value with a new version number (one larger than the largest one
+# so far).  The version is determined while the database is locked for
+# writing, so concurrent writers can never use the same version.
+_REPLACE_STATE = "REPLACE INTO state (key, value, version) VALUES (?, ?, (SELECT IFNULL(MAX(version), 0) + 1 FROM state))"
+
+# The runtime state of each node (all columns can be NULL, meaning that
+# the value was never set).
+NODE_STATE_COLUMNS = ("pid", "host", "crashed", "expect_running", "port")
+
+_BOOL_COLUMNS = ("crashed", "expect_running")
+
+_REPLACE_NODE_STATE = "REPLACE INTO node_state (name, %s, version) VALUES (?, %s, (SELECT IFNULL(MAX(version), 0) + 1 FROM node_state))" % (", ".join(NODE_STATE_COLUMNS), ", ".join(["?"] * len(NODE_STATE_COLUMNS)))
+
+# Changes the given columns of a node's state (the "%s" is replaced with
+# "col=?, " for each column), with a new version number.
+_UPDATE_NODE_STATE = "UPDATE node_state SET %sversion=(SELECT IFNULL(MAX(version), 0) + 1 FROM node_state) WHERE name=?"
+
+# Columns of the node journal (see add_journal()).  The phase columns are
+# the durations (in seconds) of the phases of starting or stopping a node,
+# or NULL if a phase does not apply (or was not reached).
+JOURNAL_PHASES = ("mkdir", "spawn", "running", "terminate", "postterminate")
+JOURNAL_COLUMNS = ("time", "cmdid", "command", "node", "type", "event") + JOURNAL_PHASES + ("killed",)
+
+_INSERT_JOURNAL = "INSERT INTO node_journal (%s) VALUES (%s)" % (", ".join(JOURNAL_COLUMNS), ", ".join(["?"] * len(JOURNAL_COLUMNS)))
+
+# Version of the database schema (stored as the database's user_version).
+# Version 1 moved the node runtime state into the node_state table.
+_SCHEMA_VERSION = 1
+
+# Older versions of broctl stored the node state in the state table under
+# keys such as "<node>-pid".  Other keys that look similar are not node
+# state.
+_NODE_STATE_KEY = re.compile("^(.+)-(expect-running|pid|host|crashed|port)$")
+_NON_NODE_PREFIXES = ("lastpkts-", "disk-space-", "alive-", "hash-")
+
+# Returns the values to store in the node_state table for one node.
+def _node_state_row(name, row):
+    return [name] + [row.get(col) for col in NODE_STATE_COLUMNS]
+
 class SqliteState:
-    def __init__(self, path):
+    # If another process is writing to the database, then we wait up to
+    # "timeout" seconds for it to finish.  If "wal" is True, then the
+    # database uses write-ahead logging (which does not work on network
+    # filesystems).
+    def __init__(self, path, timeout=30, wal=True):
         self.path = path
+        self.wal = wal
+
+        # Nesting level of transactions (see begin()).
+        self.txdepth = 0
 
         try:
-            self.db = sqlite3.connect(self.path)
+            self.db = sqlite3.connect(self.path, timeout=timeout)
         except sqlite3.Error as err:
             raise RuntimeEnvironmentError("%s: %s\nCheck if the user running BroControl has both write and search permission to\nthe directory containing the database file and has both read and write\npermission to the database file itself." % (err, path))
 
@@ -20,14 +68,147 @@ class SqliteState:
             raise RuntimeEnvironmentError("%s: %s\nCheck if the user running BroControl has write access to the database file.\nOtherwise, the database file is possibly corrupt." % (err, path))
 
     def setup(self):
-        # Create table
+        if self.path != ":memory:":
+            self._set_journal_mode()
+
+        # Create table.  Each change of a row gives it a version number that
+        # is larger than that of any row changed before, so that readers can
+        # find out which rows have changed since they last looked.
         self.c.execute('''CREATE TABLE IF NOT EXISTS state (
-            key   TEXT  PRIMARY KEY  NOT NULL,
-            value TEXT
+            key     TEXT  PRIMARY KEY  NOT NULL,
+            value   TEXT,
+            version INTEGER  NOT NULL  DEFAULT 0
+        )''')
+
+        # Databases created by older versions of broctl don't have the
+        # version column yet.
+        self.c.execute("PRAGMA table_info(state)")
+        if "version" not in [row[1] for row in self.c.fetchall()]:
+            self.c.execute("ALTER TABLE state ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+        self.c.execute("CREATE INDEX IF NOT EXISTS state_version ON state (version)")
+
+        # Runtime state of the nodes.  The versions work just like those of
+        # the state table.
+        self.c.execute('''CREATE TABLE IF NOT EXISTS node_state (
+            name           TEXT  PRIMARY KEY  NOT NULL,
+            pid            INTEGER,
+            host           TEXT,
+            crashed        INTEGER,
+            expect_running INTEGER,
+            port           INTEGER,
+            version        INTEGER  NOT NULL  DEFAULT 0
+        )''')
+
+        self.c.execute("CREATE INDEX IF NOT EXISTS node_state_version ON node_state (version)")
+        self.c.execute("CREATE INDEX IF NOT EXISTS node_state_pid ON node_state (pid)")
+        self.c.execute("CREATE INDEX IF NOT EXISTS node_state_expect_running ON node_state (expect_running)")
+
+        self.c.execute("PRAGMA user_version")
+        schemaversion = self.c.fetchone()[0]
+        if schemaversion < 1:
+            self._migrate_node_state()
+
+        # Append-only journal of node lifecycle events (such as "started",
+        # "stopped", or "crashed"), with the durations of the phases of
+        # starting and stopping, and the broctl command that caused them.
+        self.c.execute('''CREATE TABLE IF NOT EXISTS node_journal (
+            id            INTEGER  PRIMARY KEY  AUTOINCREMENT,
+            time          REAL  NOT NULL,
+            cmdid         TEXT,
+            command       TEXT,
+            node          TEXT  NOT NULL,
+            type          TEXT,
+            event         TEXT  NOT NULL,
+            mkdir         REAL,
+            spawn         REAL,
+            running       REAL,
+            terminate     REAL,
+            postterminate REAL,
+            killed        INTEGER  NOT NULL  DEFAULT 0
+        )''')
+
+        self.c.execute("CREATE INDEX IF NOT EXISTS node_journal_event ON node_journal (event, type, time)")
+        self.c.execute("CREATE INDEX IF NOT EXISTS node_journal_node ON node_journal (node, time)")
+        self.c.execute("CREATE INDEX IF NOT EXISTS node_journal_killed ON node_journal (killed, time)")
+        self.c.execute("CREATE INDEX IF NOT EXISTS node_journal_cmdid ON node_journal (cmdid)")
+
+        # Addresses of host names, and when they were looked up.
+        self.c.execute('''CREATE TABLE IF NOT EXISTS hostaddrs (
+            host    TEXT  PRIMARY KEY  NOT NULL,
+            addrs   TEXT,
+            updated REAL
         )''')
 
+        # Setting the version always writes to the database, which is
+        # avoided if it's up to date (another process might be writing).
+        if schemaversion < _SCHEMA_VERSION:
+            self.c.execute("PRAGMA user_version=%d" % _SCHEMA_VERSION)
+
         self.db.commit()
 
+    # Move the node state from the state table into the node_state table.
+    def _migrate_node_state(self):
+        self.c.execute("SELECT key, value FROM state")
+
+        rows = {}
+        oldkeys = []
+        for (key, value) in self.c.fetchall():
+            m = _NODE_STATE_KEY.match(key)
+            if not m or "." in key or key.startswith(_NON_NODE_PREFIXES):
+                continue
+
+            name, col = m.group(1), m.group(2).replace("-", "_")
+            rows.setdefault(name, dict.fromkeys(NODE_STATE_COLUMNS))[col] = json.loads(value)
+            oldkeys.append((key,))
+
+        self.c.executemany(_REPLACE_NODE_STATE, [_node_state_row(name, row) for (name, row) in sorted(rows.items())])
+        self.c.executemany("DELETE FROM state WHERE key=?", oldkeys)
+
+    def _set_journal_mode(self):
+        # With write-ahead logging, readers don't block writers (and vice
+        # versa), and a commit needs fewer fsyncs.  The journal mode is
+        # stored in the database file, so set it back if WAL is not wanted.
+        mode = "WAL" if self.wal else "DELETE"
+        try:
+            self.c.execute("PRAGMA journal_mode=%s" % mode)
+            if self.wal:
+                self.c.execute("PRAGMA synchronous=NORMAL")
+        except sqlite3.Error:
+            # If the journal mode cannot be changed (e.g. the database is
+            # read-only), we just keep the current one.
+            pass
+
+    # Start a transaction.  Changes are not committed until the matching
+    # call of commit().  Transactions can be nested, in which case only the
+    # outermost commit() actually commits the changes.
+    def begin(self):
+        self.txdepth += 1
+
+    def commit(self):
+        if self.txdepth > 0:
+            self.txdepth -= 1
+
+        if self.txdepth == 0:
+            self._commit()
+
+    # Commit the changes made so far, even inside a transaction (which
+    # continues with the next change).
+    def flush(self):
+        self._commit()
+
+    def _commit(self):
+        try:
+            self.db.commit()
+        except sqlite3.Error as err:
+            raise RuntimeEnvironmentError("%s: %s\nCheck if the user running BroControl has write access to the database file." % (err, self.path))
+
+    # Close the database.  With write-ahead logging, this also removes the
+    # log file (which must not be left behind if the database file is ever
+    # removed).
+    def close(self):
+        self.db.close()
+
     def get(self, key):
         self.c.execute("SELECT value FROM state WHERE key=?", [key])
         records = self.c.fetchall()
@@ -38,12 +219,211 @@ class SqliteState:
     def set(self, key, value):
         value = json.dumps(value)
         try:
-            self.c.execute("REPLACE INTO state (key, value) VALUES (?,?)", [key, value])
+            self.c.execute(_REPLACE_STATE, [key, value])
         except sqlite3.Error as err:
             raise RuntimeEnvironmentError("%s: %s\nCheck if the user running BroControl has write access to the database file." % (err, self.path))
 
-        self.db.commit()
+        if not self.txdepth:
+            self._commit()
+
+    # Store several values, given as a list of (key, value) tuples.
+    def set_many(self, items):
+        rows = [(key, json.dumps(value)) for (key, value) in items]
+        if not rows:
+            return
+
+        try:
+            self.c.executemany(_REPLACE_STATE, rows)
+        except sqlite3.Error as err:
+            raise RuntimeEnvironmentError("%s: %s\nCheck if the user running BroControl has write access to the database file." % (err, self.path))
+
+        if not self.txdepth:
+            self._commit()
 
     def items(self):
         self.c.execute("SELECT key, value FROM state")
         return [(k, json.loads(v)) for (k, v) in self.c.fetchall()]
+
+    # Returns the version of the most recently changed row (zero if there
+    # are none).
+    def version(self):
+        self.c.execute("SELECT MAX(version) FROM state")
+        return self.c.fetchone()[0] or 0
+
+    # Returns a tuple (items, version), where "items" is a list of (key,
+    # value) tuples of all rows changed after the given version (or of all
+    # rows if the version is None), and "version" is the current version.
+    # If nothing has changed, then only the current version is looked up.
+    def changes(self, since=None):
+        if since is None:
+            since = -1
+        elif self.version() == since:
+            return [], since
+
+        self.c.execute("SELECT key, value, version FROM state WHERE version > ?", [since])
+        rows = self.c.fetchall()
+        version = max([since, 0] + [v for (_, _, v) in rows])
+        return [(k, json.loads(v)) for (k, v, _) in rows], version
+
+    # Returns a tuple (rows, version), where "rows" is a dictionary that
+    # maps the name of each node changed after the given version (or of all
+    # nodes if the version is None) to a dictionary of its node state
+    # columns, and "version" is the current version.
+    def node_changes(self, since=None):
+        if since is None:
+            since = -1
+        else:
+            self.c.execute("SELECT MAX(version) FROM node_state")
+            if (self.c.fetchone()[0] or 0) == since:
+                return {}, since
+
+        self.c.execute("SELECT name, %s, version FROM node_state WHERE version > ?" % ", ".join(NODE_STATE_COLUMNS), [since])
+
+        rows = {}
+        version = max(since, 0)
+        for record in self.c.fetchall():
+            row = dict(zip(NODE_STATE_COLUMNS, record[1:-1]))
+            for col in _BOOL_COLUMNS:
+                if row[col] is not None:
+                    row[col] = bool(row[col])
+
+            rows[record[0]] = row
+            version = max(version, record[-1])
+
+        return rows, version
+
+    # Store the node state of several nodes, given as a list of (name, row)
+    # tuples (where "row" is a dictionary of node state columns).  Only the
+    # columns in "row" are changed, so that concurrent changes of other
+    # columns by another process are not overwritten.
+    def set_node_states(self, rows):
+        if not rows:
+            return
+
+        try:
+            for (name, row) in rows:
+                cols = sorted(row)
+                self.c.execute("INSERT OR IGNORE INTO node_state (name) VALUES (?)", [name])
+                self.c.execute(_UPDATE_NODE_STATE % "".join(["%s=?, " % col for col in cols]), [row[col] for col in cols] + [name])
+        except sqlite3.Error as err:
+            raise RuntimeEnvironmentError("%s: %s\nCheck if the user running BroControl has write access to the database file." % (err, self.path))
+
+        if not self.txdepth:
+            self._commit()
+
+    # Returns a list of (name, pid, host) tuples of all nodes that have a
+    # PID, sorted by name.
+    def nodes_with_pid(self):
+        self.c.execute("SELECT name, pid, host FROM node_state WHERE pid IS NOT NULL ORDER BY name")
+        return self.c.fetchall()
+
+    # Returns a list of the names of all nodes that are expected to be
+    # running.
+    def nodes_expected_running(self):
+        self.c.execute("SELECT name FROM node_state WHERE expect_running=1")
+        return [row[0] for row in self.c.fetchall()]
+
+    # Append entries to the node journal, given as a list of dictionaries
+    # (missing columns are NULL).
+    def add_journal(self, entries):
+        if not entries:
+            return
+
+        rows = [[entry.get(col) for col in JOURNAL_COLUMNS] for entry in entries]
+        for row in rows:
+            row[-1] = int(bool(row[-1]))
+
+        try:
+            self.c.executemany(_INSERT_JOURNAL, rows)
+        except sqlite3.Error as err:
+            raise RuntimeEnvironmentError("%s: %s\nCheck if the user running BroControl has write access to the database file." % (err, self.path))
+
+        if not self.txdepth:
+            self._commit()
+
+    # Returns a list of node journal entries (as dictionaries), oldest
+    # first.  Entries can be restricted to a node, an event, a node type, a
+    # command ID, and to those not older than "since" (a Unix timestamp).
+    def journal(self, node=None, event=None, nodetype=None, cmdid=None, since=None):
+        where, args = self._journal_filter(node=node, event=event, type=nodetype, cmdid=cmdid, since=since)
+        self.c.execute("SELECT %s FROM node_journal%s ORDER BY id" % (", ".join(JOURNAL_COLUMNS), where), args)
+
+        entries = []
+        for row in self.c.fetchall():
+            entry = dict(zip(JOURNAL_COLUMNS, row))
+            entry["killed"] = bool(entry["killed"])
+            entries.append(entry)
+
+        return entries
+
+    # Returns the given percentile (0 to 100) of the durations of a phase
+    # (see JOURNAL_PHASES) in the journal entries of an event, or None if
+    # there are no such durations.  For example, the 95th percentile of the
+    # time workers needed to reach the RUNNING state in the last week is
+    # phase_percentile("running", 95, "started", "worker", time.time() -
+    # 7 * 86400).
+    def phase_percentile(self, phase, percentile, event, nodetype=None, since=None):
+        if phase not in JOURNAL_PHASES:
+            raise ValueError("unknown phase: %s" % phase)
+
+        where, args = self._journal_filter(event=event, type=nodetype, since=since)
+        where += "%s %s IS NOT NULL" % (" AND" if where else " WHERE", phase)
+
+        self.c.execute("SELECT COUNT(*) FROM node_journal%s" % where, args)
+        count = self.c.fetchone()[0]
+        if not count:
+            return None
+
+        # Nearest-rank method.
+        rank = max(0, int(-(-count * percentile // 100)) - 1)
+        self.c.execute("SELECT %s FROM node_journal%s ORDER BY %s LIMIT 1 OFFSET ?" % (phase, where, phase), args + [rank])
+        return self.c.fetchone()[0]
+
+    # Returns a sorted list of the names of all nodes that had to be killed
+    # (with SIGKILL) when they were stopped, optionally only considering
+    # journal entries not older than "since".
+    def killed_nodes(self, since=None):
+        where, args = self._journal_filter(killed=1, since=since)
+        self.c.execute("SELECT DISTINCT node FROM node_journal%s ORDER BY node" % where, args)
+        return [row[0] for row in self.c.fetchall()]
+
+    # Returns a tuple (where, args) with a WHERE clause (possibly empty) and
+    # its arguments for the given column values (None values are ignored).
+    def _journal_filter(self, since=None, **values):
+        conds = []
+        args = []
+        for (col, val) in sorted(values.items()):
+            if val is not None:
+                conds.append("%s=?" % col)
+                args.append(val)
+
+        if since is not None:
+            conds.append("time>=?")
+            args.append(since)
+
+        if not conds:
+            return "", args
+
+        return " WHERE " + " AND ".join(conds), args
+
+    # Returns a tuple (addrs, updated) for a host name, where "addrs" is the
+    # list of addresses and "updated" is the time they were looked up, or
+    # None if the host name is not known.
+    def get_host_addrs(self, host):
+        self.c.execute("SELECT addrs, updated FROM hostaddrs WHERE host=?", [host])
+        records = self.c.fetchall()
+        if records:
+            return json.loads(records[0][0]), records[0][1]
+        return None
+
+    # Store the addresses of several host names, given as a list of
+    # (host, addrs, updated) tuples.
+    def set_host_addrs(self, entries):
+        rows = [(host, json.dumps(addrs), updated) for (host, addrs, updated) in entries]
+        try:
+            self.c.executemany("REPLACE INTO hostaddrs (host, addrs, updated) VALUES (?,?,?)", rows)
+        except sqlite3.Error as err:
+            raise RuntimeEnvironmentError("%s: %s\nCheck if the user running BroControl has write access to the database file." % (err, self.path))
+
+        if not self.txdepth:
+            self._commit()
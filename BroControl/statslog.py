@@ -0,0 +1,118 @@
+# Functions for the stats.log file archived by "broctl cron" in the stats
+# directory.  The archive is split into one segment file per day (in UTC),
+# named "stats.log.YYYY-MM-DD", so that old entries can be expired by
+# removing whole files instead of rewriting a large file.  "stats.log"
+# itself is a symlink to the newest segment.  A stats.log file written by
+# an older version of BroControl is split into segments when the archive is
+# first updated or expired.
+
+import glob
+import os
+import time
+
+
+# Returns the day (as "YYYY-MM-DD") of the given time.
+def _day(t):
+    return time.strftime("%Y-%m-%d", time.gmtime(t))
+
+
+# Returns the day of a stats.log line, or None if the line has no timestamp.
+def _line_day(line):
+    try:
+        return _day(float(line.split(None, 1)[0]))
+    except (IndexError, ValueError):
+        return None
+
+
+# Returns the sorted list of the segment files of the archive at the given
+# path (including the path itself, at the end, if it is a stats.log file
+# that has not been split yet).  Reading these files in order gives all
+# entries of the archive.
+def segments(path):
+    result = sorted(glob.glob("%s.[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]" % path))
+
+    if os.path.isfile(path) and not os.path.islink(path):
+        result.append(path)
+
+    return result
+
+
+# Append the lines read from an iterable (e.g., a file object) to the
+# segments of their days.  Lines without a timestamp are appended to the
+# same segment as the previous line.
+def _write_lines(path, lines):
+    day = None
+    out = None
+
+    try:
+        for line in lines:
+            lineday = _line_day(line) or day or _day(time.time())
+
+            if lineday != day:
+                if out:
+                    out.close()
+
+                day = lineday
+                out = open("%s.%s" % (path, day), "a")
+
+            out.write(line)
+    finally:
+        if out:
+            out.close()
+
+
+# Point the stats.log symlink to the newest segment (or remove it if there
+# are no segments).
+def _update_link(path):
+    segs = [seg for seg in segments(path) if seg != path]
+
+    if not segs:
+        if os.path.islink(path):
+            os.unlink(path)
+        return
+
+    target = os.path.basename(segs[-1])
+    if os.path.islink(path) and os.readlink(path) == target:
+        return
+
+    tmplink = "%s.tmp" % path
+    if os.path.lexists(tmplink):
+        os.unlink(tmplink)
+    os.symlink(target, tmplink)
+    os.rename(tmplink, path)
+
+
+# Split a stats.log file written by an older version of BroControl into
+# segments.
+def _split(path):
+    if os.path.islink(path) or not os.path.isfile(path):
+        return
+
+    with open(path, "r") as f:
+        _write_lines(path, f)
+
+    os.unlink(path)
+
+
+# Append the lines read from an iterable to the archive.
+def append(path, lines):
+    _split(path)
+    _write_lines(path, lines)
+    _update_link(path)
+
+
+# Remove the segments of all days before the day containing the given time.
+# Returns the number of segments removed.
+def expire(path, before):
+    _split(path)
+
+    first = "%s.%s" % (path, _day(before))
+    count = 0
+
+    for seg in segments(path):
+        if seg < first:
+            os.unlink(seg)
+            count += 1
+
+    _update_link(path)
+    return count
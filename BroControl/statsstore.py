@@ -0,0 +1,509 @@
+# A compact, append-only store for the statistics collected by "broctl
+# cron" (see CronTasks.write_stats), which can be queried by node, metric,
+# and time range without reading everything.
+#
+# The data is partitioned by day (in UTC): there is a directory for each
+# day, which contains one segment file per node.  For long-term retention,
+# hourly and daily rollups (minimum, average, and maximum of each metric)
+# are kept in stores of their own in subdirectories, partitioned by month
+# and year.  A segment file starts
+# with a header line naming the metrics (columns) of the file, followed by
+# fixed-width records, each consisting of the time (a double) and the value
+# of each metric (a float, or NaN if there's no value at that time).  The
+# records are in time order, so the records of a time range are found with
+# a binary search in the memory-mapped file.
+
+import mmap
+import os
+import struct
+import time
+
+_MAGIC = b"BROSTATS1"
+
+_TIME = struct.Struct("<d")
+
+_NAN = float("nan")
+
+# The rollups: name (of the subdirectory), resolution in seconds, and
+# partitioning.
+ROLLUPS = (("1h", 3600, "%Y-%m"), ("1d", 86400, "%Y"))
+
+# The aggregates of each metric stored in the rollups.
+AGGREGATES = ("min", "avg", "max")
+
+# The interval of the raw data (as written by "broctl cron").
+RAW_INTERVAL = 300
+
+
+# Returns the file name of the segment of a node (node names don't contain
+# slashes, but the name of the capstats pseudo-node "$total" is awkward in
+# shell commands).
+def _segment_name(node):
+    return "%s.dat" % node.replace("$", "_")
+
+
+def _record_struct(columns):
+    return struct.Struct("<d%df" % len(columns))
+
+
+# A segment file opened for reading.
+class _Segment:
+    def __init__(self, path):
+        self.columns = []
+        self.count = 0
+        self._mm = None
+
+        with open(path, "rb") as f:
+            header = f.readline()
+            if not header.startswith(_MAGIC) or not header.endswith(b"\n"):
+                return
+
+            self.columns = header.decode("ascii").split()[1:]
+            self.offset = len(header)
+            self.record = _record_struct(self.columns)
+
+            size = os.fstat(f.fileno()).st_size
+            self.count = (size - self.offset) // self.record.size
+            if self.count:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self._mm:
+            self._mm.close()
+
+    def time(self, i):
+        return _TIME.unpack_from(self._mm, self.offset + i * self.record.size)[0]
+
+    # Returns the index of the first record with a time >= t.
+    def find(self, t):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.time(mid) < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # Returns a list of (time, value) tuples of a metric for all records
+    # with start <= time < end (either can be None).  NaN values are
+    # skipped.
+    def values(self, metric, start, end):
+        if not self.count or metric not in self.columns:
+            return []
+
+        first = self.find(start) if start is not None else 0
+        last = self.find(end) if end is not None else self.count
+
+        # Unpack only the time and the value we're looking for.
+        col = self.columns.index(metric)
+        field = struct.Struct("<d%dxf" % (4 * col))
+        size = self.record.size
+        mm = self._mm
+        offset = self.offset
+
+        result = []
+        for i in range(first, last):
+            t, val = field.unpack_from(mm, offset + i * size)
+            if val == val:
+                result.append((t, val))
+
+        return result
+
+    # Returns the records with start <= time < end (either can be None) as
+    # (time, values) tuples, where "values" is a dictionary of the metrics
+    # that have a value.
+    def records(self, start=None, end=None):
+        first = self.find(start) if start is not None else 0
+        last = self.find(end) if end is not None else self.count
+
+        result = []
+        for i in range(first, last):
+            rec = self.record.unpack_from(self._mm, self.offset + i * self.record.size)
+            vals = dict((col, val) for (col, val) in zip(self.columns, rec[1:]) if val == val)
+            result.append((rec[0], vals))
+        return result
+
+
+# Returns a sorted list of the metrics of the rows that are not in the
+# given list of columns.
+def _new_columns(columns, rows):
+    metrics = set()
+    for (t, vals) in rows:
+        metrics.update(vals)
+
+    return sorted(metrics - set(columns))
+
+
+class StatsStore:
+    def __init__(self, path, partition="%Y-%m-%d"):
+        self.path = path
+        self.partition = partition
+
+    # Returns the name of the partition containing the given time.
+    def _partition(self, t):
+        return time.strftime(self.partition, time.gmtime(t))
+
+    # Returns the store of a rollup (see ROLLUPS).
+    def rollup(self, name):
+        for (rname, resolution, partition) in ROLLUPS:
+            if rname == name:
+                return StatsStore(os.path.join(self.path, rname), partition)
+
+        raise KeyError(name)
+
+    # Append records, given as a list of (time, node, values) tuples, where
+    # "values" is a dictionary that maps metric names to numbers.  Records
+    # which are not newer than the last record of the node already stored
+    # for that day are ignored (so appending the same data again doesn't
+    # change anything).
+    def append(self, records):
+        segments = {}
+        for (t, node, vals) in records:
+            if vals:
+                segments.setdefault((self._partition(t), node), []).append((t, vals))
+
+        for ((day, node), rows) in sorted(segments.items()):
+            daydir = os.path.join(self.path, day)
+            if not os.path.isdir(daydir):
+                os.makedirs(daydir)
+
+            self._append_segment(os.path.join(daydir, _segment_name(node)), rows)
+
+    def _append_segment(self, path, rows):
+        rows.sort(key=lambda row: row[0])
+
+        columns = []
+        count = 0
+        oldrows = []
+
+        if os.path.exists(path):
+            seg = _Segment(path)
+            try:
+                columns = seg.columns
+                count = seg.count
+                if count:
+                    lasttime = seg.time(count - 1)
+                    rows = [row for row in rows if row[0] > lasttime]
+
+                newcols = _new_columns(columns, rows)
+                if count and newcols:
+                    # The records already stored need to be rewritten with
+                    # the additional columns (this happens rarely, and a
+                    # segment has the records of one day only).
+                    oldrows = seg.records()
+            finally:
+                seg.close()
+
+        if not rows:
+            return
+
+        columns = columns + _new_columns(columns, rows)
+        record = _record_struct(columns)
+        header = b" ".join([_MAGIC] + [col.encode("ascii") for col in columns]) + b"\n"
+        data = b"".join([record.pack(t, *[vals.get(col, _NAN) for col in columns]) for (t, vals) in oldrows + rows])
+
+        if count and not oldrows:
+            with open(path, "r+b") as f:
+                # Overwrite an incomplete record at the end (if any).
+                f.seek(len(header) + count * record.size)
+                f.write(data)
+                f.truncate()
+        else:
+            # Write a new file and rename it, so that readers never see a
+            # partially written header.
+            tmpfile = "%s.tmp" % path
+            with open(tmpfile, "wb") as f:
+                f.write(header)
+                f.write(data)
+            os.rename(tmpfile, path)
+
+    # Returns a sorted list of the days (as "YYYY-MM-DD", or the names of
+    # the partitions of a rollup) for which data is stored.
+    def days(self):
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return []
+
+        # Partition names have the same length as e.g. "1970-01-01", and
+        # begin with a year.
+        size = len(self._partition(0))
+        return sorted(name for name in names if len(name) == size and name[:4].isdigit())
+
+    # Returns a list of the paths of the segment files of a node that might
+    # contain records with start <= time < end (either can be None).
+    def _segments(self, node, start, end):
+        days = self.days()
+        if start is not None:
+            first = self._partition(start)
+            days = [day for day in days if day >= first]
+        if end is not None:
+            last = self._partition(end)
+            days = [day for day in days if day <= last]
+
+        paths = [os.path.join(self.path, day, _segment_name(node)) for day in days]
+        return [path for path in paths if os.path.exists(path)]
+
+    # Returns a list of (time, value) tuples of a metric of a node for all
+    # records with start <= time < end (either can be None), in time order.
+    def query(self, node, metric, start=None, end=None):
+        result = []
+        for path in self._segments(node, start, end):
+            seg = _Segment(path)
+            try:
+                result += seg.values(metric, start, end)
+            finally:
+                seg.close()
+
+        return result
+
+    # Returns a list of (time, values) tuples of all records of a node with
+    # start <= time < end (either can be None), in time order.  "values" is
+    # a dictionary of the metrics that have a value.
+    def records(self, node, start=None, end=None):
+        result = []
+        for path in self._segments(node, start, end):
+            seg = _Segment(path)
+            try:
+                result += seg.records(start, end)
+            finally:
+                seg.close()
+
+        return result
+
+    # Returns the time of the first (or, if "last" is True, the last) record
+    # of a node, or None if there is none.
+    def _record_time(self, node, last=False):
+        days = self.days()
+        if last:
+            days.reverse()
+
+        for day in days:
+            path = os.path.join(self.path, day, _segment_name(node))
+            if not os.path.exists(path):
+                continue
+
+            seg = _Segment(path)
+            try:
+                if seg.count:
+                    return seg.time(seg.count - 1 if last else 0)
+            finally:
+                seg.close()
+
+        return None
+
+    # Returns a tuple of the times of the first and the last record of a
+    # node, including the rollups (which are kept longer than the raw
+    # data), or None if there is none.
+    def time_range(self, node):
+        last = self._record_time(node, last=True)
+        if last is None:
+            return None
+
+        firsts = [self._record_time(node)] + [self.rollup(name)._record_time(node) for (name, resolution, partition) in ROLLUPS]
+        return (min(t for t in firsts if t is not None), last)
+
+    # Add the rollups of the given nodes for all complete hours and days
+    # that are not rolled up yet.
+    def update_rollups(self, nodes):
+        for node in nodes:
+            rawlast = self._record_time(node, last=True)
+            if rawlast is None:
+                continue
+
+            for (name, resolution, partition) in ROLLUPS:
+                rollup = self.rollup(name)
+
+                last = rollup._record_time(node, last=True)
+                if last is not None:
+                    start = last + resolution
+                else:
+                    start = self._record_time(node) // resolution * resolution
+
+                # The period containing the last record is not complete yet.
+                end = rawlast // resolution * resolution
+                if start >= end:
+                    continue
+
+                buckets = {}
+                for (t, vals) in self.records(node, start, end):
+                    buckets.setdefault(t // resolution * resolution, []).append(vals)
+
+                rollup.append([(t, node, _aggregate(rows)) for (t, rows) in sorted(buckets.items())])
+
+    # Returns a list of (time, value) tuples of a metric of a node with
+    # start <= time < end, at a resolution suitable for that time span (so
+    # that there are about "maxpoints" values at most).  For a rollup, the
+    # given aggregate of the metric is returned.  Returns a tuple of the
+    # name of the rollup (or None for the raw data) and the list.
+    def query_span(self, node, metric, start, end, maxpoints=1000, aggregate="avg"):
+        rollup = pick_resolution(start, end, maxpoints, self._record_time(node))
+        if not rollup:
+            return (None, self.query(node, metric, start, end))
+
+        return (rollup, self.rollup(rollup).query(node, "%s:%s" % (metric, aggregate), start, end))
+
+    # Returns a sorted list of the metrics stored for a node within the
+    # given time range.
+    def metrics(self, node, start=None, end=None):
+        metrics = set()
+        for path in self._segments(node, start, end):
+            seg = _Segment(path)
+            metrics.update(seg.columns)
+            seg.close()
+
+        return sorted(metrics)
+
+    # Remove the data of all days (or partitions of a rollup) before the one
+    # containing the given time.  Returns the number removed.
+    def expire(self, before):
+        first = self._partition(before)
+        count = 0
+        for day in self.days():
+            if day >= first:
+                break
+
+            daydir = os.path.join(self.path, day)
+            for name in os.listdir(daydir):
+                os.unlink(os.path.join(daydir, name))
+            os.rmdir(daydir)
+            count += 1
+
+        return count
+
+    # Remove the rollups of all periods before the one containing the given
+    # time.
+    def expire_rollups(self, before):
+        for (name, resolution, partition) in ROLLUPS:
+            self.rollup(name).expire(before)
+
+
+# Returns the values of a rollup record for the given list of raw values
+# (dictionaries of the metrics that have a value).
+def _aggregate(rows):
+    metrics = {}
+    for vals in rows:
+        for (metric, val) in vals.items():
+            metrics.setdefault(metric, []).append(val)
+
+    result = {}
+    for (metric, vals) in metrics.items():
+        result["%s:min" % metric] = min(vals)
+        result["%s:avg" % metric] = sum(vals) / len(vals)
+        result["%s:max" % metric] = max(vals)
+
+    return result
+
+
+# Returns the name of the rollup to use for a time span (or None for the
+# raw data), so that there are about "maxpoints" values at most.  If the
+# raw data begins after the start of the span ("rawfirst", e.g. because
+# older data has expired), then a rollup is used as well.
+def pick_resolution(start, end, maxpoints=1000, rawfirst=None):
+    span = end - start
+    if span <= RAW_INTERVAL * maxpoints and (rawfirst is None or rawfirst <= start):
+        return None
+
+    for (name, resolution, partition) in ROLLUPS:
+        if span <= resolution * maxpoints:
+            return name
+
+    return ROLLUPS[-1][0]
+
+
+# Returns a string of a value for a CSV file (whole numbers are written
+# without a fraction, as in stats.log).
+def _format_value(val):
+    if val == int(val):
+        return "%d" % val
+
+    return "%.6g" % val
+
+
+# Write a CSV file (with a header line) of a node with start <= time < end
+# to a file object, at a resolution suitable for that time span (see
+# StatsStore.query_span).  The columns are given as a list of (name,
+# metrics) tuples, and the value of a column is the sum of its metrics.
+# Only the times at which all the metrics have a value are written.
+def export_csv(store, f, node, columns, start, end, maxpoints=1000):
+    values = {}
+    for (name, metrics) in columns:
+        for metric in metrics:
+            if metric not in values:
+                values[metric] = dict(store.query_span(node, metric, start, end, maxpoints)[1])
+
+    times = None
+    for vals in values.values():
+        times = set(vals) if times is None else times & set(vals)
+
+    f.write("time,%s\n" % ",".join([name for (name, metrics) in columns]))
+    for t in sorted(times or ()):
+        f.write("%s,%s\n" % (t, ",".join([_format_value(sum([values[metric][t] for metric in metrics])) for (name, metrics) in columns])))
+
+
+# Returns a list of (time, node, values) records, sorted by time and node,
+# of the stats.log lines read from a file object (in the format written by
+# CronTasks.write_stats).  The values of a node at one time are merged into
+# one record, even if other lines come in between (the interface lines of
+# all nodes follow their top lines).  Lines with values that are not
+# numbers (such as error messages) are skipped.
+def parse_statslog(f):
+    records = {}
+
+    for line in f:
+        m = line.split()
+        if len(m) != 5:
+            continue
+
+        try:
+            t = float(m[0])
+            val = float(m[4])
+        except ValueError:
+            continue
+
+        key = (t, m[1])
+        if key not in records:
+            records[key] = (t, m[1], {})
+
+        records[key][2]["%s-%s" % (m[2], m[3])] = val
+
+    return [records[key] for key in sorted(records)]
+
+
+# Import the contents of a stats.log file into the store, reading about
+# the given number of bytes at a time.  Data that is already in the store is
+# ignored, so this can be done more than once.  Returns the number of
+# records read.
+def import_statslog(store, path, chunksize=64 * 1024 * 1024):
+    count = 0
+    pending = {}
+
+    with open(path, "r") as f:
+        while True:
+            lines = f.readlines(chunksize)
+
+            for (t, node, vals) in parse_statslog(lines):
+                if (t, node) in pending:
+                    pending[(t, node)][2].update(vals)
+                else:
+                    pending[(t, node)] = (t, node, vals)
+
+            # The lines of the newest time might continue in the next
+            # chunk, so its records are kept until then (the lines of one
+            # time are written together).
+            if lines and pending:
+                newest = max(t for (t, node) in pending)
+            else:
+                newest = None
+
+            keys = sorted(key for key in pending if newest is None or key[0] < newest)
+            records = [pending.pop(key) for key in keys]
+
+            store.append(records)
+            count += len(records)
+
+            if not lines:
+                break
+
+    return count
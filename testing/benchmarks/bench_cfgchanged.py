@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+#
+# Benchmark the check whether the config files have changed (which is done
+# before nearly every command), comparing hashing the files every time
+# (the previous implementation), the check of the file stat info, and the
+# inotify-based check that is used by broctld.
+
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import benchutil
+from BroControl import config
+
+
+def make_files(tmpdir, numworkers):
+    cfgfile = os.path.join(tmpdir, "broctl.cfg")
+    nodecfg = os.path.join(tmpdir, "node.cfg")
+
+    with open(cfgfile, "w") as f:
+        f.write("MailTo = root@localhost\n" * 100)
+
+    with open(nodecfg, "w") as f:
+        f.write("[manager]\ntype=manager\nhost=localhost\n")
+        for i in range(numworkers):
+            f.write("\n[worker-%d]\ntype=worker\nhost=localhost\ninterface=eth%d\n" % (i, i % 4))
+
+    # Recently modified files are always hashed.
+    mtime = time.time() - 60
+    for fname in (cfgfile, nodecfg):
+        os.utime(fname, (mtime, mtime))
+
+    return cfgfile, nodecfg
+
+
+def legacy_is_cfg_changed(cfg):
+    for (key, fname) in (("configchksum", cfg.cfgfile), ("confignodechksum", cfg.nodecfg)):
+        with open(fname, "r") as ff:
+            if cfg.state[key] != config._get_hash(ff.read()):
+                return True
+
+    return False
+
+
+def main():
+    failed = False
+    tmpdir = tempfile.mkdtemp(prefix="bench-cfgchanged.")
+    repeat = 10000
+
+    try:
+        cfg = benchutil.make_config()
+        cfg.cfgfile, cfg.config["nodecfg"] = make_files(tmpdir, 1000)
+        cfg.state["configchksum"] = cfg._get_broctlcfg_hash(filehash=True)
+        cfg.state["confignodechksum"] = cfg._get_nodecfg_hash(filehash=True)
+
+        def run(func):
+            return benchutil.timed(lambda: [func() for i in range(repeat)])
+
+        oldsecs, old = run(lambda: legacy_is_cfg_changed(cfg))
+        statsecs, stat = run(cfg.is_cfg_changed)
+
+        cfg.watch_cfg_files()
+        if cfg.cfgwatcher:
+            watchsecs, watched = run(cfg.is_cfg_changed)
+            cfg.cfgwatcher.close()
+        else:
+            watchsecs, watched = 0, stat
+
+        if any(old) or any(stat) or any(watched):
+            failed = True
+
+        benchutil.report("%d checks (hash files)" % repeat, oldsecs)
+        benchutil.report("%d checks (stat files)" % repeat, statsecs)
+        benchutil.report("%d checks (inotify)" % repeat, watchsecs, "" if cfg.cfgwatcher else "not available")
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+#! /usr/bin/env python
+#
+# Benchmark queries of the node journal in a state database with a year's
+# worth of journal entries of a large cluster, and verify the results
+# against the same computation done in Python.
+
+from __future__ import print_function
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import benchutil
+from BroControl.state import SqliteState
+
+
+# Fill the journal with "numdays" days of a daily restart of a cluster of
+# "numworkers" workers.  Returns the list of entries.
+def fill(state, numdays, numworkers, seed=1):
+    rnd = random.Random(seed)
+    entries = []
+    for day in range(numdays):
+        t = day * 86400.0
+        cmdid = "%.6f-1" % t
+        for i in range(numworkers):
+            node = "worker-%d" % i
+            entries.append({"time": t, "cmdid": cmdid, "command": "restart", "node": node, "type": "worker",
+                            "event": "stopped", "terminate": rnd.uniform(1, 20), "postterminate": 0.5,
+                            "killed": rnd.random() < 0.001})
+            entries.append({"time": t + 30, "cmdid": cmdid, "command": "restart", "node": node, "type": "worker",
+                            "event": "started", "mkdir": 0.1, "spawn": 0.2, "running": rnd.uniform(0.5, 3)})
+
+    state.begin()
+    state.add_journal(entries)
+    state.commit()
+    return entries
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    rank = max(0, -(-len(values) * pct // 100) - 1)
+    return values[int(rank)]
+
+
+def main():
+    failed = False
+    tmpdir = tempfile.mkdtemp(prefix="bench-journal.")
+
+    try:
+        numdays, numworkers = 365, 200
+        statefile = os.path.join(tmpdir, "state.db")
+        fillsecs, entries = benchutil.timed(fill, SqliteState(statefile), numdays, numworkers)
+
+        state = SqliteState(statefile)
+        since = (numdays - 7) * 86400.0
+
+        p95secs, p95 = benchutil.timed(state.phase_percentile, "running", 95, "started", "worker", since)
+        expected = percentile([e["running"] for e in entries if e["event"] == "started" and e["time"] >= since], 95)
+        if p95 != expected:
+            print("p95 differs: %s != %s" % (p95, expected))
+            failed = True
+
+        killedsecs, killed = benchutil.timed(state.killed_nodes)
+        if killed != sorted(set(e["node"] for e in entries if e.get("killed"))):
+            print("killed nodes differ")
+            failed = True
+
+        nodesecs, journal = benchutil.timed(state.journal, "worker-1")
+        if len(journal) != 2 * numdays:
+            print("wrong number of journal entries")
+            failed = True
+
+        desc = "%d entries" % len(entries)
+        benchutil.report("%s (write)" % desc, fillsecs)
+        benchutil.report("%s (p95 worker start, last week)" % desc, p95secs, "%.3f s" % p95)
+        benchutil.report("%s (nodes killed)" % desc, killedsecs, "%d nodes" % len(killed))
+        benchutil.report("%s (journal of one node)" % desc, nodesecs)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+#! /usr/bin/env python
+#
+# Benchmark the generation of cluster-layout.bro, and verify that the output
+# is byte-identical to that of the previous implementation of make_layout
+# (which is included below for comparison).
+
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+
+import benchutil
+from BroControl import config
+from BroControl import install
+from BroControl import util
+
+
+# This is the implementation of install.make_layout prior to the streaming
+# layout writer.
+def legacy_make_layout(path, cmdout, silent=False):
+    class Port:
+        def __init__(self, startport):
+            self.p = startport
+
+        def use_port(self, node):
+            port = self.p
+            self.p += 1
+
+            if node is not None:
+                node.setPort(port)
+
+            return port
+
+    manager = config.Config.manager()
+    broport = Port(config.Config.broport)
+
+    if config.Config.standalone:
+        filename = os.path.join(path, "standalone-layout.bro")
+
+        ostr = "# Automatically generated. Do not edit.\n"
+        ostr += "redef Communication::listen_port = %s/tcp;\n" % broport.use_port(manager)
+        ostr += "redef Communication::nodes += {\n"
+        ostr += '\t["control"] = [$host=%s, $zone_id="%s", $class="control", $events=Control::controller_events],\n' % (util.format_bro_addr(manager.addr), manager.zone_id)
+        ostr += "};\n"
+
+    else:
+        filename = os.path.join(path, "cluster-layout.bro")
+        workers = config.Config.workers()
+        proxies = config.Config.proxies()
+        loggers = config.Config.loggers()
+
+        mylogger = install.Logger(loggers)
+
+        manager_is_logger = "F" if loggers else "T"
+
+        ostr = "# Automatically generated. Do not edit.\n"
+        ostr += "redef Cluster::manager_is_logger = %s;\n" % manager_is_logger
+        ostr += "redef Cluster::nodes = {\n"
+
+        ostr += '\t["control"] = [$node_type=Cluster::CONTROL, $ip=%s, $zone_id="%s", $p=%s/tcp],\n' % (util.format_bro_addr(manager.addr), config.Config.zoneid, broport.use_port(None))
+
+        for lognode in loggers:
+            ostr += '\t["%s"] = [$node_type=Cluster::LOGGER, $ip=%s, $zone_id="%s", $p=%s/tcp],\n' % (lognode.name, util.format_bro_addr(lognode.addr), lognode.zone_id, broport.use_port(lognode))
+
+        ostr += '\t["%s"] = [$node_type=Cluster::MANAGER, $ip=%s, $zone_id="%s", $p=%s/tcp, %s$workers=set(' % (manager.name, util.format_bro_addr(manager.addr), manager.zone_id, broport.use_port(manager), mylogger.next_logger())
+        ostr += ", ".join('"%s"' % s.name for s in workers)
+        ostr += ")],\n"
+
+        for p in proxies:
+            ostr += '\t["%s"] = [$node_type=Cluster::PROXY, $ip=%s, $zone_id="%s", $p=%s/tcp, %s$manager="%s", $workers=set(' % (p.name, util.format_bro_addr(p.addr), p.zone_id, broport.use_port(p), mylogger.logger, manager.name)
+            ostr += ", ".join('"%s"' % s.name for s in workers)
+            ostr += ")],\n"
+
+        for w in workers:
+            p = w.count % len(proxies)
+            ostr += '\t["%s"] = [$node_type=Cluster::WORKER, $ip=%s, $zone_id="%s", $p=%s/tcp, $interface="%s", %s$manager="%s", $proxy="%s"],\n' % (w.name, util.format_bro_addr(w.addr), w.zone_id, broport.use_port(w), w.interface, mylogger.next_logger(), manager.name, proxies[p].name)
+
+        if config.Config.timemachinehost:
+            ostr += '\t["time-machine"] = [$node_type=Cluster::TIME_MACHINE, $ip=%s, $p=%s],\n' % (config.Config.timemachinehost, config.Config.timemachineport)
+
+        ostr += "};\n"
+
+    with open(filename, "w") as out:
+        out.write(ostr)
+
+    return True
+
+
+def read_layout(path):
+    for name in ("cluster-layout.bro", "standalone-layout.bro"):
+        fname = os.path.join(path, name)
+        if os.path.exists(fname):
+            with open(fname, "r") as f:
+                return f.read()
+    return None
+
+
+# Generate the layout with both implementations and return the outputs and
+# elapsed times.
+def compare(tmpdir):
+    olddir = os.path.join(tmpdir, "old")
+    newdir = os.path.join(tmpdir, "new")
+    for d in (olddir, newdir):
+        if os.path.isdir(d):
+            shutil.rmtree(d)
+        os.makedirs(d)
+
+    ui = benchutil.BenchUI()
+    oldsecs, _ = benchutil.timed(legacy_make_layout, olddir, ui, True)
+    newsecs, ok = benchutil.timed(install.make_layout, newdir, ui, True)
+    if not ok:
+        print("make_layout failed: %s" % ui.messages)
+
+    return read_layout(olddir), read_layout(newdir), oldsecs, newsecs
+
+
+def main():
+    failed = False
+    tmpdir = tempfile.mkdtemp(prefix="bench-layout.")
+
+    try:
+        # Node configs used by the install tests, and the corresponding
+        # baseline files (if any).
+        baselinedir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Baseline", "command.install-cluster-layout")
+        cfgs = [("node.cfg__no_logger", "no-logger"),
+                ("node.cfg__logger", "logger"),
+                ("node.cfg__two_loggers", "two-loggers"),
+                ("node.cfg__cluster", None),
+                ("node.cfg__big_cluster", None),
+                ("node.cfg__pfring", None),
+                ("node.cfg__lb_interfaces", None)]
+
+        for (cfgname, baseline) in cfgs:
+            cfg = benchutil.make_config()
+            benchutil.load_node_cfg(cfg, os.path.join(benchutil.CFGDIR, "etc", cfgname))
+
+            old, new, _, _ = compare(tmpdir)
+            status = "identical" if old == new else "DIFFERENT"
+
+            if baseline:
+                with open(os.path.join(baselinedir, baseline), "r") as f:
+                    expected = f.read()
+                canon = new.replace("ip=[::1]", "ip=127.0.0.1")
+                if canon != expected:
+                    status += ", DIFFERS FROM BASELINE"
+
+            if old != new or "BASELINE" in status:
+                failed = True
+
+            print("%-40s %s" % (cfgname, status))
+
+        for numworkers in (10, 1000, 10000):
+            cfg = benchutil.make_config()
+            benchutil.add_cluster(cfg, numworkers, numproxies=1 + numworkers // 500, numloggers=2, numhosts=1 + numworkers // 20)
+
+            old, new, oldsecs, newsecs = compare(tmpdir)
+            if old != new:
+                failed = True
+
+            benchutil.report("%d workers (old)" % numworkers, oldsecs)
+            benchutil.report("%d workers (new)" % numworkers, newsecs, "identical" if old == new else "DIFFERENT")
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
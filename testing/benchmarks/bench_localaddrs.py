@@ -0,0 +1,47 @@
+#! /usr/bin/env python
+#
+# Benchmark finding the local IP addresses in-process (getifaddrs, or the
+# SIOCGIFCONF ioctl and /proc/net/if_inet6 on Linux) against running the
+# "ifconfig" and "ip" commands, and verify that all methods find the same
+# addresses.  The difference grows with the number of interfaces on the host.
+
+from __future__ import print_function
+import sys
+
+import benchutil
+from BroControl import ifaddrs
+
+
+def main():
+    failed = False
+    repeat = 20
+
+    cfg = benchutil.make_config()
+
+    methods = [("getifaddrs", ifaddrs._getifaddrs),
+               ("ioctl and /proc/net/if_inet6", lambda: (ifaddrs._linux_ipv4_addrs() or []) + (ifaddrs._linux_ipv6_addrs() or [])),
+               ("ifconfig -a (old)", cfg._get_local_addrs_ifconfig),
+               ("ip address (old)", cfg._get_local_addrs_ip)]
+
+    expected = None
+    for (name, func) in methods:
+        secs, addrs = benchutil.timed(lambda: [func() for i in range(repeat)])
+        addrs = addrs[0]
+
+        if not addrs:
+            benchutil.report(name, secs / repeat, "not available")
+            continue
+
+        if expected is None:
+            expected = set(addrs)
+
+        same = set(addrs) == expected
+        if not same:
+            failed = True
+
+        benchutil.report(name, secs / repeat, "%d addresses%s" % (len(addrs), "" if same else ", DIFFERENT"))
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+#! /usr/bin/env python
+#
+# Benchmark reading and writing very large networks.cfg files, and verify
+# that the merged list of networks covers exactly the same addresses as the
+# original list.
+
+from __future__ import print_function
+import os
+import random
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+
+import benchutil
+from BroControl import install
+
+
+# Write a networks.cfg file with "num" random IPv4 and IPv6 prefixes, many of
+# which overlap or are adjacent to each other.
+def write_networks(fname, num, seed=1):
+    rnd = random.Random(seed)
+
+    with open(fname, "w") as f:
+        f.write("# Generated by bench_networks.py\n")
+        for i in range(num):
+            if i % 10 == 9:
+                plen = rnd.randint(40, 64)
+                addr = rnd.getrandbits(plen) << (128 - plen)
+                prefix = socket.inet_ntop(socket.AF_INET6, struct.pack("!QQ", 0x20010db800000000 | (addr >> 64) & 0xffffffff, addr & 0xffffffffffffffff))
+            else:
+                plen = rnd.randint(16, 28)
+                addr = (0x0a000000 | rnd.getrandbits(24)) >> (32 - plen) << (32 - plen)
+                prefix = socket.inet_ntoa(struct.pack("!I", addr))
+
+            f.write("%s/%d\tsite-%d\n" % (prefix, plen, rnd.randint(0, 50)))
+
+
+# Return the list of merged (start, end) integer address ranges of a list
+# of networks (this is done independently of the install module).
+def ranges(prefixes):
+    result = []
+    for prefix in prefixes:
+        addr, plen = prefix.strip("[").replace("]", "").split("/")
+        if ":" in addr:
+            hi, lo = struct.unpack("!QQ", socket.inet_pton(socket.AF_INET6, addr))
+            start = (1 << 200) + (hi << 64 | lo)
+            size = 1 << (128 - int(plen))
+        else:
+            start = struct.unpack("!I", socket.inet_aton(addr))[0]
+            size = 1 << (32 - int(plen))
+        start = start // size * size
+        result.append((start, start + size - 1))
+
+    result.sort()
+    merged = []
+    for (start, end) in result:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    return merged
+
+
+# Reads the networks without merging them (as broctl did before).
+def read_networks(fname):
+    return [(prefix, tag) for (_, prefix, tag) in install._read_network_lines(fname)]
+
+
+class FakeConfig:
+    def __init__(self, fname):
+        self.localnetscfg = fname
+
+
+def main():
+    failed = False
+    tmpdir = tempfile.mkdtemp(prefix="bench-networks.")
+
+    try:
+        for num in (1000, 100000, 200000):
+            fname = os.path.join(tmpdir, "networks.cfg")
+            write_networks(fname, num)
+
+            oldsecs, old = benchutil.timed(read_networks, fname)
+            newsecs, (nets, count) = benchutil.timed(install.aggregate_networks, fname)
+
+            if ranges([cidr for (cidr, _) in old]) != ranges([cidr for (cidr, _) in nets]):
+                print("merged networks do not match original networks")
+                failed = True
+
+            # Time the whole make_local_networks (parse, merge, and write).
+            install.config.Config = FakeConfig(fname)
+            ui = benchutil.BenchUI()
+            writesecs, ok = benchutil.timed(install.make_local_networks, tmpdir, ui)
+            if not ok:
+                print("make_local_networks failed: %s" % ui.messages)
+                failed = True
+
+            outsize = os.path.getsize(os.path.join(tmpdir, "local-networks.bro"))
+
+            benchutil.report("%d prefixes (read only)" % num, oldsecs)
+            benchutil.report("%d prefixes (read and merge)" % num, newsecs, "%d -> %d networks (%.1f%%)" % (count, len(nets), 100.0 * len(nets) / count))
+            benchutil.report("%d prefixes (make_local_networks)" % num, writesecs, "%d bytes" % outsize)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+#! /usr/bin/env python
+#
+# Benchmark the memory used by the nodes of a configuration with many
+# load-balanced workers, and the time needed to read node.cfg and to
+# describe all nodes (as the "nodes" command does).  The previous Node
+# implementation (which stored every key of every node in the instance
+# dictionary) is included below for comparison.
+
+from __future__ import print_function
+import copy
+import gc
+import os
+import shutil
+import sys
+import tempfile
+
+import benchutil
+from BroControl import node as node_mod
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+# This is the implementation of Node prior to the compact representation
+# (without the methods that are not needed here).
+class LegacyNode:
+    def __init__(self, config, name):
+        self.name = name
+        self._config = config
+
+        for key in node_mod.Node._keys:
+            self.__dict__[key] = ""
+
+    def copy(self):
+        n = LegacyNode(self._config, self.name)
+
+        for key in self.__dict__:
+            if key.startswith("_"):
+                setattr(n, key, getattr(self, key))
+            else:
+                setattr(n, key, copy.copy(getattr(self, key)))
+
+        return n
+
+    def describe(self):
+        def fmt(v):
+            if isinstance(v, list):
+                v = ",".join(v)
+            elif isinstance(v, dict):
+                v = ",".join(["%s=%s" % (key, val) for (key, val) in sorted(v.items())])
+
+            return v
+
+        return ("%15s - " % self.name) + " ".join(["%s=%s" % (k, fmt(self.__dict__[k])) for k in sorted(self.__dict__.keys()) if not k.startswith("_")])
+
+
+# Write a node.cfg with "numworkers" workers in sections of 50 load-balanced
+# processes each (like the nodes created by expand_nodes).
+def write_node_cfg(fname, numworkers):
+    with open(fname, "w") as f:
+        f.write("[manager]\ntype=manager\nhost=localhost\n\n[proxy-1]\ntype=proxy\nhost=localhost\n")
+        for i in range(numworkers // 50):
+            f.write("\n[worker-%d]\ntype=worker\nhost=localhost\ninterface=eth%d\n" % (i, i % 4))
+            f.write("lb_method=pf_ring\nlb_procs=50\npin_cpus=%s\nenv_vars=A=1,B=2\n" % ",".join(str(c) for c in range(50)))
+
+
+# Create the nodes of "numsections" node.cfg sections with 50 load-balanced
+# processes each, in the same way that Configuration._check_node does.
+def expand_nodes(make, numsections):
+    nodes = []
+    for i in range(numsections):
+        values = {"type": "worker", "host": "localhost", "interface": "eth%d" % (i % 4),
+                  "lb_method": "pf_ring", "lb_procs": "50", "pin_cpus": ",".join(str(c) for c in range(50)),
+                  "env_vars": "A=1,B=2"}
+        node = make("worker-%d" % i, values)
+        node.addr = "127.0.0.1"
+        node.env_vars = {"A": "1", "B": "2"}
+        node.count = i * 50 + 1
+        node.pin_cpus = 0
+        node.name = "worker-%d-1" % i
+        nodes.append(node)
+
+        for num in range(2, 51):
+            newnode = node.copy()
+            newnode.name = "worker-%d-%d" % (i, num)
+            newnode.count = i * 50 + num
+            newnode.pin_cpus = num - 1
+            nodes.append(newnode)
+
+    return nodes
+
+
+def make_legacy(name, values):
+    n = LegacyNode(None, name)
+    for (k, v) in values.items():
+        setattr(n, k, v)
+    return n
+
+
+def make_compact(name, values):
+    return node_mod.Node(None, name, values)
+
+
+# Return the memory allocated by func(*args) (while its result is still
+# referenced), and the result.
+def allocated(func, *args):
+    if not tracemalloc:
+        return None, func(*args)
+
+    gc.collect()
+    tracemalloc.start()
+    res = func(*args)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, res
+
+
+def describe_all(nodes):
+    return [n.describe() for n in nodes]
+
+
+def fmt_size(size):
+    return "%.1f MB" % (size / 1e6) if size is not None else "(no tracemalloc)"
+
+
+def main():
+    failed = False
+    tmpdir = tempfile.mkdtemp(prefix="bench-nodes.")
+
+    try:
+        for numworkers in (1000, 10000):
+            fname = os.path.join(tmpdir, "node.cfg")
+            write_node_cfg(fname, numworkers)
+
+            cfg = benchutil.make_config()
+            readsecs, _ = benchutil.timed(benchutil.load_node_cfg, cfg, fname)
+            nodes = cfg.nodes()
+
+            oldcreate, oldnodes = benchutil.timed(expand_nodes, make_legacy, numworkers // 50)
+            newcreate, newnodes = benchutil.timed(expand_nodes, make_compact, numworkers // 50)
+            oldsize = allocated(expand_nodes, make_legacy, numworkers // 50)[0]
+            newsize = allocated(expand_nodes, make_compact, numworkers // 50)[0]
+
+            oldsecs, old = benchutil.timed(describe_all, oldnodes)
+            newsecs, new = benchutil.timed(describe_all, newnodes)
+            againsecs, again = benchutil.timed(describe_all, newnodes)
+
+            # The nodes read from node.cfg must be described in the same way
+            # as the legacy nodes (apart from the manager and proxy).
+            same = old == new == again == describe_all(nodes)[2:]
+            if not same:
+                failed = True
+
+            benchutil.report("%d workers (read node.cfg)" % numworkers, readsecs)
+            benchutil.report("%d workers (create legacy nodes)" % numworkers, oldcreate, fmt_size(oldsize))
+            benchutil.report("%d workers (create compact nodes)" % numworkers, newcreate, fmt_size(newsize))
+            benchutil.report("%d workers (legacy describe)" % numworkers, oldsecs)
+            benchutil.report("%d workers (describe)" % numworkers, newsecs, "same output" if same else "DIFFERENT OUTPUT")
+            benchutil.report("%d workers (describe again)" % numworkers, againsecs)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
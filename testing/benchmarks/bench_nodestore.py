@@ -0,0 +1,102 @@
+#! /usr/bin/env python
+#
+# Benchmark the node selection functions of the configuration (nodes(),
+# hosts(), manager(), etc.) with large numbers of nodes, and verify that they
+# return the same results as the previous implementation (which scanned and
+# sorted all nodes on each call, and is included below for comparison).
+
+from __future__ import print_function
+import sys
+
+import benchutil
+from BroControl import node as node_mod
+
+
+# This is the implementation of Configuration.nodes prior to the indexed
+# node store.
+def legacy_nodes(cfg, tag=None):
+    nodetype = node_mod.group_type(tag)
+    if nodetype == "_ALL_":
+        tag = None
+
+    nodes = []
+    for n in cfg.nodestore.values():
+        if nodetype == n.type or tag == n.name or tag is None:
+            nodes += [n]
+
+    nodes.sort(key=node_mod.sortnode)
+
+    return nodes
+
+
+def legacy_hosts(cfg, tag=None, exclude_local=False):
+    hosts = {}
+    nodelist = []
+    for node in legacy_nodes(cfg, tag):
+        if node.host in hosts:
+            continue
+
+        if exclude_local and node.addr in cfg.localaddrs:
+            continue
+
+        hosts[node.host] = 1
+        nodelist.append(node)
+
+    return nodelist
+
+
+# Do what a typical command does: select some node groups, the hosts, and
+# look up each worker by name (as Controller.update does for each result).
+def select(cfg, nodes, hosts, lookups=True):
+    result = [nodes(cfg), nodes(cfg, "workers"), nodes(cfg, "proxies"),
+              nodes(cfg, "manager"), hosts(cfg), hosts(cfg, None, True)]
+    if lookups:
+        result += [nodes(cfg, n.name)[0] for n in result[1]]
+    return result
+
+
+def indexed_nodes(cfg, tag=None):
+    return cfg.nodes(tag)
+
+
+def indexed_hosts(cfg, tag=None, exclude_local=False):
+    return cfg.hosts(tag, exclude_local)
+
+
+def main():
+    failed = False
+
+    for (numworkers, numhosts) in ((100, 10), (1000, 50), (10000, 200)):
+        cfg = benchutil.add_cluster(benchutil.make_config(), numworkers, numproxies=4, numloggers=2, numhosts=numhosts)
+        cfg.localaddrs = ["127.0.0.1", "::1", "10.0.0.1"]
+
+        # The legacy version is quadratic, so for the largest configuration
+        # only the group selections are compared.
+        if numworkers <= 1000:
+            oldsecs, old = benchutil.timed(select, cfg, legacy_nodes, legacy_hosts)
+        else:
+            oldsecs, old = None, None
+
+        newsecs, new = benchutil.timed(select, cfg, indexed_nodes, indexed_hosts)
+
+        # The index is built when first needed, so the second selection
+        # shows the cost without building it.
+        warmsecs, _ = benchutil.timed(select, cfg, indexed_nodes, indexed_hosts)
+
+        if old is not None:
+            same = old == new
+            if not same:
+                failed = True
+            benchutil.report("%d workers (scan and sort)" % numworkers, oldsecs)
+        else:
+            same = select(cfg, legacy_nodes, legacy_hosts, False) == new[:6]
+            if not same:
+                failed = True
+
+        benchutil.report("%d workers (indexed)" % numworkers, newsecs, "same nodes" if same else "DIFFERENT NODES")
+        benchutil.report("%d workers (indexed, warm)" % numworkers, warmsecs)
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+#! /usr/bin/env python
+#
+# Benchmark reading the state variables (as done each time a command takes
+# the lock) from a large state database, by reading all of them (as before)
+# and by reading only those changed since the previous read.
+
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+
+import benchutil
+from BroControl.state import SqliteState
+
+
+# Fill the state database with "num" keys like those written by cron.
+def fill(state, num):
+    items = []
+    for i in range(num):
+        kind = ("lastpkts", "disk-space", "alive")[i % 3]
+        items.append(("%s-host-%d" % (kind, i), i))
+    state.set_many(items)
+
+
+def main():
+    failed = False
+    tmpdir = tempfile.mkdtemp(prefix="bench-readstate.")
+
+    try:
+        for num in (1000, 50000):
+            statefile = os.path.join(tmpdir, "state-%d.db" % num)
+            fill(SqliteState(statefile), num)
+
+            cfg = benchutil.make_config(statefile=statefile)
+            cfg.state_store = SqliteState(statefile)
+            writer = SqliteState(statefile)
+
+            fullsecs, full = benchutil.timed(lambda: dict(cfg.state_store.items()))
+            firstsecs, _ = benchutil.timed(cfg.read_state)
+            unchangedsecs, _ = benchutil.timed(cfg.read_state)
+
+            writer.set_many([("alive-host-%d" % i, -i) for i in range(0, 300, 3)])
+            full = dict(writer.items())
+            changedsecs, _ = benchutil.timed(cfg.read_state)
+
+            same = cfg.state == full
+            if not same:
+                failed = True
+
+            benchutil.report("%d keys (read all)" % num, fullsecs)
+            benchutil.report("%d keys (first read_state)" % num, firstsecs)
+            benchutil.report("%d keys (read_state, no change)" % num, unchangedsecs)
+            benchutil.report("%d keys (read_state, 100 changed)" % num, changedsecs, "same state" if same else "DIFFERENT STATE")
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
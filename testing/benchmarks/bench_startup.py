@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+#
+# Benchmark the time needed to set up the broctl configuration at startup
+# (reading broctl.cfg and node.cfg, finding the local addresses, resolving
+# the node host names, and getting the Bro version), both without and with
+# a valid config snapshot.
+
+from __future__ import print_function
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+import benchutil
+from BroControl import config
+
+
+# Create a minimal Bro installation in "basedir" (with a fake Bro binary),
+# with a cluster config of "numworkers" workers.  Returns the path of the
+# broctl.cfg file.
+def make_install(basedir, numworkers):
+    for d in ("bin", "etc", "logs", "spool", "share/bro/site",
+              "share/broctl/scripts", "lib/broctl/plugins", "lib/bro/plugins"):
+        os.makedirs(os.path.join(basedir, d))
+
+    files = {
+        "share/broctl/scripts/make-archive-name": "#! /bin/sh\n",
+        "bin/bro": "#! /bin/sh\necho 'bro version 2.5'\n",
+        "etc/broctl.cfg": "MailTo = root@localhost\nLogRotationInterval = 3600\n",
+        "etc/networks.cfg": "10.0.0.0/8 Private IP space\n",
+    }
+
+    nodecfg = "[manager]\ntype=manager\nhost=localhost\n\n[proxy-1]\ntype=proxy\nhost=localhost\n"
+    for i in range(1, numworkers + 1):
+        nodecfg += "\n[worker-%d]\ntype=worker\nhost=localhost\ninterface=eth%d\n" % (i, i % 4)
+    files["etc/node.cfg"] = nodecfg
+
+    # Files modified in the last few seconds are never cached, so pretend
+    # that everything was installed a while ago.
+    mtime = time.time() - 60
+    for (name, content) in files.items():
+        fname = os.path.join(basedir, name)
+        with open(fname, "w") as f:
+            f.write(content)
+        os.chmod(fname, stat.S_IRWXU)
+        os.utime(fname, (mtime, mtime))
+
+    return os.path.join(basedir, "etc", "broctl.cfg")
+
+
+# Do the same configuration setup as broctl does at startup (apart from
+# loading plugins).
+def startup(basedir, cfgfile):
+    cfg = config.Configuration(basedir, cfgfile, os.path.join(basedir, "share", "bro"), benchutil.BenchUI())
+    cfg.initPostPlugins()
+    cfg.warn_broctl_install()
+    cfg._get_bro_version()
+    cfg.save_snapshot()
+    return cfg
+
+
+def main():
+    failed = False
+    tmpdir = tempfile.mkdtemp(prefix="bench-startup.")
+
+    try:
+        for numworkers in (2, 100, 1000):
+            basedir = os.path.join(tmpdir, "bro-%d" % numworkers)
+            cfgfile = make_install(basedir, numworkers)
+            snapshotfile = os.path.join(basedir, "spool", config.SNAPSHOT_FILE)
+
+            coldsecs, cold = benchutil.timed(startup, basedir, cfgfile)
+            if not os.path.exists(snapshotfile):
+                print("no snapshot file was written")
+                failed = True
+
+            warmsecs, warm = benchutil.timed(startup, basedir, cfgfile)
+
+            # The configuration must be the same in both cases.
+            same = (cold.options() == warm.options() and
+                    cold.localaddrs == warm.localaddrs and
+                    [n.describe() for n in cold.nodes()] == [n.describe() for n in warm.nodes()])
+            if not same:
+                failed = True
+
+            benchutil.report("%d workers (no snapshot)" % numworkers, coldsecs)
+            benchutil.report("%d workers (snapshot)" % numworkers, warmsecs, "same config" if same else "DIFFERENT CONFIG")
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+#! /usr/bin/env python
+#
+# Benchmark the state database writes of the "start" command for a large
+# cluster, with each state change committed separately (as before), and
+# with the changes of the command written in one transaction (which must
+# take the same number of commits for any number of nodes).  The Bro
+# processes are not actually started (the helper scripts are replaced by a
+# fake executor).
+
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+
+import benchutil
+from BroControl import control
+from BroControl.state import SqliteState
+
+
+# A state store that counts the number of commits.
+class CountingState(SqliteState):
+    def __init__(self, path, wal):
+        self.commits = 0
+        SqliteState.__init__(self, path, wal=wal)
+
+    def _commit(self):
+        self.commits += 1
+        SqliteState._commit(self)
+
+
+# An executor that pretends that all helper scripts succeed, and that each
+# Bro process reaches the RUNNING state right away.
+class FakeExecutor:
+    def __init__(self):
+        self.nextpid = 1000
+
+    def mkdirs(self, dirs):
+        return [(node, True, "") for (node, _) in dirs]
+
+    def run_helper(self, cmds, shell=False):
+        results = []
+        for (node, cmd, args) in cmds:
+            if cmd == "start":
+                self.nextpid += 1
+                output = "%d\n" % self.nextpid
+            elif cmd == "check-pid":
+                output = "running\n"
+            elif cmd == "first-line":
+                output = "RUNNING [net_run]\n"
+            else:
+                output = ""
+            results.append((node, True, output))
+        return results
+
+
+class FakePlugins:
+    def broProcessDied(self, node):
+        pass
+
+
+# A Controller that doesn't write any files when it is created.
+class BenchController(control.Controller):
+    def __init__(self, cfg):
+        self.config = cfg
+        self.ui = cfg.ui
+        self.executor = FakeExecutor()
+        self.pluginregistry = FakePlugins()
+
+
+def start(statefile, numworkers, wal, batch):
+    cfg = benchutil.make_config(statefile=statefile, spooldir=os.path.dirname(statefile),
+                                prefixes="local", broargs="", savetraces=False, memlimit="unlimited",
+                                sitepolicyscripts="local.bro", sitepolicymanager="", sitepolicylogger="", sitepolicyworker="")
+    cfg.state_store = CountingState(statefile, wal)
+    benchutil.add_cluster(cfg, numworkers, numproxies=4, numloggers=1)
+    ctl = BenchController(cfg)
+
+    cfg.state_store.commits = 0
+    if batch:
+        cfg.begin_state_batch()
+
+    results = ctl.start(cfg.nodes())
+
+    if batch:
+        cfg.end_state_batch()
+
+    return cfg.state_store.commits, results.ok, (dict(cfg.state_store.items()), cfg.state_store.node_changes()[0])
+
+
+def main():
+    failed = False
+    tmpdir = tempfile.mkdtemp(prefix="bench-state.")
+
+    try:
+        numworkers = 500
+        states = []
+        for (wal, batch, name) in ((False, False, "commit per change"),
+                                   (True, False, "commit per change, WAL"),
+                                   (True, True, "one transaction, WAL")):
+            statefile = os.path.join(tmpdir, "state-%d%d.db" % (wal, batch))
+            secs, (commits, ok, state) = benchutil.timed(start, statefile, numworkers, wal, batch)
+            if not ok:
+                failed = True
+            states.append(state)
+
+            benchutil.report("start %d workers (%s)" % (numworkers, name), secs, "%d commits" % commits)
+
+        if states[0] != states[2]:
+            print("state databases differ")
+            failed = True
+
+        # With one transaction, the number of commits doesn't depend on the
+        # number of nodes.
+        commits = []
+        for n in (numworkers // 10, numworkers):
+            statefile = os.path.join(tmpdir, "state-%d.db" % n)
+            commits.append(start(statefile, n, True, True)[0])
+
+        if commits[0] != commits[1]:
+            print("number of commits grows with the number of nodes: %s" % commits)
+            failed = True
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+#! /usr/bin/env python
+#
+# Benchmark the stats store with a year of 5-minute stats of 300 nodes:
+# appending the stats of each cron run, loading a year of data, rolling it
+# up, and querying it (compared with finding the same values in a stats.log
+# file).
+#
+# Usage: bench_statsstore.py [<days>]
+
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+
+import benchutil
+from BroControl import statsstore
+
+NUMNODES = 300
+INTERVAL = 300
+START = 1483228800.0   # 2017-01-01 00:00:00 UTC
+
+METRICS = ("parent-cpu", "parent-pid", "parent-rss", "parent-vsize",
+           "child-cpu", "child-pid", "child-rss", "child-vsize",
+           "interface-kpps", "interface-mbps", "interface-pkts")
+
+
+# Returns the stats of a node at a time (all values are exactly
+# representable as floats, so they can be compared).
+def values(node, i):
+    return dict((metric, float((node * 7 + i * 13 + n) % 1000)) for (n, metric) in enumerate(METRICS))
+
+
+# Returns the records of one cron run.
+def cron_run(i):
+    t = START + i * INTERVAL
+    return [(t, "worker-%d" % node, values(node, i)) for node in range(NUMNODES)]
+
+
+# Write the stats.log lines of the given cron runs.
+def write_statslog(fname, runs):
+    with open(fname, "w") as f:
+        for i in runs:
+            for (t, node, vals) in cron_run(i):
+                for (metric, val) in sorted(vals.items()):
+                    proc, key = metric.split("-")
+                    f.write("%s %s %s %s %s\n" % (t, node, proc, key, int(val)))
+
+
+# Find the values of a metric of a node in a stats.log file (like
+# stats-to-csv does).
+def scan_statslog(fname, node, metric):
+    proc, key = metric.split("-")
+    result = []
+    with open(fname, "r") as f:
+        for line in f:
+            m = line.split()
+            if m[1] == node and m[2] == proc and m[3] == key:
+                result.append((float(m[0]), float(m[4])))
+    return result
+
+
+def main():
+    numdays = int(sys.argv[1]) if len(sys.argv) > 1 else 365
+    perday = 86400 // INTERVAL
+
+    failed = False
+    tmpdir = tempfile.mkdtemp(prefix="bench-statsstore.")
+
+    try:
+        store = statsstore.StatsStore(os.path.join(tmpdir, "store"))
+
+        # The first day is written one cron run at a time.
+        daysecs, _ = benchutil.timed(lambda: [store.append(cron_run(i)) for i in range(perday)])
+
+        # The rest is loaded one day at a time (like importing stats.log).
+        def load():
+            for day in range(1, numdays):
+                store.append([rec for i in range(day * perday, (day + 1) * perday) for rec in cron_run(i)])
+
+        loadsecs, _ = benchutil.timed(load)
+
+        size = 0
+        for (dirpath, dirnames, filenames) in os.walk(store.path):
+            size += sum(os.path.getsize(os.path.join(dirpath, fname)) for fname in filenames)
+
+        node = 17
+        yearsecs, year = benchutil.timed(store.query, "worker-%d" % node, "parent-cpu")
+        expected = [(START + i * INTERVAL, values(node, i)["parent-cpu"]) for i in range(numdays * perday)]
+        if year != expected:
+            print("query returned wrong values")
+            failed = True
+
+        weekstart = START + (numdays - 7) * 86400
+        weeksecs, week = benchutil.timed(store.query, "worker-%d" % node, "parent-cpu", weekstart)
+
+        def query_all_nodes():
+            return [store.query("worker-%d" % n, "interface-mbps", weekstart, weekstart + 86400) for n in range(NUMNODES)]
+
+        allsecs, _ = benchutil.timed(query_all_nodes)
+
+        # Roll up all the data, then the next cron run.
+        nodes = ["worker-%d" % n for n in range(NUMNODES)]
+        rollupsecs, _ = benchutil.timed(store.update_rollups, nodes)
+        store.append(cron_run(numdays * perday))
+        cronrollupsecs, _ = benchutil.timed(store.update_rollups, nodes)
+
+        spansecs, (rollup, span) = benchutil.timed(store.query_span, "worker-%d" % node, "parent-cpu", START, START + numdays * 86400)
+        if len(span) != (numdays if rollup == "1d" else numdays * 24):
+            print("query_span returned %d values" % len(span))
+            failed = True
+
+        # The same query for the last week in a stats.log file.
+        statslog = os.path.join(tmpdir, "stats.log")
+        write_statslog(statslog, range((numdays - 7) * perday, numdays * perday))
+        scansecs, scanned = benchutil.timed(scan_statslog, statslog, "worker-%d" % node, "parent-cpu")
+        if scanned != week:
+            print("stats.log and store differ")
+            failed = True
+
+        records = numdays * perday * NUMNODES
+        benchutil.report("append one cron run (%d nodes)" % NUMNODES, daysecs / perday)
+        benchutil.report("load %d days (%d records)" % (numdays - 1, records - perday * NUMNODES), loadsecs, "%.0f records/s, %.1f MB on disk" % ((records - perday * NUMNODES) / loadsecs, size / 1e6))
+        benchutil.report("query 1 node, 1 metric, %d days" % numdays, yearsecs, "%d values" % len(year))
+        benchutil.report("query 1 node, 1 metric, 7 days", weeksecs, "%d values" % len(week))
+        benchutil.report("query %d nodes, 1 metric, 1 day" % NUMNODES, allsecs)
+        benchutil.report("roll up %d days (%d nodes)" % (numdays, NUMNODES), rollupsecs)
+        benchutil.report("roll up one cron run (%d nodes)" % NUMNODES, cronrollupsecs)
+        benchutil.report("query 1 node, 1 metric, %d days, auto resolution" % numdays, spansecs, "%d values (%s)" % (len(span), rollup))
+        benchutil.report("scan stats.log, 1 node, 1 metric, 7 days", scansecs, "%.1f MB file" % (os.path.getsize(statslog) / 1e6))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+# Helpers shared by the benchmarks in this directory.
+
+from __future__ import print_function
+import os
+import sys
+import time
+
+# Make the BroControl package in this source tree, and the stubs shared
+# with the API tests, importable.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test_api"))
+
+from BroControl import config
+from BroControl import node as node_mod
+from BroControl.state import SqliteState
+
+from stubs import UI as BenchUI, FakeConfiguration
+
+# Directory containing the config files used by the BTest tests.
+CFGDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Cfg")
+
+
+# A configuration (see the API tests) with the options that the benchmarked
+# code needs.  Keyword arguments override option values.  It becomes the
+# global configuration.
+class BenchConfiguration(FakeConfiguration):
+    def __init__(self, **options):
+        opts = {
+            "broport": 47760,
+            "zoneid": "",
+            "timemachinehost": "",
+            "timemachineport": "47757/tcp",
+            "standalone": False,
+            "spooldir": "/bro/spool",
+            "statefile": ":memory:",
+            "hostlookupttl": 3600,
+            "hostlookuptimeout": 5,
+            "statedbtimeout": 30,
+            "havenfs": False,
+            "statslogenable": False,
+        }
+        opts.update(options)
+        FakeConfiguration.__init__(self, opts, SqliteState(opts["statefile"]))
+        self.basedir = "/bro"
+        self.cfgfile = None
+        self.broscriptdir = "/bro/share/bro"
+
+        config.Config = self
+
+
+def make_config(**options):
+    return BenchConfiguration(**options)
+
+
+# Add a cluster with the given number of nodes of each type to "cfg".  The
+# workers are spread over "numhosts" hosts.
+def add_cluster(cfg, numworkers, numproxies=1, numloggers=0, numhosts=1):
+    nodestore = config.NodeStore()
+
+    def add(name, nodetype, count, host, addr, interface=""):
+        n = node_mod.Node(cfg, name)
+        n.type = nodetype
+        n.count = count
+        n.host = host
+        n.addr = addr
+        n.interface = interface
+        n.env_vars = {}
+        nodestore.add_node(n)
+
+    for i in range(1, numloggers + 1):
+        add("logger-%d" % i, "logger", i, "localhost", "127.0.0.1")
+
+    add("manager", "manager", 1, "localhost", "127.0.0.1")
+
+    for i in range(1, numproxies + 1):
+        add("proxy-%d" % i, "proxy", i, "localhost", "127.0.0.1")
+
+    for i in range(1, numworkers + 1):
+        h = i % numhosts
+        add("worker-%d" % i, "worker", i, "host-%d" % h, "10.0.%d.%d" % (h // 256, h % 256), "eth%d" % (i % 4))
+
+    cfg.nodestore = nodestore
+    cfg.config["standalone"] = False
+    return cfg
+
+
+# Read the nodes from a node.cfg file (e.g. one of the files in the testing
+# "Cfg/etc" directory) into "cfg".
+def load_node_cfg(cfg, path):
+    cfg.config["nodecfg"] = path
+    cfg.nodestore = cfg._read_nodes()
+    cfg.config["standalone"] = len(cfg.nodestore) == 1
+    return cfg
+
+
+# Call func(*args) and return a tuple (elapsed seconds, result).
+def timed(func, *args, **kwargs):
+    start = time.time()
+    res = func(*args, **kwargs)
+    return time.time() - start, res
+
+
+def report(name, secs, extra=""):
+    print("%-40s %10.4f s %s" % (name, secs, extra))
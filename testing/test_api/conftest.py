@@ -0,0 +1,31 @@
+import pytest
+
+from BroControl import node as node_mod
+
+from stubs import UI, FakeConfiguration
+
+@pytest.fixture
+def ui():
+    return UI()
+
+# Returns a function that creates a FakeConfiguration from a dictionary of
+# options and an optional state database.  Any other attributes (e.g., to
+# replace methods such as hosts()) can be given as keyword arguments.
+@pytest.fixture
+def make_config():
+    def make(options=None, state_store=None, **attrs):
+        cfg = FakeConfiguration(dict(options or {}), state_store)
+        for (key, val) in attrs.items():
+            setattr(cfg, key, val)
+        return cfg
+
+    return make
+
+# Returns a function that creates a node with the given name, type, and
+# host.
+@pytest.fixture
+def make_node():
+    def make(name, nodetype, host="localhost", cfg=None):
+        return node_mod.Node(cfg, name, {"type": nodetype, "host": host})
+
+    return make
@@ -0,0 +1,30 @@
+# Stubs shared by the API tests (see conftest.py) and the benchmarks.
+
+from BroControl import config
+from BroControl.snapshot import ConfigSnapshot
+from BroControl.state import SqliteState
+
+# A user interface that records all messages.
+class UI:
+    def __init__(self):
+        self.messages = []
+
+    def info(self, txt):
+        self.messages.append(txt)
+    error = info
+    warn = info
+
+# A configuration that doesn't read any files.  The broctl.cfg options are
+# given as a dictionary, and the state is kept in a state database in
+# memory (unless another state database is given).
+class FakeConfiguration(config.Configuration):
+    def __init__(self, options, state_store=None):
+        self.config = options
+        self._init_state(state_store or SqliteState(":memory:"))
+        self.ui = UI()
+        self.snapshot = ConfigSnapshot(None)
+        self.nodestore = config.NodeStore()
+        self.localaddrs = ["127.0.0.1", "::1"]
+        self.filehashes = {}
+        self.cfgwatcher = None
+        self.cfgchanged = None
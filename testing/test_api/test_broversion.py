@@ -0,0 +1,53 @@
+import os
+import stat
+import time
+
+# Create a fake Bro binary that counts how often it runs.
+def make_bro(tmpdir, version):
+    counter = tmpdir.join("count")
+    bro = tmpdir.join("bro")
+    bro.write("#! /bin/sh\necho x >> %s\necho 'bro version %s'\n" % (counter, version))
+    os.chmod(str(bro), stat.S_IRWXU)
+
+    # Recently modified files are never cached.
+    mtime = time.time() - 60
+    os.utime(str(bro), (mtime, mtime))
+
+    return str(bro), counter
+
+def runs(counter):
+    return len(counter.readlines())
+
+def test_bro_version_cached(tmpdir, make_config):
+    bro, counter = make_bro(tmpdir, "2.5-1")
+    cfg = make_config({"bro": bro, "pluginbrodir": str(tmpdir.mkdir("plugins"))})
+
+    assert cfg._get_bro_version() == "2.5-1"
+    assert cfg._get_bro_version() == "2.5-1"
+    assert runs(counter) == 1
+
+def test_bro_version_binary_changed(tmpdir, make_config):
+    bro, counter = make_bro(tmpdir, "2.5-1")
+    cfg = make_config({"bro": bro, "pluginbrodir": str(tmpdir.mkdir("plugins"))})
+
+    assert cfg._get_bro_version() == "2.5-1"
+    make_bro(tmpdir, "2.6-debug")
+    assert cfg._get_bro_version() == "2.6"
+    assert runs(counter) == 2
+
+def test_bro_version_plugins_changed(tmpdir, make_config):
+    bro, counter = make_bro(tmpdir, "2.5-1")
+    plugins = tmpdir.mkdir("plugins")
+    cfg = make_config({"bro": bro, "pluginbrodir": str(plugins)})
+
+    cfg._get_bro_version()
+    plugin = plugins.mkdir("Demo_Plugin")
+    os.utime(str(plugins), (0, 0))
+    cfg._get_bro_version()
+    assert runs(counter) == 2
+
+    # A plugin that changed in place (the directory is unchanged) also
+    # invalidates the cached version.
+    os.utime(str(plugin), (0, 0))
+    cfg._get_bro_version()
+    assert runs(counter) == 3
@@ -0,0 +1,23 @@
+import pytest
+
+from BroControl import control
+
+def test_capstats_values():
+    vals = control._capstats_values("1186620936.890567 pkts=12747 kpps=1.3 kbytes=10807 mbps=8.8 nic_pkts=12822 nic_drops=0")
+    assert vals == {"pkts": 12747.0, "kpps": 1.3, "kbytes": 10807.0, "mbps": 8.8, "nic_pkts": 12822.0, "nic_drops": 0.0}
+
+    for line in ("1186620936.890567", "1186620936.890567 pkts", "1186620936.890567 pkts=x"):
+        with pytest.raises(ValueError):
+            control._capstats_values(line)
+
+def test_counter_stats():
+    output = "1000.0 5000 1000000 3 1 0\n1005.0 30000 26000000 5 2 10\n"
+    assert control._counter_stats(output) == {"pkts": 25000.0, "kpps": 5.0, "kbytes": 24414.0,
+                                              "mbps": 40.0, "nic_pkts": 25000.0, "nic_drops": 13.0}
+
+    # Missing samples, and counters which were reset.
+    for output in ("1000.0 5000 1000000 3 1 0\n",
+                   "1000.0 5000 1000000 3 1 0\n1005.0 3 26000000 5 2 10\n",
+                   "no packet counters for interface: eth9\n"):
+        with pytest.raises(ValueError):
+            control._counter_stats(output)
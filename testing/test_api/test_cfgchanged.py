@@ -0,0 +1,124 @@
+import os
+import time
+
+from BroControl import config
+from BroControl import filewatch
+
+# Write a file that looks like it was modified a while ago (recently
+# modified files are always hashed).
+def write_old(f, text, age=60):
+    f.write(text)
+    mtime = time.time() - age
+    os.utime(str(f), (mtime, mtime))
+
+# Returns a configuration with a broctl.cfg and node.cfg whose hashes are
+# stored in the state, along with the two files.
+def cfg_config(make_config, tmpdir):
+    cfgfile = tmpdir.join("broctl.cfg")
+    nodecfg = tmpdir.join("node.cfg")
+    write_old(cfgfile, "MailTo = root\n")
+    write_old(nodecfg, "[bro]\ntype=standalone\nhost=localhost\n")
+
+    cfg = make_config({"nodecfg": str(nodecfg)}, cfgfile=str(cfgfile))
+    cfg.state["configchksum"] = cfg._get_broctlcfg_hash(filehash=True)
+    cfg.state["confignodechksum"] = cfg._get_nodecfg_hash(filehash=True)
+    return cfg, cfgfile, nodecfg
+
+def count_hashes(monkeypatch):
+    hashed = []
+    orig = config._get_hash
+
+    def get_hash(data):
+        hashed.append(data)
+        return orig(data)
+
+    monkeypatch.setattr(config, "_get_hash", get_hash)
+    return hashed
+
+def test_cfg_changed_stat(tmpdir, monkeypatch, make_config):
+    cfg, cfgfile, nodecfg = cfg_config(make_config, tmpdir)
+    hashed = count_hashes(monkeypatch)
+
+    assert not cfg.is_cfg_changed()
+    assert not cfg.is_cfg_changed()
+    assert hashed == []
+
+    write_old(nodecfg, "[bro]\ntype=standalone\nhost=127.0.0.1\n", age=30)
+    assert cfg.is_cfg_changed()
+    assert len(hashed) == 1
+
+def test_cfg_changed_watched(tmpdir, monkeypatch, make_config):
+    cfg, cfgfile, nodecfg = cfg_config(make_config, tmpdir)
+    cfg.watch_cfg_files()
+    if not cfg.cfgwatcher:
+        # inotify is not available on this platform.
+        return
+
+    try:
+        assert not cfg.is_cfg_changed()
+
+        # Nothing changed, so the files are not even looked at.
+        monkeypatch.setattr(config.snapshot, "file_id", None)
+        assert not cfg.is_cfg_changed()
+        monkeypatch.undo()
+
+        cfgfile.write("MailTo = someone\n")
+        for i in range(100):
+            if cfg.cfgwatcher._dirty:
+                break
+            time.sleep(0.01)
+
+        assert cfg.is_cfg_changed()
+    finally:
+        cfg.cfgwatcher.close()
+
+def test_filewatch_dead(tmpdir, monkeypatch):
+    class FailingOs:
+        path = os.path
+        close = os.close
+
+        @staticmethod
+        def read(fd, size):
+            raise OSError(9, "Bad file descriptor")
+
+    monkeypatch.setattr(filewatch, "os", FailingOs)
+    f = tmpdir.join("watched")
+    f.write("a")
+
+    watcher = filewatch.watch([str(f)])
+    if not watcher:
+        return
+
+    for i in range(100):
+        if watcher._dead:
+            break
+        time.sleep(0.01)
+
+    # If the events can't be read, then the files might always have changed.
+    assert watcher.changed()
+    assert watcher.changed()
+
+def test_filewatch(tmpdir):
+    f = tmpdir.join("watched")
+    f.write("a")
+    other = tmpdir.join("other")
+
+    watcher = filewatch.watch([str(f)])
+    if not watcher:
+        return
+
+    try:
+        assert watcher.changed()
+        assert not watcher.changed()
+
+        # Changes of other files in the same directory are ignored.
+        other.write("b")
+        time.sleep(0.1)
+        assert not watcher.changed()
+
+        # Replacing the file is noticed.
+        other.rename(f)
+        time.sleep(0.1)
+        assert watcher.changed()
+    finally:
+        watcher.close()
@@ -0,0 +1,270 @@
+import os
+import time
+
+import pytest
+
+from BroControl import cron
+from BroControl import execute
+
+BINDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "bin")
+
+# A configuration for the cron tasks, with a manager and a worker.
+@pytest.fixture
+def cron_config(tmpdir, make_config, make_node):
+    hosts = [make_node("manager", "manager"), make_node("worker-1", "worker")]
+    return make_config({"statslogenable": True, "statsdir": str(tmpdir.join("stats")),
+                        "statslog": str(tmpdir.join("stats.log")), "scriptsdir": BINDIR,
+                        "version": "1.2"}, cronintervals={}, hosts=lambda: hosts)
+
+def test_update_http_stats(monkeypatch, cron_config, ui):
+    commands = []
+    run_localcmd = execute.run_localcmd
+
+    def run(cmd, *args):
+        commands.append(cmd.split()[0])
+        return run_localcmd(cmd, *args)
+
+    monkeypatch.setattr(execute, "run_localcmd", run)
+
+    config = cron_config
+    tasks = cron.CronTasks(ui, config, None, None, None)
+
+    with open(config.statslog, "w") as f:
+        f.write("100.0 manager parent cpu 1\n100.0 manager child cpu 2\n")
+
+    tasks.update_http_stats()
+    assert ui.messages == ["creating directory for stats file: %s" % config.statsdir]
+    assert commands == ["uname", "hostname", os.path.join(BINDIR, "stats-to-csv")]
+    assert not os.path.exists(config.statslog)
+    assert not os.path.exists(config.statslog + ".cron")
+
+    metadat = os.path.join(config.statsdir, "meta.dat")
+    with open(metadat) as f:
+        meta = f.read()
+    assert meta.startswith("node manager manager localhost\nnode worker-1 worker localhost\ntime ")
+    assert "version 1.2\nos " in meta
+
+    with open(os.path.join(config.statsdir, "www", "manager.cpu.csv")) as f:
+        assert f.read() == "time,CPU\n100.0,3\n"
+
+    # The host info is cached, and meta.dat is not changed.
+    del commands[:]
+    os.utime(metadat, (0, 0))
+
+    with open(config.statslog, "w") as f:
+        f.write("400.0 manager parent cpu 3\n400.0 manager child cpu 2\n")
+
+    tasks.update_http_stats()
+    assert commands == [os.path.join(BINDIR, "stats-to-csv")]
+    assert os.stat(metadat).st_mtime == 0
+
+    with open(os.path.join(config.statsdir, "stats.log")) as f:
+        assert f.read().splitlines()[-1] == "400.0 manager child cpu 2"
+
+    # A stats.log left over by an interrupted run is processed first.
+    with open(config.statslog + ".cron", "w") as f:
+        f.write("700.0 manager parent cpu 1\n700.0 manager child cpu 1\n")
+    with open(config.statslog, "w") as f:
+        f.write("1000.0 manager parent cpu 2\n1000.0 manager child cpu 2\n")
+
+    tasks.update_http_stats()
+    assert len(ui.messages) == 1
+
+    with open(os.path.join(config.statsdir, "www", "manager.cpu.csv")) as f:
+        assert f.read() == "time,CPU\n100.0,3\n400.0,5\n700.0,2\n1000.0,4\n"
+
+    # Nothing happens if there is no stats.log in spool.
+    tasks.update_http_stats()
+    assert len(ui.messages) == 1
+    assert not os.path.exists(config.statslog + ".cron")
+
+def test_update_http_stats_store(monkeypatch, cron_config, ui):
+    commands = []
+    monkeypatch.setattr(execute, "run_localcmd", lambda cmd, *args: (commands.append(cmd.split()[0]), (True, ""))[1])
+    monkeypatch.setattr(cron, "WWW_MAXPOINTS", 100)
+
+    config = cron_config
+    tasks = cron.CronTasks(ui, config, None, None, None)
+    tasks.import_stats()
+
+    # Three days of stats.
+    store = tasks._stats_store()
+    store.append([(i * 300.0, "manager", {"parent-cpu": 1, "child-cpu": 2, "parent-vsize": 10, "child-vsize": 20})
+                  for i in range(3 * 288)])
+    store.append([(i * 300.0, "worker-1", {"parent-cpu": 1, "child-cpu": 1, "interface-mbps": 0.5})
+                  for i in range(3 * 288)])
+    store.update_rollups(["manager", "worker-1"])
+
+    with open(config.statslog, "w") as f:
+        f.write("100.0 manager parent cpu 1\n")
+
+    # The CSV files are written from the hourly rollups, instead of
+    # appending all stats with stats-to-csv.
+    tasks.update_http_stats()
+    assert os.path.join(BINDIR, "stats-to-csv") not in commands
+
+    wwwdir = os.path.join(config.statsdir, "www")
+    assert sorted(os.listdir(wwwdir)) == ["manager.cpu.csv", "manager.mem.csv", "meta.dat",
+                                         "worker-1.cpu.csv", "worker-1.mbps.csv", "worker-1.mem.csv", "worker-1.pkts.csv"]
+
+    with open(os.path.join(wwwdir, "manager.cpu.csv")) as f:
+        lines = f.read().splitlines()
+    assert (len(lines), lines[:3]) == (72, ["time,CPU", "0.0,3", "3600.0,3"])
+
+    with open(os.path.join(wwwdir, "worker-1.mbps.csv")) as f:
+        assert f.read().splitlines()[:2] == ["time,MBits/sec", "0.0,0.5"]
+
+    # A file without values has only the header line.
+    with open(os.path.join(wwwdir, "worker-1.mem.csv")) as f:
+        assert f.read() == "time,Memory\n"
+
+@pytest.mark.parametrize("spool", [False, True])
+def test_stats_store_import(spool, cron_config, ui):
+    config = cron_config
+    tasks = cron.CronTasks(ui, config, None, None, None)
+
+    os.makedirs(config.statsdir)
+    with open(os.path.join(config.statsdir, "stats.log"), "w") as f:
+        f.write("100.0 manager parent cpu 1\n")
+    if spool:
+        with open(config.statslog, "w") as f:
+            f.write("400.0 manager parent cpu 2\n")
+
+    # The store is not used until the stats.log files are imported.
+    assert tasks._stats_store() is None
+
+    tasks.import_stats()
+    store = tasks._stats_store()
+    assert os.path.exists(os.path.join(config.statsdir, "store", ".imported"))
+    assert os.path.isfile(os.path.join(config.statsdir, "stats.log"))
+
+    expected = [(100.0, 1.0)] + ([(400.0, 2.0)] if spool else [])
+    assert store.query("manager", "parent-cpu") == expected
+
+    # The files are imported only once.
+    with open(os.path.join(config.statsdir, "stats.log"), "a") as f:
+        f.write("700.0 manager parent cpu 3\n")
+    tasks.import_stats()
+    assert tasks._stats_store().query("manager", "parent-cpu") == expected
+
+def test_run_tasks(ui):
+    order = []
+
+    def task(name, secs=0):
+        def func():
+            time.sleep(secs)
+            order.append(name)
+        return func
+
+    start = time.time()
+    cron.run_tasks(ui, [("slow", task("slow", 0.5), []),
+                        ("a", task("a", 0.1), []),
+                        ("b", task("b"), ["a"]),
+                        ("c", task("c"), ["slow", "b"])])
+
+    # "a" and "b" ran while "slow" was running.
+    assert time.time() - start < 0.9
+    assert order == ["a", "b", "slow", "c"]
+    assert ui.messages == []
+
+def test_run_tasks_timeout(ui):
+    order = []
+
+    def fail():
+        raise ValueError("failed")
+
+    finished = set()
+    with pytest.raises(ValueError):
+        cron.run_tasks(ui, [("hang", lambda: time.sleep(2), []),
+                            ("fail", fail, []),
+                            ("ok", lambda: order.append("ok"), []),
+                            ("after-hang", lambda: order.append("after-hang"), ["hang"]),
+                            ("after-fail", lambda: order.append("after-fail"), ["fail"])], timeout=0.3, finished=finished)
+
+    assert order == ["ok"]
+    assert finished == set(["ok"])
+    assert len(ui.messages) == 1
+    assert ui.messages[0].startswith("cron task hang did not finish within")
+
+def test_run_tasks_not_due(ui):
+    order = []
+
+    # Dependencies on tasks which are not run are ignored.
+    cron.run_tasks(ui, [("b", lambda: order.append("b"), ["a"]),
+                          ("c", lambda: order.append("c"), ["b"])])
+
+    assert order == ["b", "c"]
+
+def test_due_tasks(monkeypatch, cron_config, ui):
+    now = [100000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+
+    config = cron_config
+    config.cronintervals = {"expire-logs": 60, "expire-crash": 24 * 60}
+    tasks = cron.CronTasks(ui, config, None, None, None)
+
+    # All tasks are due the first time, and remain due until they ran.
+    assert tasks.due_tasks() == set(cron.TASKS)
+    assert "cron-lastrun-expire-logs" not in config.state
+    tasks.record_runs(cron.TASKS, cron.TASKS)
+    assert config.state["cron-lastrun-expire-logs"] == now[0]
+
+    now[0] += 300
+    assert tasks.due_tasks() == set(cron.TASKS) - set(["expire-logs", "expire-crash"])
+    assert tasks.due_tasks(["expire-crash"]) == set(cron.TASKS) - set(["expire-logs"])
+    tasks.record_runs(["expire-crash"], ["expire-crash"])
+
+    # A task is due a bit before its interval has passed.
+    now[0] += 3600 - 300 - 30
+    assert tasks.due_tasks() == set(cron.TASKS) - set(["expire-crash"])
+
+    # A task which failed is due again on the next run.
+    tasks.record_runs(["expire-logs"], [])
+    now[0] += 60
+    assert tasks.due_tasks() == set(cron.TASKS) - set(["expire-crash"])
+    tasks.record_runs(["expire-logs"], ["expire-logs"])
+
+    now[0] += 240
+    assert tasks.due_tasks() == set(cron.TASKS) - set(["expire-logs", "expire-crash"])
+
+    assert [cron.task_schedule(name) for name in ("stats", "stats:top", "expire-stats")] == ["stats", "stats", "expire-stats"]
+
+    # A schedule of several tasks ran only if all of them succeeded.
+    tasks.due_tasks()
+    tasks.record_runs(["stats:top", "stats:capstats", "stats"], ["stats:top", "stats:capstats"])
+    assert config.state["cron-lastrun-stats"] == 100000.0
+
+def test_check_hosts_plugins(cron_config, ui):
+    import threading
+
+    class Executor:
+        def host_status(self):
+            return [("localhost", True), ("otherhost", False)]
+
+    calls = []
+
+    class PluginRegistry:
+        def hostStatusChanged(self, host, status):
+            calls.append((host, status, threading.current_thread().name))
+
+    config = cron_config
+    config.set_option("mailhostupdown", True)
+    config.set_state("alive-localhost", True)
+    config.set_state("alive-otherhost", True)
+    tasks = cron.CronTasks(ui, config, None, Executor(), PluginRegistry())
+
+    # The plugins are called only after the task has finished, from the
+    # thread calling call_plugins().  As in broctl cron, state changes are
+    # written at the end.
+    config.begin_state_batch("cron")
+    cron.run_tasks(ui, [("check-hosts", tasks.check_hosts, [])])
+    config.end_state_batch()
+    assert calls == []
+    assert ui.messages == ["host otherhost down"]
+    assert config.state["alive-otherhost"] == False
+
+    tasks.call_plugins()
+    assert calls == [("otherhost", False, threading.current_thread().name)]
+
+    tasks.call_plugins()
+    assert len(calls) == 1
@@ -0,0 +1,76 @@
+from BroControl import control
+
+DIRS = ("logdir", "bindir", "helperdir", "cfgdir", "spooldir",
+        "policydir", "libdir", "tmpdir", "staticdir", "scriptsdir")
+
+class Executor:
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.cmds = []
+
+    def run_helper(self, cmds, shell=False):
+        self.cmds += cmds
+        return [(node, node.host in self.outputs, self.outputs.get(node.host, "cannot connect")) for (node, cmd, args) in cmds]
+
+class DfController(control.Controller):
+    def __init__(self, config, executor):
+        self.config = config
+        self.executor = executor
+
+# Returns the options with the directories checked by the df command.
+def df_options():
+    options = dict((key, "/bro/%s" % key) for key in DIRS)
+    options["bindir"] = "/bro/bin"
+    options["helperdir"] = "/bro/bin"
+    return options
+
+def test_df(make_config, make_node):
+    def line(path):
+        if path == "/bro/logdir":
+            return "/dev/sdb1 2000 500 1500"
+        if path == "/bro/tmpdir":
+            return "server:/export 1000 100 900"
+        return "/dev/sda1 1000 750 250"
+
+    paths = ["/bro/logdir", "/bro/bin"] + ["/bro/%s" % key for key in DIRS[3:]]
+    executor = Executor({"host1": "\n".join(line(path) for path in paths) + "\n",
+                         "host2": "\n".join(line(path) for path in paths[1:]) + "\n"})
+
+    nodes = [make_node("manager", "manager", "host1"), make_node("worker-1", "worker", "host1"),
+             make_node("worker-2", "worker", "host2"), make_node("worker-3", "worker", "host3")]
+    results = DfController(make_config(df_options()), executor).df(nodes)
+
+    # The helper runs once per host, for each path once.
+    assert [(node.host, cmd, args) for (node, cmd, args) in executor.cmds] == [
+        ("host1", "df", paths), ("host2", "df", paths[1:]), ("host3", "df", paths[1:])]
+
+    data = dict((node.name, (success, dfs)) for (node, success, dfs) in results.nodes)
+
+    # NFS mounted volumes are ignored, and each file system is reported once.
+    success, dfs = data["manager"]
+    assert success
+    assert sorted(dfs) == ["/dev/sda1", "/dev/sdb1"]
+    assert dfs["/dev/sda1"] == ("/dev/sda1", 1000.0, 750.0, 250.0, 75.0)
+    assert dfs["/dev/sdb1"].available == 1500.0
+
+    # Workers don't check the log directory.
+    assert sorted(data["worker-1"][1]) == ["/dev/sda1"]
+    assert sorted(data["worker-2"][1]) == ["/dev/sda1"]
+    assert data["worker-3"] == (False, {"FAIL": "cannot connect"})
+
+def test_df_bad_output(make_config, make_node):
+    executor = Executor({"host1": "/dev/sda1 1000 750 250\n"})
+    results = DfController(make_config(df_options()), executor).df([make_node("bro", "standalone", "host1")])
+    assert results.nodes[0][1:] == (False, {"FAIL": "wrong number of lines from df helper"})
+
+def test_df_path_error(make_config, make_node):
+    paths = ["/bro/logdir", "/bro/bin"] + ["/bro/%s" % key for key in DIRS[3:]]
+    lines = ["error: not a directory: %s" % path if path == "/bro/spooldir" else "/dev/sda1 1000 750 250" for path in paths]
+    executor = Executor({"host1": "\n".join(lines) + "\n"})
+
+    # An error affects only the path, and the other file systems are still
+    # reported.
+    results = DfController(make_config(df_options()), executor).df([make_node("bro", "standalone", "host1")])
+    assert results.nodes[0][1] == False
+    assert sorted(results.nodes[0][2]) == ["/dev/sda1", "FAIL"]
+    assert results.nodes[0][2]["FAIL"] == "not a directory: /bro/spooldir"
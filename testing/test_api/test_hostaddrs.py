@@ -0,0 +1,112 @@
+import socket
+import time
+
+from BroControl.exceptions import ConfigurationError
+
+# Returns a configuration with the given host lookup options.
+def host_config(make_config, ttl=3600, timeout=5):
+    return make_config({"hostlookupttl": ttl, "hostlookuptimeout": timeout})
+
+# Replace socket.getaddrinfo with a function that returns addresses from a
+# dictionary (or raises an error for unknown host names), and counts lookups.
+def fake_dns(monkeypatch, addrs, lookups, delay=0):
+    def getaddrinfo(host, *args):
+        lookups.append(host)
+        time.sleep(delay)
+        if host not in addrs:
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return [(socket.AF_INET, 0, 0, "", (addrs[host], 0))]
+
+    monkeypatch.setattr(socket, "getaddrinfo", getaddrinfo)
+
+def test_resolve_hosts_cached(monkeypatch, make_config):
+    lookups = []
+    fake_dns(monkeypatch, {"a": "10.0.0.1", "b": "10.0.0.2"}, lookups)
+    cfg = host_config(make_config)
+
+    assert cfg._resolve_hosts(set(["a", "b"])) == {"a": ["10.0.0.1"], "b": ["10.0.0.2"]}
+    assert sorted(lookups) == ["a", "b"]
+
+    # The second time, the addresses come from the state database.
+    assert cfg._resolve_hosts(set(["a", "b"])) == {"a": ["10.0.0.1"], "b": ["10.0.0.2"]}
+    assert len(lookups) == 2
+
+def test_resolve_hosts_failed(monkeypatch, make_config):
+    lookups = []
+    fake_dns(monkeypatch, {}, lookups)
+    cfg = host_config(make_config)
+
+    result = cfg._resolve_hosts(set(["unknown"]))
+    assert isinstance(result["unknown"], ConfigurationError)
+    assert "hostname lookup failed for 'unknown'" in str(result["unknown"])
+
+def test_resolve_hosts_expired(monkeypatch, make_config):
+    lookups = []
+    fake_dns(monkeypatch, {"a": "10.0.0.2"}, lookups, delay=0.2)
+    cfg = host_config(make_config, ttl=60)
+    cfg.state_store.set_host_addrs([("a", ["10.0.0.1"], time.time() - 120)])
+
+    # The expired address is used without waiting for the lookup.
+    start = time.time()
+    assert cfg._resolve_hosts(set(["a"])) == {"a": ["10.0.0.1"]}
+    assert time.time() - start < 0.1
+    assert cfg.ui.messages == []
+
+    # The new address is stored once the lookup in the background is done.
+    cfg._store_host_lookups()
+    assert cfg.state_store.get_host_addrs("a")[0] == ["10.0.0.1"]
+
+    time.sleep(0.4)
+    cfg.flush_state()
+    assert lookups == ["a"]
+    assert cfg.state_store.get_host_addrs("a")[0] == ["10.0.0.2"]
+    assert cfg._resolve_hosts(set(["a"])) == {"a": ["10.0.0.2"]}
+    assert lookups == ["a"]
+
+def test_resolve_hosts_expired_failed(monkeypatch, make_config):
+    lookups = []
+    fake_dns(monkeypatch, {}, lookups)
+    cfg = host_config(make_config, ttl=60)
+    updated = time.time() - 120
+    cfg.state_store.set_host_addrs([("a", ["10.0.0.1"], updated)])
+
+    # The lookup fails, so the expired address remains in use.
+    assert cfg._resolve_hosts(set(["a"])) == {"a": ["10.0.0.1"]}
+    time.sleep(0.1)
+    cfg.flush_state()
+    assert lookups == ["a"]
+    assert cfg.state_store.get_host_addrs("a") == (["10.0.0.1"], updated)
+    assert cfg.ui.messages == []
+
+def test_resolve_hosts_no_cache(monkeypatch, make_config):
+    lookups = []
+    fake_dns(monkeypatch, {"a": "10.0.0.1"}, lookups)
+    cfg = host_config(make_config, ttl=0)
+
+    cfg._resolve_hosts(set(["a"]))
+    cfg._resolve_hosts(set(["a"]))
+    assert lookups == ["a", "a"]
+    assert cfg.state_store.get_host_addrs("a") is None
+
+def test_resolve_hosts_exception(monkeypatch, make_config):
+    def getaddrinfo(host, *args):
+        raise UnicodeError("label empty or too long")
+
+    monkeypatch.setattr(socket, "getaddrinfo", getaddrinfo)
+    cfg = host_config(make_config)
+
+    # Any error of the lookup is reported (instead of waiting forever).
+    result = cfg._resolve_hosts(set(["a..b"]))
+    assert isinstance(result["a..b"], ConfigurationError)
+    assert "label empty or too long" in str(result["a..b"])
+
+def test_resolve_hosts_wait(monkeypatch, make_config):
+    lookups = []
+    fake_dns(monkeypatch, {"a": "10.0.0.1"}, lookups, delay=1)
+    cfg = host_config(make_config, timeout=0.1)
+
+    # Without a cached address, we wait for HostLookupTimeout seconds.
+    start = time.time()
+    result = cfg._resolve_hosts(set(["a"]))
+    assert time.time() - start < 0.5
+    assert "timed out" in str(result["a"])
@@ -0,0 +1,23 @@
+import socket
+import sys
+
+from BroControl import ifaddrs
+
+def test_local_addrs():
+    addrs = ifaddrs.get_local_addrs()
+
+    if addrs is None:
+        # Not supported on this platform.
+        return
+
+    assert "127.0.0.1" in addrs
+    for addr in addrs:
+        assert "%" not in addr and "/" not in addr
+
+def test_format_addr_bsd_zone_id(monkeypatch):
+    monkeypatch.setattr(sys, "platform", "freebsd10")
+    packed = socket.inet_pton(socket.AF_INET6, "fe80:2::1")
+    assert ifaddrs._format_addr(socket.AF_INET6, packed) == "fe80::1"
+
+    monkeypatch.setattr(sys, "platform", "linux2")
+    assert ifaddrs._format_addr(socket.AF_INET6, packed) == "fe80:2::1"
@@ -0,0 +1,167 @@
+import fcntl
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from BroControl import config
+from BroControl import lock
+
+@pytest.fixture
+def lockfile(tmpdir, monkeypatch, make_config):
+    path = str(tmpdir.join("lock"))
+    monkeypatch.setattr(config, "Config", make_config({"lockfile": path, "havenfs": False}), raising=False)
+    yield path
+    assert lock.lockCount == 0
+
+# Start another process that holds a lock on the lock file for the given
+# number of seconds.  Returns once the process has the lock.
+def hold_lock(path, mode, secs):
+    code = ("import fcntl, os, sys, time\n"
+            "fd = os.open(sys.argv[1], os.O_RDWR | os.O_CREAT)\n"
+            "fcntl.flock(fd, %d)\n"
+            "os.write(fd, b'%%d' %% os.getpid())\n"
+            "sys.stdout.write('locked\\n')\n"
+            "sys.stdout.flush()\n"
+            "time.sleep(%f)\n" % (mode, secs))
+    proc = subprocess.Popen([sys.executable, "-c", code, path], stdout=subprocess.PIPE)
+    assert proc.stdout.readline().strip() == b"locked"
+    return proc
+
+# Returns True if another process could get a lock on the file right now.
+def can_lock(path, mode):
+    code = "import fcntl, os, sys\nfd = os.open(sys.argv[1], os.O_RDWR)\nfcntl.flock(fd, %d)\n" % (mode | fcntl.LOCK_NB)
+    return subprocess.call([sys.executable, "-c", code, path], stderr=subprocess.PIPE) == 0
+
+def test_lock_exclusive(lockfile, ui):
+    assert lock.lock(ui)
+    assert not can_lock(lockfile, fcntl.LOCK_SH)
+
+    with open(lockfile) as f:
+        assert f.read().strip() == str(os.getpid())
+
+    # Nested locking.
+    assert lock.lock(ui)
+    lock.unlock(ui)
+    assert not can_lock(lockfile, fcntl.LOCK_SH)
+
+    lock.unlock(ui)
+    assert can_lock(lockfile, fcntl.LOCK_EX)
+    assert ui.messages == []
+
+def test_lock_shared(lockfile, ui):
+    proc = hold_lock(lockfile, fcntl.LOCK_SH, 5)
+    try:
+        start = time.time()
+        assert lock.lock(ui, shared=True)
+        assert time.time() - start < 1
+        assert can_lock(lockfile, fcntl.LOCK_SH)
+        assert not can_lock(lockfile, fcntl.LOCK_EX)
+
+        # A shared lock cannot become exclusive.
+        assert not lock.lock(ui)
+        lock.unlock(ui)
+    finally:
+        proc.kill()
+        proc.wait()
+
+def test_lock_wait(lockfile, ui):
+    proc = hold_lock(lockfile, fcntl.LOCK_EX, 0.5)
+    try:
+        start = time.time()
+        assert lock.lock(ui)
+        assert time.time() - start < 2
+        assert ui.messages == ["waiting for lock (owned by PID %d) ..." % proc.pid]
+        lock.unlock(ui)
+    finally:
+        proc.wait()
+
+def test_lock_timeout(lockfile, monkeypatch, ui):
+    monkeypatch.setattr(lock, "_LOCK_TIMEOUT", 0.5)
+    proc = hold_lock(lockfile, fcntl.LOCK_EX, 1.5)
+    try:
+        assert not lock.lock(ui, showwait=False)
+    finally:
+        proc.wait()
+
+    # The lock that the waiting thread got in the meantime is released again.
+    time.sleep(0.2)
+    assert can_lock(lockfile, fcntl.LOCK_EX)
+
+def test_lock_nfs(lockfile, ui):
+    config.Config.set_option("havenfs", True)
+    assert lock.lock(ui, shared=True)
+    assert os.path.exists(lockfile)
+    assert lock.lockFd is None
+    lock.unlock(ui)
+    assert not os.path.exists(lockfile)
+
+def test_lock_nodes(lockfile, ui):
+    os.mkdir(lockfile + ".nodes")
+    proc = hold_lock(os.path.join(lockfile + ".nodes", "worker-1"), fcntl.LOCK_EX, 0.5)
+    try:
+        # Nodes other than worker-1 can be locked right away.
+        start = time.time()
+        assert lock.lock(ui, nodes=["Worker-2", "manager"])
+        assert time.time() - start < 0.3
+        assert sorted(lock.nodeLockFds) == ["manager", "worker-2"]
+        assert can_lock(lockfile, fcntl.LOCK_SH)
+        assert not can_lock(lockfile, fcntl.LOCK_EX)
+
+        # Nested locks can't add more nodes.
+        assert lock.lock(ui, nodes=["worker-2"])
+        assert not lock.lock(ui, nodes=["worker-1"])
+        lock.unlock(ui)
+        lock.unlock(ui)
+        assert lock.nodeLockFds == {}
+        assert can_lock(lockfile, fcntl.LOCK_EX)
+
+        # Locking worker-1 waits until the other process is done.
+        del ui.messages[:]
+        assert lock.lock(ui, nodes=["worker-1", "worker-2"])
+        assert time.time() - start > 0.3
+        assert ui.messages == ["waiting for lock of node worker-1 (owned by PID %d) ..." % proc.pid]
+        lock.unlock(ui)
+    finally:
+        proc.wait()
+
+def test_lock_nodes_exclusive(lockfile, ui):
+
+    # Within an exclusive lock, no nodes need to be locked.
+    assert lock.lock(ui)
+    assert lock.lock(ui, nodes=["worker-1"])
+    assert lock.nodeLockFds == {}
+    lock.unlock(ui)
+    lock.unlock(ui)
+
+def test_lock_required_nodes():
+    from BroControl import broctl
+
+    class Node:
+        def __init__(self, name):
+            self.name = name
+
+    class FakeBroCtl:
+        def __init__(self):
+            self.locked = []
+
+        def node_args(self, node_list=None):
+            return [Node(name) for name in (node_list or "manager worker-1").split()]
+
+        def lock(self, command=None, nodes=None):
+            self.locked.append((command, nodes))
+
+        def unlock(self):
+            pass
+
+        @broctl.lock_required_nodes
+        def cleanup(self, cleantmp=False, node_list=None):
+            return cleantmp
+
+    b = FakeBroCtl()
+    assert b.cleanup(True, "worker-2") == True
+    b.cleanup(node_list="worker-3")
+    b.cleanup()
+    assert b.locked == [("cleanup", ["worker-2"]), ("cleanup", ["worker-3"]), ("cleanup", ["manager", "worker-1"])]
@@ -0,0 +1,44 @@
+from BroControl import install
+
+def write_networks(tmpdir, text):
+    f = tmpdir.join("networks.cfg")
+    f.write(text)
+    return str(f)
+
+def test_aggregate_overlapping(tmpdir):
+    fname = write_networks(tmpdir, "10.0.0.0/8 big\n10.1.0.0/16 small\n10.1.0.0/16 small\n")
+    nets, count = install.aggregate_networks(fname)
+
+    assert count == 3
+    assert nets == [("10.0.0.0/8", "big; small")]
+
+def test_aggregate_adjacent_ipv6(tmpdir):
+    fname = write_networks(tmpdir, "# comment\n\n2001:db8::/33\n2001:db8:8000::/33 b\n")
+    nets, count = install.aggregate_networks(fname)
+
+    assert count == 2
+    assert nets == [("[2001:db8::]/32", "b")]
+
+def test_aggregate_order(tmpdir):
+    fname = write_networks(tmpdir, "fe80::/64 v6\n192.168.0.0/16 c\n10.0.0.0/8 a\n")
+    nets, count = install.aggregate_networks(fname)
+
+    assert count == 3
+    assert nets == [("10.0.0.0/8", "a"), ("192.168.0.0/16", "c"), ("[fe80::]/64", "v6")]
+
+def test_aggregate_many_tags(tmpdir):
+    fname = write_networks(tmpdir, "".join("10.0.%d.0/24 tag%d\n" % (i, i) for i in range(256)))
+    nets, count = install.aggregate_networks(fname)
+
+    assert count == 256
+    assert nets == [("10.0.0.0/16", "tag0; tag1; tag2 (and 253 more)")]
+
+def test_aggregate_invalid(tmpdir):
+    fname = write_networks(tmpdir, "10.0.0.0/8\n10.0.0.300/24 bad\n")
+
+    try:
+        install.aggregate_networks(fname)
+    except ValueError as err:
+        assert "line 2" in str(err)
+    else:
+        assert False
@@ -0,0 +1,98 @@
+import pytest
+
+from BroControl import node as node_mod
+
+def make_node():
+    n = node_mod.Node(None, "worker-1", {"type": "worker", "host": "localhost"})
+    n.env_vars = {"A": "1"}
+    n.count = 1
+    return n
+
+def test_defaults():
+    n = make_node()
+    assert n.type == "worker"
+    assert n.interface == ""
+    assert getattr(n, "aux_scripts", None) == ""
+    with pytest.raises(AttributeError):
+        n.unknown_key
+
+def test_set_attribute():
+    n = make_node()
+    n.addr = "127.0.0.1"
+    n.interface = "eth0"
+    assert n.addr == "127.0.0.1"
+    assert n.interface == "eth0"
+    assert ("addr", "127.0.0.1") in n.items()
+
+def test_copy_on_write():
+    n = make_node()
+    n2 = n.copy()
+    n2.name = "worker-2"
+    n2.count = 2
+    n2.env_vars["B"] = "2"
+
+    assert (n.name, n.count, n.env_vars) == ("worker-1", 1, {"A": "1"})
+    assert (n2.name, n2.count, n2.env_vars) == ("worker-2", 2, {"A": "1", "B": "2"})
+
+    # Changes to the original after copying must not affect the copy.
+    n.host = "otherhost"
+    n.env_vars["C"] = "3"
+    assert n2.host == "localhost"
+    assert n2.env_vars == {"A": "1", "B": "2"}
+
+def test_describe_memoised():
+    n = make_node()
+    desc = n.describe()
+    assert desc.startswith("       worker-1 - ")
+    assert "count=1 env_vars=A=1 " in desc
+    assert n.describe() is desc
+
+    n.count = 5
+    assert "count=5 " in n.describe()
+
+    # Reading a mutable value does not discard the description.
+    desc = n.describe()
+    env_vars = n.env_vars
+    assert n.describe() is desc
+
+    # A value modified in place is noticed as well.
+    env_vars["B"] = "2"
+    assert "env_vars=A=1,B=2 " in n.describe()
+    assert ("env_vars", "A=1,B=2") in n.items()
+
+    n.env_vars["C"] = "3"
+    assert "env_vars=A=1,B=2,C=3 " in n.describe()
+    assert n.to_dict()["env_vars"] == "A=1,B=2,C=3"
+
+    # Also in a copy of the node, which shares the value until it is read.
+    n2 = n.copy()
+    n2.describe()
+    n2.env_vars["D"] = "4"
+    assert "D=4" in n2.describe()
+    assert "D=4" not in n.describe()
+
+def test_items():
+    n = make_node()
+    items = n.items()
+    assert items == sorted(items)
+    assert ("env_vars", "A=1") in items
+    assert ("name", "worker-1") in items
+    assert [k for (k, v) in items if k.startswith("_")] == ["_config"]
+    assert "_config" not in n.describe()
+
+    d = n.to_dict()
+    assert d["name"] == "worker-1"
+    assert d["description"] == n.describe()
+
+def test_add_key(monkeypatch):
+    monkeypatch.setattr(node_mod.Node, "_keys", dict(node_mod.Node._keys))
+    n = make_node()
+    n.describe()
+
+    node_mod.Node.addKey("Test_Foo")
+    assert n.test_foo == ""
+    assert "test_foo= " in n.describe()
+
+    n2 = node_mod.Node(None, "worker-2", {"test_foo": "bar"})
+    assert n2.test_foo == "bar"
+    assert ("test_foo", "bar") in n2.items()
@@ -0,0 +1,89 @@
+import pytest
+
+from BroControl import node as node_mod
+from BroControl.exceptions import ConfigurationError
+
+def add(cfg, name, nodetype, count, host, addr):
+    n = node_mod.Node(cfg, name)
+    n.type = nodetype
+    n.count = count
+    n.host = host
+    n.addr = addr
+    cfg.nodestore.add_node(n)
+    return n
+
+def make_cluster(make_config):
+    cfg = make_config({"standalone": False})
+    # Add the nodes in an order that differs from the sorted order.
+    add(cfg, "worker-2", "worker", 2, "b", "10.0.0.2")
+    add(cfg, "proxy-1", "proxy", 1, "localhost", "127.0.0.1")
+    add(cfg, "worker-1", "worker", 1, "a", "10.0.0.1")
+    add(cfg, "manager", "manager", 1, "localhost", "127.0.0.1")
+    add(cfg, "worker-3", "worker", 3, "a", "10.0.0.1")
+    add(cfg, "logger", "logger", 1, "localhost", "127.0.0.1")
+    return cfg
+
+def names(nodes):
+    return [n.name for n in nodes]
+
+def test_nodes_sorted(make_config):
+    cfg = make_cluster(make_config)
+    assert names(cfg.nodes()) == ["logger", "manager", "proxy-1", "worker-1", "worker-2", "worker-3"]
+    assert names(cfg.nodes("all")) == names(cfg.nodes())
+    assert names(cfg.workers()) == ["worker-1", "worker-2", "worker-3"]
+    assert names(cfg.proxies()) == ["proxy-1"]
+    assert names(cfg.loggers()) == ["logger"]
+    assert cfg.manager().name == "manager"
+
+def test_nodes_by_name(make_config):
+    cfg = make_cluster(make_config)
+    assert names(cfg.nodes("worker-2")) == ["worker-2"]
+    assert names(cfg.nodes("manager")) == ["manager"]
+    assert cfg.nodes("unknown") == []
+
+def test_node_named_like_group(make_config):
+    cfg = make_config({"standalone": False})
+    add(cfg, "manager", "manager", 1, "localhost", "127.0.0.1")
+    add(cfg, "workers", "proxy", 1, "localhost", "127.0.0.1")
+    add(cfg, "worker-1", "worker", 1, "localhost", "127.0.0.1")
+    assert names(cfg.nodes("workers")) == ["workers", "worker-1"]
+
+def test_nodes_returns_copy(make_config):
+    cfg = make_cluster(make_config)
+    cfg.nodes().pop()
+    cfg.workers().pop()
+    assert len(cfg.nodes()) == 6
+    assert len(cfg.workers()) == 3
+
+def test_hosts(make_config):
+    cfg = make_cluster(make_config)
+    assert names(cfg.hosts()) == ["logger", "worker-1", "worker-2"]
+    assert names(cfg.hosts(exclude_local=True)) == ["worker-1", "worker-2"]
+    assert names(cfg.hosts("workers")) == ["worker-1", "worker-2"]
+
+def test_indexes_updated_on_add(make_config):
+    cfg = make_cluster(make_config)
+    assert len(cfg.workers()) == 3
+    add(cfg, "worker-0", "worker", 0, "c", "10.0.0.3")
+    assert names(cfg.workers()) == ["worker-0", "worker-1", "worker-2", "worker-3"]
+    assert names(cfg.nodestore.by_host("a")) == ["worker-1", "worker-3"]
+    assert names(cfg.nodestore.by_addr("10.0.0.3")) == ["worker-0"]
+
+def test_duplicate_name(make_config):
+    cfg = make_cluster(make_config)
+    with pytest.raises(ConfigurationError) as err:
+        add(cfg, "Worker-1", "worker", 4, "a", "10.0.0.1")
+    assert 'node name "Worker-1" is a duplicate of "worker-1"' in str(err.value)
+
+def test_dict_interface(make_config):
+    cfg = make_cluster(make_config)
+    store = cfg.nodestore
+    assert store["worker-1"].name == "worker-1"
+    assert "manager" in store
+    assert "worker-4" not in store
+    assert sorted(store) == sorted(store.keys())
+    assert sorted(store.keys()) == names(cfg.nodes())
+    assert dict(store.items())["proxy-1"] is store["proxy-1"]
+    assert store.get("worker-4", "none") == "none"
+    with pytest.raises(KeyError):
+        store["worker-4"]
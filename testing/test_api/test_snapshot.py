@@ -0,0 +1,75 @@
+import os
+import time
+
+from BroControl import snapshot
+from BroControl.snapshot import ConfigSnapshot
+
+def test_snapshot_get_set():
+    s = ConfigSnapshot(None)
+
+    assert s.get("a", [1]) is None
+    s.set("a", [1], {"x": [1, 2]})
+    assert s.get("a", [1]) == {"x": [1, 2]}
+    assert s.get("a", [2]) is None
+
+def test_snapshot_uncacheable():
+    s = ConfigSnapshot(None)
+
+    s.set("a", None, "value")
+    assert s.get("a", None) is None
+    assert not s.changed
+
+def test_snapshot_copy():
+    s = ConfigSnapshot(None)
+
+    value = {"x": [1, 2]}
+    s.set("a", ("k", 1), value)
+    value["x"].append(3)
+    assert s.get("a", ["k", 1]) == {"x": [1, 2]}
+
+    s.get("a", ["k", 1])["x"].append(4)
+    assert s.get("a", ["k", 1]) == {"x": [1, 2]}
+
+def test_snapshot_save_load(tmpdir):
+    path = str(tmpdir.join("snapshot.json"))
+
+    s = ConfigSnapshot(path)
+    s.set("a", ["key"], "value")
+    s.save()
+    assert not s.changed
+
+    s = ConfigSnapshot(path)
+    assert s.get("a", ["key"]) == "value"
+
+    s.clear()
+    assert not os.path.exists(path)
+    assert ConfigSnapshot(path).get("a", ["key"]) is None
+
+    # Clearing a missing snapshot is not an error.
+    s.clear()
+
+def test_snapshot_corrupt(tmpdir):
+    f = tmpdir.join("snapshot.json")
+    f.write("{not json")
+
+    s = ConfigSnapshot(str(f))
+    assert s.get("a", ["key"]) is None
+
+def test_snapshot_file_id(tmpdir):
+    f = tmpdir.join("node.cfg")
+    f.write("[bro]\n")
+    path = str(f)
+
+    # Recently modified files are not cached.
+    assert snapshot.file_id(path) is None
+
+    mtime = time.time() - 60
+    os.utime(path, (mtime, mtime))
+    fid = snapshot.file_id(path)
+    assert fid is not None
+
+    f.write("[bro]\ntype=standalone\n")
+    os.utime(path, (mtime + 1, mtime + 1))
+    assert snapshot.file_id(path) not in (None, fid)
+
+    assert snapshot.file_id(str(tmpdir.join("missing"))) is None
@@ -42,3 +42,225 @@ def test_state_items():
 
     assert d["a"] == 1
     assert d["b"] == "two"
+
+def test_state_set_many():
+    s = SqliteState(":memory:")
+    s.set_many([("a", 1), ("b", "two")])
+
+    assert s.get("a") == 1
+    assert s.get("b") == "two"
+
+def test_state_transaction(tmpdir):
+    path = str(tmpdir.join("state.db"))
+    s = SqliteState(path)
+    s.begin()
+    s.begin()
+    s.set("a", 1)
+    s.commit()
+
+    # Nothing is visible to other connections until the outermost commit.
+    other = SqliteState(path)
+    assert other.get("a") == None
+
+    s.commit()
+    assert other.get("a") == 1
+
+def test_state_wal(tmpdir):
+    s = SqliteState(str(tmpdir.join("state.db")))
+    s.c.execute("PRAGMA journal_mode")
+    assert s.c.fetchone()[0] == "wal"
+    s.db.close()
+
+    s = SqliteState(str(tmpdir.join("state.db")), wal=False)
+    s.c.execute("PRAGMA journal_mode")
+    assert s.c.fetchone()[0] == "delete"
+
+def test_state_batch(tmpdir, make_config):
+    path = str(tmpdir.join("state.db"))
+    cfg = make_config(state_store=SqliteState(path))
+    other = SqliteState(path)
+
+    cfg.begin_state_batch()
+    cfg.set_state("a", 1)
+    cfg.set_state("B", 2)
+    assert cfg.get_state("a") == 1
+    assert other.get("a") == None
+
+    # Reading the state again keeps the changes not yet written.
+    cfg.read_state()
+    assert cfg.get_state("b") == 2
+
+    cfg.end_state_batch()
+    assert other.get("a") == 1
+    assert other.get("b") == 2
+
+def test_state_changes():
+    s = SqliteState(":memory:")
+    assert s.changes() == ([], 0)
+
+    s.set("a", 1)
+    s.set_many([("b", 2), ("c", 3)])
+    items, version = s.changes()
+    assert sorted(items) == [("a", 1), ("b", 2), ("c", 3)]
+    assert version == s.version()
+
+    # Nothing has changed.
+    assert s.changes(version) == ([], version)
+
+    s.set("b", 20)
+    items, newversion = s.changes(version)
+    assert items == [("b", 20)]
+    assert newversion > version
+
+def test_state_version_migration(tmpdir):
+    import sqlite3
+
+    # A state database written by an older version of broctl.
+    path = str(tmpdir.join("state.db"))
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE state (key TEXT PRIMARY KEY NOT NULL, value TEXT)")
+    db.execute("INSERT INTO state VALUES ('a', '1')")
+    db.commit()
+    db.close()
+
+    s = SqliteState(path)
+    assert s.changes() == ([("a", 1)], 0)
+
+    s.set("b", 2)
+    assert s.changes(0) == ([("b", 2)], 1)
+
+def test_read_state_incremental(tmpdir, make_config):
+    path = str(tmpdir.join("state.db"))
+    other = SqliteState(path)
+    other.set("a", 1)
+    other.set("b", 2)
+
+    cfg = make_config(state_store=SqliteState(path))
+    cfg.read_state()
+    assert cfg.get_state("a") == 1
+
+    other.set("b", 3)
+    other.set("c", 4)
+    cfg.read_state()
+    assert (cfg.get_state("a"), cfg.get_state("b"), cfg.get_state("c")) == (1, 3, 4)
+
+def test_node_state():
+    s = SqliteState(":memory:")
+    assert s.node_changes() == ({}, 0)
+
+    s.set_node_states([("bro", {"pid": 123, "host": "localhost", "expect_running": True})])
+    rows, version = s.node_changes()
+    assert rows == {"bro": {"pid": 123, "host": "localhost", "crashed": None, "expect_running": True, "port": None}}
+    assert s.node_changes(version) == ({}, version)
+
+    assert s.nodes_with_pid() == [("bro", 123, "localhost")]
+    assert s.nodes_expected_running() == ["bro"]
+
+def test_node_state_migration(tmpdir):
+    import sqlite3
+
+    # Node state written by an older version of broctl.
+    path = str(tmpdir.join("state.db"))
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE state (key TEXT PRIMARY KEY NOT NULL, value TEXT)")
+    db.executemany("INSERT INTO state VALUES (?, ?)", [
+        ("worker-1-pid", "123"), ("worker-1-host", '"localhost"'),
+        ("worker-1-expect-running", "true"), ("worker-1-crashed", "false"),
+        ("worker-1-port", "47763"), ("alive-localhost", "1"),
+        ("plugin.foo.bar-port", "3")])
+    db.commit()
+    db.close()
+
+    s = SqliteState(path)
+    assert s.node_changes()[0] == {"worker-1": {"pid": 123, "host": "localhost", "crashed": False, "expect_running": True, "port": 47763}}
+    assert sorted(k for (k, _) in s.items()) == ["alive-localhost", "plugin.foo.bar-port"]
+
+    # Opening the database again doesn't migrate anything.
+    s.db.close()
+    s = SqliteState(path)
+    assert len(s.node_changes()[0]) == 1
+
+def test_node_state_batch(tmpdir, make_config):
+    path = str(tmpdir.join("state.db"))
+    cfg = make_config(state_store=SqliteState(path))
+    other = SqliteState(path)
+
+    cfg.begin_state_batch()
+    cfg.set_node_state("Worker-1", pid=123, host="localhost")
+    cfg.set_node_state("worker-1", expect_running=True)
+    assert cfg.get_node_state("WORKER-1", "pid") == 123
+    assert other.node_changes() == ({}, 0)
+
+    # Queries see the changes of the current batch, which are committed
+    # right away.
+    assert cfg.nodes_with_pid() == [("worker-1", 123, "localhost")]
+    assert cfg.nodes_expected_running() == set(["worker-1"])
+    assert other.node_changes()[0]["worker-1"]["pid"] == 123
+
+    # The state database is not left locked until the end of the batch.
+    SqliteState(path, timeout=0).set("a", 1)
+    cfg.set_node_state("worker-1", crashed=False)
+
+    cfg.end_state_batch()
+    assert other.node_changes()[0]["worker-1"]["expect_running"] == True
+
+    other.set_node_states([("worker-1", {"pid": None, "host": "localhost"})])
+    cfg.read_state()
+    assert cfg.get_node_state("worker-1", "pid") == None
+    assert cfg.get_node_state("worker-2", "pid") == None
+
+def test_node_state_concurrent(tmpdir, make_config):
+    path = str(tmpdir.join("state.db"))
+    cfg = make_config(state_store=SqliteState(path))
+    other = make_config(state_store=SqliteState(path))
+    cfg.set_node_state("worker-1", pid=123, host="localhost", crashed=False)
+    cfg.read_state()
+    other.read_state()
+
+    # Another process changes the node state after it was read.
+    other.set_node_state("worker-1", crashed=True, port=47761)
+
+    # Setting a value that seems unchanged still writes it, and columns
+    # that were not set are not overwritten.
+    cfg.begin_state_batch()
+    cfg.set_node_state("worker-1", crashed=False)
+    cfg.end_state_batch()
+
+    rows = other.state_store.node_changes()[0]
+    assert rows["worker-1"] == {"pid": 123, "host": "localhost", "crashed": False, "expect_running": None, "port": 47761}
+
+def test_journal():
+    s = SqliteState(":memory:")
+    assert s.phase_percentile("running", 95, "started") == None
+
+    entries = [{"time": 1000 + i, "node": "worker-%d" % i, "type": "worker", "event": "started", "running": i / 10.0} for i in range(1, 21)]
+    entries.append({"time": 1000, "node": "manager", "type": "manager", "event": "started", "running": 100.0})
+    entries.append({"time": 1100, "node": "worker-3", "type": "worker", "event": "stopped", "terminate": 60.0, "killed": True})
+    s.add_journal(entries)
+
+    assert s.phase_percentile("running", 95, "started", "worker") == 1.9
+    assert s.phase_percentile("running", 50, "started", "worker", since=1011) == 1.5
+    assert s.phase_percentile("running", 100, "started") == 100.0
+    assert s.killed_nodes() == ["worker-3"]
+    assert s.killed_nodes(since=1200) == []
+
+    journal = s.journal(node="worker-3")
+    assert [e["event"] for e in journal] == ["started", "stopped"]
+    assert journal[1]["killed"] == True and journal[1]["running"] == None
+
+def test_journal_batch(make_config):
+    class Node:
+        name = "worker-1"
+        type = "worker"
+
+    cfg = make_config()
+    cfg.begin_state_batch("start")
+    cmdid = cfg.cmdid
+    cfg.add_journal_entry(Node(), "started", mkdir=0.5)
+    assert cfg.state_store.journal() == []
+
+    cfg.end_state_batch()
+    journal = cfg.state_store.journal()
+    assert len(journal) == 1
+    assert (journal[0]["cmdid"], journal[0]["command"], journal[0]["mkdir"]) == (cmdid, "start", 0.5)
+    assert cfg.cmdid == None
@@ -0,0 +1,52 @@
+import os
+
+from BroControl import statslog
+
+DAY = 86400.0
+
+def read_all(path):
+    lines = []
+    for seg in statslog.segments(path):
+        with open(seg) as f:
+            lines += f.readlines()
+    return lines
+
+def test_statslog_append(tmpdir):
+    path = str(tmpdir.join("stats.log"))
+    statslog.append(path, ["100.0 manager parent cpu 1\n",
+                           "%s manager parent cpu 2\n" % (DAY + 1),
+                           "bad line\n"])
+    statslog.append(path, ["%s manager parent cpu 3\n" % (DAY + 2)])
+
+    assert statslog.segments(path) == [path + ".1970-01-01", path + ".1970-01-02"]
+    assert os.readlink(path) == "stats.log.1970-01-02"
+
+    with open(path) as f:
+        assert f.read().splitlines() == ["86401.0 manager parent cpu 2", "bad line", "86402.0 manager parent cpu 3"]
+
+    assert len(read_all(path)) == 4
+
+def test_statslog_split(tmpdir):
+    # A stats.log file of an older version is split into segments.
+    path = str(tmpdir.join("stats.log"))
+    with open(path, "w") as f:
+        f.write("100.0 bro action old\n%s bro action new\n" % (2 * DAY))
+
+    assert statslog.segments(path) == [path]
+    assert read_all(path) == ["100.0 bro action old\n", "172800.0 bro action new\n"]
+
+    assert statslog.expire(path, 2 * DAY + 100) == 1
+    assert statslog.segments(path) == [path + ".1970-01-03"]
+    assert os.path.islink(path)
+    assert read_all(path) == ["172800.0 bro action new\n"]
+
+def test_statslog_expire(tmpdir):
+    path = str(tmpdir.join("stats.log"))
+    statslog.append(path, ["%s bro action %d\n" % (i * DAY, i) for i in range(5)])
+
+    assert statslog.expire(path, 2.5 * DAY) == 2
+    assert [line.split()[3] for line in read_all(path)] == ["2", "3", "4"]
+
+    assert statslog.expire(path, 10 * DAY) == 3
+    assert statslog.segments(path) == []
+    assert not os.path.lexists(path)
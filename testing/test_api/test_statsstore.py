@@ -0,0 +1,147 @@
+import os
+
+from BroControl import py3bro
+from BroControl.statsstore import StatsStore, export_csv, import_statslog, pick_resolution
+
+DAY = 86400.0
+
+def test_statsstore_query(tmpdir):
+    s = StatsStore(str(tmpdir))
+    s.append([(100.0, "worker-1", {"parent-cpu": 5, "parent-vsize": 1024}),
+              (100.0, "worker-2", {"parent-cpu": 6}),
+              (400.0, "worker-1", {"parent-cpu": 7})])
+
+    assert s.query("worker-1", "parent-cpu") == [(100.0, 5.0), (400.0, 7.0)]
+    assert s.query("worker-1", "parent-vsize") == [(100.0, 1024.0)]
+    assert s.query("worker-1", "parent-cpu", 200, 400) == []
+    assert s.query("worker-1", "parent-cpu", 100, 401) == [(100.0, 5.0), (400.0, 7.0)]
+    assert s.query("worker-3", "parent-cpu") == []
+    assert s.metrics("worker-1") == ["parent-cpu", "parent-vsize"]
+
+def test_statsstore_days(tmpdir):
+    s = StatsStore(str(tmpdir))
+    s.append([(i * 3600.0, "manager", {"parent-cpu": i}) for i in range(72)])
+
+    assert s.days() == ["1970-01-01", "1970-01-02", "1970-01-03"]
+    assert len(s.query("manager", "parent-cpu")) == 72
+    assert s.query("manager", "parent-cpu", DAY - 3600, DAY + 3600) == [(DAY - 3600, 23.0), (DAY, 24.0)]
+
+    assert s.expire(2 * DAY) == 2
+    assert s.query("manager", "parent-cpu") == [(2 * DAY + i * 3600.0, 48.0 + i) for i in range(24)]
+
+def test_statsstore_append(tmpdir):
+    s = StatsStore(str(tmpdir))
+    s.append([(100.0, "$total", {"interface-mbps": 1.5})])
+
+    # Old data is ignored, new metrics get new columns.
+    s.append([(100.0, "$total", {"interface-mbps": 9}),
+              (200.0, "$total", {"interface-mbps": 2.5, "interface-pkts": 10})])
+
+    assert s.query("$total", "interface-mbps") == [(100.0, 1.5), (200.0, 2.5)]
+    assert s.query("$total", "interface-pkts") == [(200.0, 10.0)]
+
+    # An incomplete record at the end of a segment is overwritten.
+    path = os.path.join(str(tmpdir), "1970-01-01", "_total.dat")
+    with open(path, "ab") as f:
+        f.write(b"\0\0\0")
+
+    assert len(s.query("$total", "interface-mbps")) == 2
+    s.append([(300.0, "$total", {"interface-mbps": 3.5})])
+    assert s.query("$total", "interface-mbps") == [(100.0, 1.5), (200.0, 2.5), (300.0, 3.5)]
+
+def test_statsstore_import(tmpdir):
+    statslog = tmpdir.join("stats.log")
+    statslog.write("100.5 manager action started\n"
+                   "200.5 manager parent cmd bro\n"
+                   "200.5 manager parent cpu 3\n"
+                   "200.5 manager parent vsize 1000\n"
+                   "200.5 worker-1 error error top failed\n"
+                   "200.5 worker-1 interface mbps 0.5\n"
+                   "500.5 manager parent cpu 4\n")
+
+    s = StatsStore(str(tmpdir.join("store")))
+
+    # Read a few lines at a time, so that records span chunks.
+    assert import_statslog(s, str(statslog), 30) == 3
+    assert s.query("manager", "parent-cpu") == [(200.5, 3.0), (500.5, 4.0)]
+    assert s.query("manager", "parent-vsize") == [(200.5, 1000.0)]
+    assert s.query("worker-1", "interface-mbps") == [(200.5, 0.5)]
+
+    # Importing again doesn't change anything.
+    import_statslog(s, str(statslog))
+    assert s.query("manager", "parent-cpu") == [(200.5, 3.0), (500.5, 4.0)]
+
+def test_statsstore_import_interleaved(tmpdir):
+    # At each time, the interface lines of all nodes follow their top
+    # lines.
+    nodes = ("worker-1", "worker-2")
+    statslog = tmpdir.join("stats.log")
+    statslog.write("".join(["".join(["%d.5 %s parent cpu %d\n%d.5 %s parent vsize 1000\n" % (t, node, t, t, node) for node in nodes]) +
+                            "".join(["%d.5 %s interface mbps %d\n" % (t, node, t) for node in nodes])
+                            for t in (100, 200)]))
+
+    for chunksize in (1, 40, 1000):
+        s = StatsStore(str(tmpdir.join("store-%d" % chunksize)))
+        assert import_statslog(s, str(statslog), chunksize) == 4
+
+        for node in nodes:
+            assert s.query(node, "parent-cpu") == [(100.5, 100.0), (200.5, 200.0)]
+            assert s.query(node, "interface-mbps") == [(100.5, 100.0), (200.5, 200.0)]
+            assert [t for (t, vals) in s.records(node)] == [100.5, 200.5]
+
+def test_statsstore_rollups(tmpdir):
+    s = StatsStore(str(tmpdir))
+
+    # Two days of 5-minute data, and the first record of the third day.
+    s.append([(i * 300.0, "worker-1", {"parent-cpu": i % 12}) for i in range(2 * 288 + 1)])
+    s.update_rollups(["worker-1", "worker-2"])
+
+    hourly = s.rollup("1h")
+    assert hourly.days() == ["1970-01"]
+    assert len(hourly.query("worker-1", "parent-cpu:avg")) == 48
+    assert hourly.query("worker-1", "parent-cpu:min", 0, 3600) == [(0.0, 0.0)]
+    assert hourly.query("worker-1", "parent-cpu:avg", 0, 3600) == [(0.0, 5.5)]
+    assert hourly.query("worker-1", "parent-cpu:max", 0, 3600) == [(0.0, 11.0)]
+    assert s.rollup("1d").query("worker-1", "parent-cpu:max") == [(0.0, 11.0), (DAY, 11.0)]
+
+    # Only complete periods are rolled up, and only once.
+    s.append([(2 * DAY + 3600, "worker-1", {"parent-cpu": 20})])
+    s.update_rollups(["worker-1"])
+    assert hourly.query("worker-1", "parent-cpu:max", 2 * DAY) == [(2 * DAY, 0.0)]
+    assert len(hourly.query("worker-1", "parent-cpu:avg")) == 49
+
+    # Raw data can expire, the rollups are kept.
+    s.expire(2 * DAY)
+    assert s.query("worker-1", "parent-cpu", 0, DAY) == []
+    assert len(hourly.query("worker-1", "parent-cpu:avg")) == 49
+
+    s.expire_rollups(400 * DAY)
+    assert hourly.days() == []
+
+def test_statsstore_query_span(tmpdir):
+    s = StatsStore(str(tmpdir))
+    s.append([(i * 300.0, "manager", {"parent-cpu": 1, "parent-vsize": 2}) for i in range(3 * 288)])
+    s.update_rollups(["manager"])
+
+    assert pick_resolution(0, 3 * 3600) is None
+    assert pick_resolution(0, 30 * DAY) == "1h"
+    assert pick_resolution(0, 365 * DAY) == "1d"
+    assert pick_resolution(0, 3600, rawfirst=100) == "1h"
+
+    assert s.query_span("manager", "parent-cpu", 0, 3600)[0] is None
+    rollup, values = s.query_span("manager", "parent-cpu", 0, 3 * DAY, maxpoints=100)
+    assert rollup == "1h"
+    assert len(values) == 71
+
+    out = py3bro.io.StringIO()
+    export_csv(s, out, "manager", [("CPU", ["parent-cpu"]), ("Both", ["parent-cpu", "parent-vsize"])], 0, 1000, 100)
+    assert out.getvalue() == "time,CPU,Both\n0.0,1,3\n300.0,1,3\n600.0,1,3\n900.0,1,3\n"
+
+    assert s.time_range("manager") == (0.0, (3 * 288 - 1) * 300.0)
+    assert s.time_range("worker-1") is None
+
+    # Longer spans are written from a rollup.
+    out = py3bro.io.StringIO()
+    export_csv(s, out, "manager", [("Memory", ["parent-vsize"])], 0, 3 * DAY, 100)
+    lines = out.getvalue().splitlines()
+    assert (len(lines), lines[:3]) == (72, ["time,Memory", "0.0,2", "3600.0,2"])
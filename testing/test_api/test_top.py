@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from BroControl import control
+
+HELPER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "bin", "helpers", "proc-stats")
+
+def test_parse_proc_stats():
+    output = ("proc 100 1 4096000 2048000 12.6 3.0 0.5 - - bro\n"
+              "thread 100 100 10.0 bro\n"
+              "thread 100 101 2.6 bro:worker 1\n"
+              "proc 102 100 1024000 512000 0.0 1.0 0.0 10.0 20.0 bro\n")
+
+    procs = control._parse_proc_stats(output)
+    assert sorted(procs) == [100, 102]
+    assert procs[100] == {"pid": 100, "ppid": 1, "vsize": 4096000, "rss": 2048000, "cpu": "13",
+                          "cswch": 3.0, "nvcswch": 0.5, "cmd": "bro",
+                          "threads": [{"tid": 100, "cpu": 10.0, "name": "bro"},
+                                      {"tid": 101, "cpu": 2.6, "name": "bro:worker 1"}]}
+    assert procs[102]["rdbytes"] == 10.0
+    assert procs[102]["wrbytes"] == 20.0
+
+    for output in ("proc 100 1\n", "thread 100 100 10.0 bro\n", "usage: proc-stats <interval> <pid> ...\n"):
+        with pytest.raises((KeyError, IndexError, ValueError)):
+            control._parse_proc_stats(output)
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/task"), reason="requires Linux /proc")
+def test_proc_stats_helper():
+    child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(5)"])
+    try:
+        out = subprocess.check_output([sys.executable, HELPER, "0.2", str(os.getpid()), "999999999"])
+    finally:
+        child.kill()
+        child.wait()
+
+    procs = control._parse_proc_stats(out.decode())
+    assert procs[os.getpid()]["rss"] > 0
+    assert procs[child.pid]["ppid"] == os.getpid()
+    assert [t["tid"] for t in procs[child.pid]["threads"]] == [child.pid]
+    assert 999999999 not in procs